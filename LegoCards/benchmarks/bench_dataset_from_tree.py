@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - compare time and peak memory of making data_obs from a tree with
+#      get_dataset_from_tree (CopyTree of the selection + RooDataSet from tree),
+#      get_dataset_from_tree_columnar (pruned branches, TTree::Draw to NumPy,
+#      compiled fill) and get_dataset_from_tree_streaming (chunked columnar,
+#      unbinned and binned).
+#    - the input is a generated tree with the observables and unused branches.
+#    - the peak RSS of the binned streaming case should not grow with --entries.
+#-------------------------------------------------------------------------------
+
+import sys, os, time, optparse, tempfile, json, resource
+import multiprocessing
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+OBSERVABLES = ['mass4l', 'KD']
+SELECTION = 'mass4l > 110 && mass4l < 140'
+BINNING = {'mass4l': [30, 110., 140.], 'KD': [10, 0., 1.]}
+#(label, method, extra keyword arguments)
+CASES = [('CopyTree', 'get_dataset_from_tree', {}),
+         ('columnar', 'get_dataset_from_tree_columnar', {}),
+         ('streaming', 'get_dataset_from_tree_streaming', {}),
+         ('streaming binned', 'get_dataset_from_tree_streaming', {'binning': BINNING})]
+
+
+def write_tree(file_name, n_entries, n_unused_branches):
+    """
+    Write tree passedEvents with the observables and n_unused_branches other
+    branches (like the many branches of real ntuples which are not needed).
+    """
+    from ROOT import TFile, TTree
+    branch_names = OBSERVABLES + ['unused_{0}'.format(i) for i in range(n_unused_branches)]
+    values = np.random.RandomState(1234).uniform(0., 1., (n_entries, len(branch_names)))
+    values[:, 0] = 100. + 60. * values[:, 0]
+    txt_name = file_name + '.txt'
+    np.savetxt(txt_name, values, fmt = '%.8g')
+    root_file = TFile.Open(file_name, 'RECREATE')
+    tree = TTree('passedEvents', 'passedEvents')
+    tree.ReadFile(txt_name, ':'.join('{0}/D'.format(name) for name in branch_names))
+    tree.Write()
+    root_file.Close()
+    os.remove(txt_name)
+
+
+def _run_case(case, tree_path, queue):
+    from lib.RooFit.ToyDataSetManager import ToyDataSetManager
+    label, method_name, kwargs = case
+    dataset_tool = ToyDataSetManager()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    #the selection is the third argument of all the methods
+    dataset = getattr(dataset_tool, method_name)(tree_path, OBSERVABLES, SELECTION,
+                                                 basket = False, **kwargs)
+    elapsed = time.time() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in kB on linux
+    queue.put({'case': label, 'time_s': elapsed, 'n_selected': int(round(dataset.sumEntries())),
+               'peak_rss_increase_MB': (rss_after - rss_before) / 1024.})
+
+
+def measure(case, tree_path):
+    """
+    Run the case in a fresh process so that peak RSS and opened files are not shared.
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = _run_case,
+                                      args = (case, tree_path, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def parseOptions():
+
+    usage = ('usage: %prog [options] \n'
+             + '%prog -h for help')
+    parser = optparse.OptionParser(usage)
+    parser.add_option('-n', '--entries', dest='n_entries', type='int', default=1000000)
+    parser.add_option('', '--unused-branches', dest='n_unused_branches', type='int', default=20)
+    parser.add_option('', '--max-memory-MB', dest='max_memory_MB', type='float', default=50,
+                      help='max_memory_MB of the streaming cases.')
+    parser.add_option('-o', '--output', dest='output', type='string', default=None,
+                      help='Write results to this json file.')
+
+    global opt, args
+    (opt, args) = parser.parse_args()
+
+
+def main():
+    parseOptions()
+    fd, root_file = tempfile.mkstemp(suffix='.root', prefix='bench_dataset_')
+    os.close(fd)
+    try:
+        write_tree(root_file, opt.n_entries, opt.n_unused_branches)
+        results = []
+        for label, method_name, kwargs in CASES:
+            if method_name == 'get_dataset_from_tree_streaming':
+                kwargs = dict(kwargs, max_memory_MB = opt.max_memory_MB)
+            results.append(measure((label, method_name, kwargs), root_file + '/passedEvents'))
+    finally:
+        os.remove(root_file)
+
+    #the binning covers the whole selected range
+    assert len(set(result['n_selected'] for result in results)) == 1, (
+        'The methods select different number of entries.')
+    print 'Tree entries: {0}, selected: {1}'.format(opt.n_entries, results[0]['n_selected'])
+    print '{0:<20} {1:>10} {2:>22}'.format('case', 'time [s]', 'peak RSS increase [MB]')
+    for result in results:
+        print '{0:<20} {1:>10.2f} {2:>22.1f}'.format(result['case'], result['time_s'],
+                                                  result['peak_rss_increase_MB'])
+    if opt.output:
+        with open(opt.output, 'w') as fd:
+            json.dump({'n_entries': opt.n_entries, 'results': results}, fd, indent=4)
+        print 'Results written to {0}'.format(opt.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - generate synthetic configurations shaped like
+#      configs/more_complicated_datacard_8TeV_2e2mu.yaml, scaling the number
+#      of categories, processes, nuisances and INSERTed systematics files
+#    - time the config parsing, systematics assembly, txt card writing and
+#      (if ROOT is available) the workspace building.
+#    - everything is generated locally, no network or external inputs needed.
+#-------------------------------------------------------------------------------
+
+import sys, os, time, optparse, tempfile, shutil, json, itertools, random
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib.util.UniversalConfigParser import UniversalConfigParser
+from lib.util.UniversalConfigParser import parsed_cfg_cache, flat_index_cache
+
+MASS_RANGE = (105., 140.)
+
+
+def get_process_names(n_processes):
+    """
+    About a third of the processes are signals (with analytic shapes),
+    the rest are backgrounds (with templates).
+    """
+    n_signals = max(1, n_processes / 3)
+    return (['sig_{0}'.format(i) for i in range(n_signals)],
+            ['bkg_{0}'.format(i) for i in range(n_processes - n_signals)])
+
+
+def write_common_setup(cfg_dir):
+    with open(os.path.join(cfg_dir, 'common_setup.yaml'), 'w') as fd:
+        fd.write('COMMON_SETUP: &COMMON_SETUP\n'
+                 '    reserved_sections: [observation, functions_and_definitions, setup,\n'
+                 '                        category, systematics, processes]\n'
+                 '    functions_and_definitions:\n'
+                 '        - lumi_8[19.712]\n')
+
+
+def write_inputs(inputs_dir, categories, signals, backgrounds, n_nuisances, insert_fanout):
+    """
+    Yields, signal shape parameters and systematics. The nuisances are
+    split among insert_fanout files, each INSERTed by every category.
+    """
+    rnd = random.Random(1234)
+    with open(os.path.join(inputs_dir, 'yields.yaml'), 'w') as fd:
+        fd.write("mass_range: '{0},{1}'\n".format(*MASS_RANGE))
+        for category in categories:
+            fd.write('{0}:\n'.format(category))
+            for p_name in signals + backgrounds:
+                fd.write('    {0}: {1:.5f}\n'.format(p_name, rnd.uniform(0.1, 10.)))
+
+    with open(os.path.join(inputs_dir, 'shapes.yaml'), 'w') as fd:
+        for category in categories:
+            fd.write('{0}:\n'.format(category))
+            fd.write("    mean: '{0:.4f}+(0.997)*(@0-125)'\n".format(rnd.uniform(124.5, 125.5)))
+            fd.write("    sigma: '{0:.4f}+(0.014)*(@0-125)'\n".format(rnd.uniform(1., 2.)))
+
+    processes = signals + backgrounds
+    for i_file in range(insert_fanout):
+        with open(os.path.join(inputs_dir, 'systematics_{0}.yaml'.format(i_file)), 'w') as fd:
+            for i_sys in range(i_file, n_nuisances, insert_fanout):
+                fd.write('sys_{0}:\n'.format(i_sys))
+                for category in categories:
+                    fd.write('    {0}:\n'.format(category))
+                    if i_sys % 10 == 9:
+                        fd.write('        type: param 0.0 1 [-3,3]\n')
+                        continue
+                    fd.write('        type: lnN\n')
+                    for i_proc, p_name in enumerate(processes):
+                        if (i_proc + i_sys) % 3:
+                            fd.write('        {0}: {1:.3f}\n'.format(p_name, rnd.uniform(1.01, 1.1)))
+
+
+def write_datacard_cfg(cfg_file, categories, signals, backgrounds, insert_fanout, n_events):
+    lines = ['---']
+    for category in categories:
+        lines += ['{0}:'.format(category),
+                  '    setup: INSERT(common_setup.yaml:COMMON_SETUP)',
+                  '    category: {0}'.format(category),
+                  '    observation:',
+                  '        rate: {0}'.format(n_events),
+                  '        source:',
+                  '            path: inputs/data_observed.root/passedEvents',
+                  '            selection: (mass4l>{0} && mass4l<{1})'.format(*MASS_RANGE),
+                  '            observables:',
+                  '                - mass4l[INSERT(inputs/yields.yaml:mass_range)]',
+                  '    functions_and_definitions:',
+                  '        - MH[125,105,140]',
+                  '        - r_{0}[1,0,4]'.format(category),
+                  '    systematics:']
+        lines += ['        - INSERT(inputs/systematics_{0}.yaml:*:{1}:*:*)'.format(i_file, category)
+                  for i_file in range(insert_fanout)]
+        lines += ['    processes:']
+        for p_name in signals:
+            lines += ['        {0}:'.format(p_name),
+                      '            is_signal: 1',
+                      '            rate: INSERT(inputs/yields.yaml:{0}:{1})'.format(category, p_name),
+                      '            functions_and_definitions:',
+                      "                - expr::{0}_norm('@0',r_{1})".format(p_name, category),
+                      "                - expr::mean_{0}('INSERT(inputs/shapes.yaml:{0}:mean)',MH)"
+                      .format(category),
+                      "                - expr::sigma_{0}('INSERT(inputs/shapes.yaml:{0}:sigma)',MH)"
+                      .format(category),
+                      '            shape: "RooGaussian::{0}(mass4l, mean_{1}, sigma_{1})"'
+                      .format(p_name, category),
+                      '            systematics:',
+                      '                extra_sys_{0}: lnN 1.03'.format(p_name)]
+        for p_name in backgrounds:
+            lines += ['        {0}:'.format(p_name),
+                      '            is_signal: 0',
+                      '            rate: INSERT(inputs/yields.yaml:{0}:{1})'.format(category, p_name),
+                      '            shape: Template::{0}(mass4l, inputs/templates.root/h_{0})'
+                      .format(p_name)]
+    with open(cfg_file, 'w') as fd:
+        fd.write('\n'.join(lines) + '\n')
+
+
+def write_root_inputs(inputs_dir, backgrounds, n_events):
+    """
+    Tree with observed events and one histogram template per background.
+    """
+    import ROOT
+    from array import array
+    rnd = ROOT.TRandom3(1234)
+
+    data_file = ROOT.TFile(os.path.join(inputs_dir, 'data_observed.root'), 'RECREATE')
+    tree = ROOT.TTree('passedEvents', 'passedEvents')
+    mass4l = array('d', [0.])
+    tree.Branch('mass4l', mass4l, 'mass4l/D')
+    for i in range(n_events):
+        mass4l[0] = rnd.Uniform(*MASS_RANGE)
+        tree.Fill()
+    data_file.Write()
+    data_file.Close()
+
+    templates_file = ROOT.TFile(os.path.join(inputs_dir, 'templates.root'), 'RECREATE')
+    for p_name in backgrounds:
+        histo = ROOT.TH1F('h_' + p_name, p_name, 35, MASS_RANGE[0], MASS_RANGE[1])
+        for i in range(1000):
+            histo.Fill(rnd.Uniform(*MASS_RANGE))
+        histo.Write()
+    templates_file.Close()
+
+
+def generate(cfg_dir, n_categories, n_processes, n_nuisances, insert_fanout, n_events, with_root):
+    """
+    Write the synthetic configuration to cfg_dir and return the path of
+    the datacard configuration and the list of categories.
+    """
+    inputs_dir = os.path.join(cfg_dir, 'inputs')
+    if not os.path.exists(inputs_dir):
+        os.makedirs(inputs_dir)
+    categories = ['cat_{0}'.format(i) for i in range(n_categories)]
+    signals, backgrounds = get_process_names(n_processes)
+    write_common_setup(cfg_dir)
+    write_inputs(inputs_dir, categories, signals, backgrounds, n_nuisances, insert_fanout)
+    cfg_file = os.path.join(cfg_dir, 'synthetic_datacard.yaml')
+    write_datacard_cfg(cfg_file, categories, signals, backgrounds, insert_fanout, n_events)
+    if with_root:
+        write_root_inputs(inputs_dir, backgrounds, n_events)
+    return (cfg_file, categories)
+
+
+def best_time(function, n_repeat):
+    """
+    Best time out of n_repeat calls and the result of the last call.
+    """
+    best = None
+    for i in range(n_repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, result)
+
+
+def run_point(n_categories, n_processes, n_nuisances, insert_fanout):
+    """
+    Generate one configuration and time all the stages.
+    """
+    cfg_dir = tempfile.mkdtemp(prefix = 'bench_synthetic_')
+    result = {'categories': n_categories, 'processes': n_processes,
+              'nuisances': n_nuisances, 'insert_fanout': insert_fanout}
+    try:
+        cfg_file, categories = generate(cfg_dir, n_categories, n_processes, n_nuisances,
+                                        insert_fanout, opt.events, opt.with_root)
+        result['cfg_size_bytes'] = sum(os.path.getsize(os.path.join(dir_path, file_name))
+                                       for dir_path, dir_names, file_names in os.walk(cfg_dir)
+                                       for file_name in file_names if file_name.endswith('.yaml'))
+
+        def parse():
+            parsed_cfg_cache.clear()
+            flat_index_cache.clear()
+            return UniversalConfigParser(file_list = cfg_file).get_dict()
+        result['parse_s'], full_config = best_time(parse, opt.repeat)
+
+        try:
+            from build_datacard import LegoCards
+        except ImportError as error:
+            print 'Cannot import build_datacard ({0}). Only parsing is timed.'.format(error)
+            return result
+
+        out_dir = os.path.join(cfg_dir, 'cards')
+
+        def get_builders():
+            builders = []
+            for category in categories:
+                builder = LegoCards(datacard_input = full_config[category],
+                                    datacard_name = 'synthetic_' + category)
+                builder.set_cfg_dir(cfg_file)
+                builder.set_out_dir(out_dir)
+                builder.set_echo_txt_card(False)
+                builders.append(builder)
+            return builders
+
+        result['systematics_s'] = best_time(
+            lambda: [builder._get_systematics_table() for builder in get_builders()],
+            opt.repeat)[0]
+        result['txt_cards_s'] = best_time(
+            lambda: [builder.make_txt_card() for builder in get_builders()],
+            opt.repeat)[0]
+        if opt.with_root:
+            result['workspaces_s'] = best_time(
+                lambda: [builder.make_workspace() for builder in get_builders()],
+                opt.repeat)[0]
+    finally:
+        if opt.keep:
+            print 'Configuration kept in {0}'.format(cfg_dir)
+        else:
+            shutil.rmtree(cfg_dir)
+    return result
+
+
+def parseOptions():
+
+    usage = ('usage: %prog [options] \n'
+             + '%prog -h for help')
+    parser = optparse.OptionParser(usage)
+    parser.add_option('', '--categories', dest='categories', type='string', default='1,10',
+                      help='Comma separated numbers of categories.')
+    parser.add_option('', '--processes', dest='processes', type='string', default='5,50',
+                      help='Comma separated numbers of processes per category.')
+    parser.add_option('', '--nuisances', dest='nuisances', type='string', default='20,200',
+                      help='Comma separated numbers of nuisances.')
+    parser.add_option('', '--insert-fanout', dest='insert_fanout', type='string', default='2',
+                      help='Comma separated numbers of systematics files INSERTed per category.')
+    parser.add_option('', '--events', dest='events', type='int', default=1000,
+                      help='Number of observed events in the data tree.')
+    parser.add_option('', '--with-root', dest='with_root', action='store_true', default=False,
+                      help='Generate ROOT inputs and time the workspace building.')
+    parser.add_option('-r', '--repeat', dest='repeat', type='int', default=3,
+                      help='Number of timing repetitions (best is reported).')
+    parser.add_option('-k', '--keep', dest='keep', action='store_true', default=False,
+                      help='Keep the generated configurations.')
+    parser.add_option('-o', '--output', dest='output', type='string', default=None,
+                      help='Write results to this json file.')
+
+    global opt, args
+    (opt, args) = parser.parse_args()
+
+
+def main():
+    parseOptions()
+    os.environ['PYTHON_LOGGER_VERBOSITY'] = '0'
+    grid = [[int(n) for n in values.split(',')] for values in
+            (opt.categories, opt.processes, opt.nuisances, opt.insert_fanout)]
+
+    columns = ['categories', 'processes', 'nuisances', 'insert_fanout',
+               'parse_s', 'systematics_s', 'txt_cards_s', 'workspaces_s']
+    print ' '.join('{0:>13}'.format(column) for column in columns)
+    results = []
+    for point in itertools.product(*grid):
+        result = run_point(*point)
+        results.append(result)
+        print ' '.join('{0:>13}'.format(result[column] if isinstance(result.get(column), int)
+                                        else '{0:.3f}'.format(result[column]) if column in result
+                                        else '-')
+                       for column in columns)
+
+    if opt.output:
+        with open(opt.output, 'w') as fd:
+            json.dump(results, fd, indent=4)
+        print 'Results written to {0}'.format(opt.output)
+
+
+if __name__ == '__main__':
+    main()
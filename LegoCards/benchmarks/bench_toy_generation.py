@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - measure the wall time of ToyDataSetManager.generate_toys for different
+#      numbers of processes (--jobs) on a generated 2D workspace.
+#    - the speedup is relative to the first --jobs entry (1 by default) and
+#      should grow with the number of jobs up to the number of cores.
+#-------------------------------------------------------------------------------
+
+import sys, os, time, optparse, tempfile, shutil, json
+import multiprocessing
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+
+def write_workspace(file_name):
+    """
+    Write workspace w with pdf model(mass4l, KD): a Gaussian peak on an
+    exponential background times a polynomial in KD.
+    """
+    from ROOT import TFile, RooWorkspace
+    ws = RooWorkspace('w')
+    ws.factory('Gaussian::sig_mass(mass4l[110, 140], mH[125], sigma[2])')
+    ws.factory('Exponential::bkg_mass(mass4l, tau[-0.02])')
+    ws.factory('SUM::pdf_mass(f_sig[0.3] * sig_mass, bkg_mass)')
+    ws.factory('Polynomial::pdf_KD(KD[0, 1], {a1[0.5]})')
+    ws.factory('PROD::model(pdf_mass, pdf_KD)')
+    root_file = TFile.Open(file_name, 'RECREATE')
+    ws.Write()
+    root_file.Close()
+
+
+def measure(workspace_path, n_toys, n_events, n_jobs, output_dir):
+    from lib.RooFit.ToyDataSetManager import ToyDataSetManager
+    output_filename = os.path.join(output_dir, 'toys_{0}jobs.root'.format(n_jobs))
+    start = time.time()
+    ToyDataSetManager().generate_toys(workspace_path, 'model', n_toys, n_events,
+                                      observables = ['mass4l', 'KD'], n_jobs = n_jobs,
+                                      output_filename = output_filename)
+    elapsed = time.time() - start
+    os.remove(output_filename)
+    return {'n_jobs': n_jobs, 'time_s': elapsed}
+
+
+def parseOptions():
+
+    usage = ('usage: %prog [options] \n'
+             + '%prog -h for help')
+    parser = optparse.OptionParser(usage)
+    parser.add_option('-t', '--toys', dest='n_toys', type='int', default=200)
+    parser.add_option('-e', '--events', dest='n_events', type='int', default=10000)
+    parser.add_option('-j', '--jobs', dest='jobs', type='string', default=None,
+                      help='Comma separated numbers of processes. Default: 1,2,4,... up to the number of cores.')
+    parser.add_option('-o', '--output', dest='output', type='string', default=None,
+                      help='Write results to this json file.')
+
+    global opt, args
+    (opt, args) = parser.parse_args()
+
+
+def main():
+    parseOptions()
+    if opt.jobs:
+        jobs = [int(n_jobs) for n_jobs in opt.jobs.split(',')]
+    else:
+        jobs = [1]
+        while jobs[-1] * 2 <= multiprocessing.cpu_count():
+            jobs.append(jobs[-1] * 2)
+
+    output_dir = tempfile.mkdtemp(prefix='bench_toys_')
+    try:
+        workspace_file = os.path.join(output_dir, 'workspace.root')
+        write_workspace(workspace_file)
+        results = [measure(workspace_file + '/w', opt.n_toys, opt.n_events, n_jobs, output_dir)
+                   for n_jobs in jobs]
+    finally:
+        shutil.rmtree(output_dir)
+
+    print 'Toys: {0} x {1} events, cores: {2}'.format(opt.n_toys, opt.n_events,
+                                                     multiprocessing.cpu_count())
+    print '{0:>6} {1:>10} {2:>8}'.format('jobs', 'time [s]', 'speedup')
+    for result in results:
+        result['speedup'] = results[0]['time_s'] / result['time_s']
+        print '{0:>6} {1:>10.2f} {2:>8.2f}'.format(result['n_jobs'], result['time_s'], result['speedup'])
+    if opt.output:
+        with open(opt.output, 'w') as fd:
+            json.dump({'n_toys': opt.n_toys, 'n_events': opt.n_events, 'results': results},
+                      fd, indent=4)
+        print 'Results written to {0}'.format(opt.output)
+
+
+if __name__ == '__main__':
+    main()
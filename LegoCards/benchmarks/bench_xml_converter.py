@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - compare peak memory and time of ConvertXmlToDict (full ElementTree)
+#      and ConvertXmlToDictStreaming (iterparse) on a generated XML datacard.
+#-------------------------------------------------------------------------------
+
+import sys, os, time, optparse, tempfile, json, resource
+import multiprocessing
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+import lib.util.XmlDictConverter as xmlc
+
+
+def write_xml_card(file_name, n_categories, n_processes, n_systematics):
+    """
+    Write a legacy-style XML datacard definition.
+    """
+    with open(file_name, 'w') as fd:
+        fd.write('<datacards>\n')
+        for i_cat in range(n_categories):
+            fd.write('  <category name="cat_{0}">\n'.format(i_cat))
+            for i_proc in range(n_processes):
+                fd.write('    <process name="proc_{0}" is_signal="{1}">\n'
+                         .format(i_proc, int(i_proc == 0)))
+                fd.write('      <rate>{0}</rate>\n'.format(0.1 * (i_proc + 1)))
+                fd.write('      <shape>Template::proc_{0}(mass4l, inputs/h.root/h_{0})</shape>\n'
+                         .format(i_proc))
+                for i_sys in range(n_systematics):
+                    fd.write('      <systematic name="sys_{0}" type="lnN">1.0{1}</systematic>\n'
+                             .format(i_sys, i_sys % 10))
+                fd.write('    </process>\n')
+            fd.write('  </category>\n')
+        fd.write('</datacards>\n')
+
+
+def _run_converter(converter_name, file_name, queue):
+    converter = getattr(xmlc, converter_name)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    converter(file_name)
+    elapsed = time.time() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in kB on linux
+    queue.put({'converter': converter_name, 'time_s': elapsed,
+               'peak_rss_increase_MB': (rss_after - rss_before) / 1024.})
+
+
+def measure(converter_name, file_name):
+    """
+    Run the converter in a fresh process so that peak RSS is not shared.
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = _run_converter,
+                                      args = (converter_name, file_name, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def parseOptions():
+
+    usage = ('usage: %prog [options] \n'
+             + '%prog -h for help')
+    parser = optparse.OptionParser(usage)
+    parser.add_option('', '--categories', dest='n_categories', type='int', default=20)
+    parser.add_option('', '--processes', dest='n_processes', type='int', default=50)
+    parser.add_option('', '--systematics', dest='n_systematics', type='int', default=200)
+    parser.add_option('-o', '--output', dest='output', type='string', default=None,
+                      help='Write results to this json file.')
+
+    global opt, args
+    (opt, args) = parser.parse_args()
+
+
+def main():
+    parseOptions()
+    fd, xml_file = tempfile.mkstemp(suffix='.xml', prefix='bench_xml_')
+    os.close(fd)
+    try:
+        write_xml_card(xml_file, opt.n_categories, opt.n_processes, opt.n_systematics)
+        assert xmlc.ConvertXmlToDict(xml_file) == xmlc.ConvertXmlToDictStreaming(xml_file), (
+            'Streaming converter gives different result.')
+        size_MB = os.path.getsize(xml_file) / 1024. / 1024.
+        results = [measure(name, xml_file)
+                   for name in ['ConvertXmlToDict', 'ConvertXmlToDictStreaming']]
+    finally:
+        os.remove(xml_file)
+
+    print 'XML file size: {0:.1f} MB'.format(size_MB)
+    print '{0:<30} {1:>10} {2:>22}'.format('converter', 'time [s]', 'peak RSS increase [MB]')
+    for result in results:
+        print '{0:<30} {1:>10.2f} {2:>22.1f}'.format(result['converter'], result['time_s'],
+                                                  result['peak_rss_increase_MB'])
+    if opt.output:
+        with open(opt.output, 'w') as fd:
+            json.dump({'xml_size_MB': size_MB, 'results': results}, fd, indent=4)
+        print 'Results written to {0}'.format(opt.output)
+
+
+if __name__ == '__main__':
+    main()
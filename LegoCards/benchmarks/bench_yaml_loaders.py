@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - compare the pure-python and libyaml YAML loaders on the shipped
+#      configs/inputs files, scaled up by repeating their top-level sections.
+#-------------------------------------------------------------------------------
+
+import sys, os, re, glob, time, optparse, tempfile, shutil, json, collections
+import yaml
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib.util.UniversalConfigParser import UniversalConfigParser, set_yaml_loader
+
+INPUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir, 'configs', 'inputs')
+
+
+def scale_yaml_text(text, scale):
+    """
+    Repeat the document 'scale' times. Top-level keys and anchors get
+    a suffix, so that the copies don't overwrite each other.
+    """
+    body = '\n'.join(line for line in text.splitlines() if line.strip() != '---')
+    p_top_key = re.compile(r'^(\w[\w.-]*)\s*:', re.MULTILINE)
+    p_anchor = re.compile(r'([&*])(\w+)')
+    copies = []
+    for i in range(scale):
+        one_copy = p_top_key.sub(r'\1_{0}:'.format(i), body)
+        one_copy = p_anchor.sub(r'\1\2_{0}'.format(i), one_copy)
+        copies.append(one_copy)
+    return '---\n' + '\n'.join(copies)
+
+
+def time_loader(file_name, loader, n_repeat):
+    """
+    Best time out of n_repeat yaml.load calls.
+    """
+    best = None
+    for i in range(n_repeat):
+        with open(file_name) as fd:
+            start = time.time()
+            yaml.load(fd, Loader = loader)
+            elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def parseOptions():
+
+    usage = ('usage: %prog [options] \n'
+             + '%prog -h for help')
+    parser = optparse.OptionParser(usage)
+    parser.add_option('-n', '--scale', dest='scale', type='int', default=1000,
+                      help='How many times the input files are repeated.')
+    parser.add_option('-r', '--repeat', dest='repeat', type='int', default=3,
+                      help='Number of timing repetitions (best is reported).')
+    parser.add_option('-o', '--output', dest='output', type='string', default=None,
+                      help='Write results to this json file.')
+
+    global opt, args
+    (opt, args) = parser.parse_args()
+
+
+def main():
+    parseOptions()
+    os.environ['PYTHON_LOGGER_VERBOSITY'] = '0'
+    loaders = [('python', yaml.SafeLoader)]
+    if getattr(yaml, '__with_libyaml__', False):
+        loaders.append(('c', yaml.CSafeLoader))
+    else:
+        print 'PyYAML is built without libyaml. Only the pure-python loader is timed.'
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench_yaml_')
+    results = []
+    try:
+        for input_file in sorted(glob.glob(os.path.join(INPUTS_DIR, '*.yaml'))):
+            scaled_file = os.path.join(tmp_dir, os.path.basename(input_file))
+            with open(input_file) as fd:
+                scaled_text = scale_yaml_text(fd.read(), opt.scale)
+            with open(scaled_file, 'w') as fd:
+                fd.write(scaled_text)
+
+            #make sure both loaders give the same result before timing
+            if len(loaders) == 2:
+                with open(scaled_file) as fd:
+                    py_dict = yaml.load(fd, Loader = yaml.SafeLoader)
+                with open(scaled_file) as fd:
+                    c_dict = yaml.load(fd, Loader = yaml.CSafeLoader)
+                assert py_dict == c_dict, 'Loaders disagree on {0}'.format(scaled_file)
+
+            result = {'file': os.path.basename(input_file),
+                      'scale': opt.scale,
+                      'size_bytes': os.path.getsize(scaled_file)}
+            for loader_name, loader in loaders:
+                result[loader_name] = time_loader(scaled_file, loader, opt.repeat)
+            results.append(result)
+
+        #full parse of the scaled files through UniversalConfigParser
+        for loader_name, loader in loaders:
+            set_yaml_loader(loader_name)
+            start = time.time()
+            for scaled_file in sorted(glob.glob(os.path.join(tmp_dir, '*.yaml'))):
+                UniversalConfigParser(file_list = scaled_file).get_dict()
+            results.append({'file': 'UniversalConfigParser(all)', 'scale': opt.scale,
+                            loader_name: time.time() - start})
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print '{0:<50} {1:>12} {2:>12} {3:>8}'.format('file (x{0})'.format(opt.scale),
+                                                  'python [s]', 'c [s]', 'speedup')
+    merged = collections.OrderedDict()
+    for result in results:
+        merged.setdefault(result['file'], {}).update(result)
+    for file_name, result in merged.iteritems():
+        speedup = ''
+        if result.get('python') and result.get('c'):
+            speedup = '{0:.1f}x'.format(result['python'] / result['c'])
+        print '{0:<50} {1:>12} {2:>12} {3:>8}'.format(file_name,
+                '{0:.3f}'.format(result['python']) if 'python' in result else '-',
+                '{0:.3f}'.format(result['c']) if 'c' in result else '-', speedup)
+
+    if opt.output:
+        with open(opt.output, 'w') as fd:
+            json.dump(results, fd, indent=4)
+        print 'Results written to {0}'.format(opt.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,16 +8,22 @@
 #    - making a webpage for easier testing.
 #-------------------------------------------------------------------------------
 
-import sys,os,re, optparse, pprint, textwrap, string
+import sys,os,re, optparse, pprint, json
 
-from ROOT import RooFit, RooWorkspace, RooArgSet, RooArgList
-from ROOT import RooDataHist, RooHistPdf, gSystem
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
                                              os.pardir, os.pardir)))
 from lib.util.Logger import Logger
-from lib.util.UniversalConfigParser import UniversalConfigParser
-from lib.RootHelpers.RootHelperBase import RootHelperBase
-from lib.RooFit.ToyDataSetManager import ToyDataSetManager
+from lib.util.UniversalConfigParser import UniversalConfigParser, set_yaml_loader
+from lib.util.UniversalConfigParser import yaml_loader_choices, LazyConfigDict
+from lib.util.UniversalConfigParser import get_parsed_insert_lines, add_parsed_insert_lines
+from lib.util.ResolvedConfigCache import ResolvedConfigCache
+from lib.util.SystematicsMatrix import SystematicsMatrix
+from lib.util.BuildCache import BuildCache, get_tool_version
+from lib.util.Profiler import profiler
+from lib.util.DatasetCache import DatasetCache
+from lib.RooFit.FactoryRegistry import FactoryRegistry
+#ROOT (and the modules using it) is imported only when a workspace is built,
+#so the txt cards of counting experiments can be made without ROOT.
 import lib.util.MiscTools as misc
 import lib.util.nested_dict as nd
 
@@ -78,8 +84,11 @@ class LegoCards(object):
 
         self.log.debug('Processes: {0}'.format(self.process_list))
 
-        #self.n_systematics, self.systematics_lines = self._get_systematics_lines()
         self.card_header='' #set of information lines os a header of the card.
+        self.echo_txt_card = True #print the txt card to stdout
+        self.build_cache = None #rebuild everything by default
+        self.dataset_cache = None #no caching of selected data_obs columns by default
+        self.sys_matrix = None #systematics shared by the cards of a luminosity scan
 
     ###########################################################################
     #              _     _ _                       _   _               _      #
@@ -97,55 +106,36 @@ class LegoCards(object):
         - loop on processes and fill in txt card lines
         - look fr systematics
         - check if there are shapes
-        """
-        self.process_lines = self._get_process_lines()
-        self.n_systematics, self.systematics_lines = self._get_systematics_lines()
-
-        txt_card = """
-                    Datacard for event category: {cat}
-                    {card_header}
-
-                    ------------------------------------------------------------
-                    imax 1 number of bins
-                    jmax {jmax} number of processes minus 1
-                    kmax {kmax} number of nuisance parameters
-                    ------------------------------------------------------------
-                    {shapes_line}
-                    ------------------------------------------------------------
-                    bin          cat_{cat}
-                    observation  {n_observed}
-                    ------------------------------------------------------------
-                    bin          {process_cat}
-                    process      {process_name}
-                    process      {process_number}
-                    rate         {process_rate}
-                    ------------------------------------------------------------
-                   """.format(cat = self.d_input['category'],
-                              jmax = (len(self.process_list)-1),
-                              kmax = self.n_systematics,
-                              shapes_line = self._get_shapes_line(),
-                              n_observed = self._get_observed_rate(),
-                              process_cat = self.process_lines['bin'],
-                              process_name = self.process_lines['name'],
-                              process_number = self.process_lines['number'],
-                              process_rate = self.process_lines['rate'],
-                              card_header = self.card_header
-                              )
-
-        txt_card = textwrap.dedent(txt_card)
-        txt_card+= textwrap.dedent(self.systematics_lines)
-        print txt_card
 
+        The process/systematics part is built as a table once, with aligned
+        columns, and the lines are streamed to the file.
+        """
         file_datacard_name = os.path.join(self.out_dir,self.datacard_name+'.txt')
         if self.lumi_scaling != 1.0:
             file_datacard_name = file_datacard_name.replace('.txt',
                                                             '.lumi_scale_{0:3.2f}.txt'
                                                             .format(self.lumi_scaling))
-
-        with open(file_datacard_name, 'w') as file_datacard:
-            file_datacard.write(textwrap.dedent(txt_card))
-            #file_datacard.write(textwrap.dedent(self.systematics_lines))
+        if self.build_cache:
+            fingerprint = self._get_build_fingerprint(lumi_scaling = self.lumi_scaling,
+                                                      card_header = self.card_header)
+            if self.build_cache.load(file_datacard_name, fingerprint) is not None:
+                self.log.info('Datacard text is up to date: {0}'.format(file_datacard_name))
+                return
+
+        with profiler.stage('systematics assembly', category = self.d_input['category']):
+            self.process_table = self._get_process_table()
+            self.n_systematics, self.systematics_table = self._get_systematics_table()
+
+        with profiler.stage('txt card writing', category = self.d_input['category']):
+            with open(file_datacard_name, 'w') as file_datacard:
+                for line in self._get_txt_card_lines():
+                    file_datacard.write(line)
+                    file_datacard.write('\n')
+                    if self.echo_txt_card:
+                        print line
             self.log.info('Datacard text saved: {0}'.format(file_datacard_name))
+        if self.build_cache:
+            self.build_cache.store(file_datacard_name, fingerprint)
 
     #___________________________________________________________________________
     def make_workspace(self):
@@ -163,6 +153,20 @@ class LegoCards(object):
             self.log.info("There is no need to create the workspace file.")
             return
 
+        if self.build_cache:
+            fingerprint = self._get_build_fingerprint()
+            build_info = self.build_cache.load(os.path.join(self.out_dir, workspace_filename),
+                                               fingerprint)
+            if build_info is not None:
+                self.log.info('Datacard workspace is up to date: {0}'
+                              .format(os.path.join(self.out_dir, workspace_filename)))
+                self.n_data_obs = build_info['n_data_obs']
+                return
+
+        from ROOT import RooFit, RooWorkspace, gSystem
+        from lib.RootHelpers.RootHelperBase import RootHelperBase
+        from lib.RooFit.ToyDataSetManager import ToyDataSetManager
+
         #we need this for some pdf functions, e.g. RooDoubleCB whic doesn't exist
         #in plane RooFit
         gSystem.Load("$CMSSW_BASE/lib/$SCRAM_ARCH/libHiggsAnalysisCombinedLimit.so")
@@ -170,6 +174,14 @@ class LegoCards(object):
 
 
         self.w = RooWorkspace('w')
+        #one helper per build, so that every input file is opened only once
+        self.root_helper = RootHelperBase()
+        #identical statements (e.g. repeated through INSERT) are built only once
+        self.factory = FactoryRegistry(self.w)
+        #RooDataHist templates of this workspace, the same histogram with the same
+        #binning is imported only once.
+        #Key: (file, histogram, ((observable, min, max, bins), ...))
+        self.template_cache = {}
 
 
 
@@ -205,18 +217,43 @@ class LegoCards(object):
             if is_factory_statement:
                 self.log.debug('Adding observable {0} to the RooWorkspace.'
                                .format(observable))
-                self.w.factory(observable)
+                self.factory.factory(observable)
 
         dataset_tool = ToyDataSetManager()
-        self.data_obs = dataset_tool.get_dataset_from_tree(
+        dataset_tool.set_dataset_cache(self.dataset_cache)
+        with profiler.stage('get_dataset_from_tree', category = self.d_input['category']):
+            #only the observables and the branches in the selection are read
+            if 'binning' in self.d_input['observation']['source']:
+                #binned data_obs, filled in one vectorized pass over the tree
+                self.data_obs = dataset_tool.get_dataset_from_tree_streaming(
+                                                data_obs_path,
+                                                tree_variables = data_obs_branches,
+                                                selection = self.d_input['observation']['source']['selection'],
+                                                dataset_name = "data_obs",
+                                                binning = self._get_data_obs_binning(data_obs_branches),
+                                                max_memory_MB = self.d_input['observation']['source'].get('max_memory_MB', 500),
+                                                basket=False)
+            elif 'max_memory_MB' in self.d_input['observation']['source']:
+                #trees larger than memory are read in chunks
+                self.data_obs = dataset_tool.get_dataset_from_tree_streaming(
                                                 data_obs_path,
                                                 tree_variables = data_obs_branches,
-                                                weight = self.d_input['observation']['source']['selection'],
-                                                weight_var_name=0,
+                                                selection = self.d_input['observation']['source']['selection'],
                                                 dataset_name = "data_obs",
-                                                basket=False,
-                                                category = None)
-        self.n_data_obs = self.data_obs.numEntries()
+                                                max_memory_MB = self.d_input['observation']['source']['max_memory_MB'],
+                                                basket=False)
+            else:
+                self.data_obs = dataset_tool.get_dataset_from_tree_columnar(
+                                                data_obs_path,
+                                                tree_variables = data_obs_branches,
+                                                selection = self.d_input['observation']['source']['selection'],
+                                                dataset_name = "data_obs",
+                                                basket=False)
+        if self.data_obs.InheritsFrom('RooDataHist'):
+            #numEntries() is the number of bins for binned data
+            self.n_data_obs = int(round(self.data_obs.sumEntries()))
+        else:
+            self.n_data_obs = self.data_obs.numEntries()
         assert self._get_observed_rate()==self.data_obs.sumEntries(), ('Mismatch between '
                 'observation in txt datacard and sum of entries in RooDataSet::data_obs\n'
                 'HINT: If you put negative number for observation in txt datacard then the '
@@ -231,17 +268,21 @@ class LegoCards(object):
 
 
         #setup-level functions_and_definitions
-        for statement in self._get_functions_and_definitions(self.d_input['setup']):
-            self.w.factory(statement)
+        with profiler.stage('setup factory calls', category = self.d_input['category']):
+            for statement in self._get_functions_and_definitions(self.d_input['setup']):
+                self.factory.factory(statement)
 
         #setup-0 functions_and_definitions
-        for statement in self._get_functions_and_definitions(self.d_input):
-            self.w.factory(statement)
+        with profiler.stage('category factory calls', category = self.d_input['category']):
+            for statement in self._get_functions_and_definitions(self.d_input):
+                self.factory.factory(statement)
 
         for p_id, p_setup in self.d_input['processes'].iteritems():
             #setup-1 functions_and_definitions (under process name)
-            for statement in self._get_functions_and_definitions(p_setup):
-                self.w.factory(statement)
+            with profiler.stage('process factory calls', category = self.d_input['category'],
+                                process = p_id):
+                for statement in self._get_functions_and_definitions(p_setup):
+                    self.factory.factory(statement)
 
             self.log.debug('Checking shape in {0}/{1}'.format(self.datacard_name, p_id))
             try:
@@ -255,7 +296,9 @@ class LegoCards(object):
                     self.shapes_exist = True
 
                     if p_setup['shape'].lower().startswith('template'):
-                        the_template = self._get_template(p_setup['shape'])
+                        with profiler.stage('template import', category = self.d_input['category'],
+                                            process = p_id):
+                            the_template = self._get_template(p_setup['shape'])
                         assert the_template.GetName() == p_id, (
                             'Template pdf name must be identical to process name.\n'
                             'You provided process_name = {0} and '
@@ -265,16 +308,23 @@ class LegoCards(object):
                             self.log.debug('Imported template for {0}'.format(p_id))
                             the_template.Print('v')
                     else:
-                        self.w.factory(p_setup['shape'])
+                        with profiler.stage('process factory calls',
+                                            category = self.d_input['category'], process = p_id):
+                            self.factory.factory(p_setup['shape'])
+        self.factory.report()
         self.log.debug('Printing workspace...')
 
         #getattr(self.w,'import')(self.data_obs)
         print 20*"----"
         self.w.Print()
         print 20*"----"
-        self.w.writeToFile(os.path.join(self.out_dir, workspace_filename))
+        with profiler.stage('writeToFile', category = self.d_input['category']):
+            self.w.writeToFile(os.path.join(self.out_dir, workspace_filename))
         self.log.info('Datacard workspace saved: {0}'
                       .format(self.out_dir + workspace_filename))
+        if self.build_cache:
+            self.build_cache.store(os.path.join(self.out_dir, workspace_filename), fingerprint,
+                                   n_data_obs = self.n_data_obs)
 
     #___________________________________________________________________________
     def set_out_dir(self, out_dir):
@@ -287,6 +337,35 @@ class LegoCards(object):
         self.log.debug('Output directory set to: {0}'.format(self.out_dir))
         return
 
+    #___________________________________________________________________________
+    def set_echo_txt_card(self, echo_txt_card):
+        """
+        Print (or not) the txt card to stdout while it is written.
+        """
+        self.echo_txt_card = echo_txt_card
+
+    #___________________________________________________________________________
+    def set_build_cache(self, incremental, hash_inputs = False):
+        """
+        With incremental builds the workspace and the txt card are rebuilt only
+        if their fingerprint changed: the configuration section, the input ROOT
+        files (mtime and size, or the content with hash_inputs), the luminosity
+        scaling or the version of the tool.
+        """
+        if incremental:
+            self.build_cache = BuildCache(get_tool_version(os.path.dirname(os.path.abspath(__file__))),
+                                          hash_inputs = hash_inputs)
+        else:
+            self.build_cache = None
+
+    #___________________________________________________________________________
+    def set_dataset_cache(self, dataset_cache):
+        """
+        DatasetCache with the selected columns of data_obs trees,
+        None (default) to always read the input trees.
+        """
+        self.dataset_cache = dataset_cache
+
     #___________________________________________________________________________
     def set_cfg_dir(self,dir_name):
         """
@@ -323,6 +402,28 @@ class LegoCards(object):
         self.log.debug('Rates in datacards will be scaled by a factor of {0}'
                         .format(self.lumi_scaling))
 
+    #___________________________________________________________________________
+    def make_lumi_scan_txt_cards(self, lumi_scalings):
+        """
+        Make one txt card per luminosity scaling factor.
+
+        Only the rates in the txt card depend on luminosity, so all the cards
+        point to the same (unscaled) workspace which has to be made with
+        make_workspace() before the scan. The systematics are merged once and
+        shared by all the cards, so their rows are in the same order.
+        """
+        card_header = self.card_header
+        self.lumi_scaling = 1.0
+        self._get_workspace_file_name()  #fixes the name of the shared workspace
+        self.sys_matrix = self._get_systematics_matrix()
+        for lumi_scaling in lumi_scalings:
+            self.card_header = card_header
+            self.scale_lumi_by(lumi_scaling)
+            self.make_txt_card()
+        self.card_header = card_header
+        self.lumi_scaling = 1.0
+        self.sys_matrix = None
+
     ################################################################################
     #             _            _                        _   _               _      #
     #  _ __  _ __(_)_   ____ _| |_ ___   _ __ ___   ___| |_| |__   ___   __| |___  #
@@ -399,6 +500,33 @@ class LegoCards(object):
             return (statement, False)
 
 
+    #___________________________________________________________________________
+    def _get_data_obs_binning(self, observables):
+        """
+        Binning of data_obs from observation.source.binning:
+            binning:
+                mass4l: [35, 105, 140]  #n_bins, min, max
+                D_bkg: 20               #n_bins, range of the observable
+        Returns {observable: [n_bins, min, max]} for all the observables.
+        """
+        binning_input = self.d_input['observation']['source']['binning']
+        binning = {}
+        for obs in observables:
+            try:
+                obs_binning = binning_input[obs]
+            except KeyError:
+                raise KeyError, 'No binning given for observable {0} of data_obs.'.format(obs)
+            if isinstance(obs_binning, int):
+                if not self.w.var(obs):
+                    raise NameError, ('Binning of {0} needs the range, but the observable '
+                                      'is not defined.'.format(obs))
+                obs_binning = [obs_binning, self.w.var(obs).getMin(), self.w.var(obs).getMax()]
+            assert len(obs_binning) == 3, ('Binning of {0} should be [n_bins, min, max], not {1}'
+                                           .format(obs, obs_binning))
+            binning[obs] = [int(obs_binning[0]), float(obs_binning[1]), float(obs_binning[2])]
+        self.log.debug('Binning of data_obs: {0}'.format(binning))
+        return binning
+
     #___________________________________________________________________________
     def _get_functions_and_definitions(self,data):
         """Get list of functions_and_definitions to be defined with RooWSFactory.
@@ -444,6 +572,43 @@ class LegoCards(object):
         self.log.debug('No workspace will be used.')
         return False
 
+    #___________________________________________________________________________
+    def _get_input_files(self):
+        """
+        List of the ROOT files used in the configuration section
+        (observation source, templates, ...) as absolute paths.
+        """
+        p_root_file = re.compile(r'[^\s,()\[\]]+?\.root')
+        input_files = []
+        values = [self.d_input]
+        while values:
+            value = values.pop()
+            if isinstance(value, dict):
+                values.extend(value.itervalues())
+            elif isinstance(value, list):
+                values.extend(value)
+            elif isinstance(value, basestring):
+                input_files.extend(p_root_file.findall(value))
+        if self.cfg_absdir:
+            input_files = [os.path.normpath(os.path.join(self.cfg_absdir, input_file))
+                           for input_file in input_files]
+        return [os.path.abspath(input_file) for input_file in input_files]
+
+    #___________________________________________________________________________
+    def _get_build_fingerprint(self, **parameters):
+        """
+        Fingerprint of the outputs for the build cache. The configuration
+        section and the inputs are taken at the first call, before the
+        building modifies self.d_input.
+        """
+        try:
+            self._fingerprint_inputs
+        except AttributeError:
+            self._fingerprint_inputs = (json.dumps(self.d_input, sort_keys = True, default = str),
+                                        self._get_input_files())
+        cfg_section, input_files = self._fingerprint_inputs
+        return self.build_cache.get_fingerprint(cfg_section, input_files, **parameters)
+
     #___________________________________________________________________________
     def _get_workspace_file_name(self):
         """
@@ -493,6 +658,7 @@ class LegoCards(object):
     def _get_template(self, shape_setup, new_template_name=None):
         """Get template from histogram and make it RooHistPdf.
         """
+        from ROOT import RooFit, RooArgSet, RooArgList, RooDataHist, RooHistPdf
         self.log.info('Creating RooHistPdf from given histogram.')
         all_matches = re.findall("Template::(.+?)\((.+?)\)",shape_setup)
 
@@ -527,9 +693,6 @@ class LegoCards(object):
         self.log.debug('Template name: {0}, arguments: {1}'.format(template_name,
                                                                   template_args))
 
-        #fetch the template from file
-        root_helper = RootHelperBase()
-        histo = root_helper.get_histogram(template_path)
         template_name_cat = template_name+'_'+self.d_input['category']
 
         #ral_observables = RooArgList(self.w.factory('{{0}}'.format(
@@ -550,10 +713,22 @@ class LegoCards(object):
             ral_observables.Print()
             ras_observables.Print()
 
-
-        roo_data_hist  = RooDataHist('rdh_'+template_name_cat, template_name_cat,
-                                     #ral_observables, RooFit.Import(histo,kFALSE))
-                                    ral_observables, RooFit.Import(histo,False))
+        #the same histogram with the same binning is imported only once
+        template_key = (template_path_to_file, self.root_helper.get_paths(template_path)[1],
+                        tuple((obs, self.w.var(obs).getMin(), self.w.var(obs).getMax(),
+                               self.w.var(obs).getBins()) for obs in template_observables))
+        try:
+            roo_data_hist = self.template_cache[template_key]
+        except KeyError:
+            #fetch the template from file
+            histo = self.root_helper.get_histogram(template_path)
+            roo_data_hist  = RooDataHist('rdh_'+template_name_cat, template_name_cat,
+                                         #ral_observables, RooFit.Import(histo,kFALSE))
+                                        ral_observables, RooFit.Import(histo,False))
+            self.template_cache[template_key] = roo_data_hist
+        else:
+            self.log.debug('Reusing RooDataHist {0} for {1}'.format(roo_data_hist.GetName(),
+                                                                   template_name_cat))
 
         roo_hist_pdf   = RooHistPdf(template_name,template_name,
                                     ras_observables,
@@ -589,51 +764,21 @@ class LegoCards(object):
         return process_list
 
     #___________________________________________________________________________
-    def _get_process_lines(self):
-        """
-        Gets and formats lines corresponding to processes from self.process_list
-        """
-        process_lines = {'bin': '', 'name':'', 'number':'', 'rate':'','sys':''}
-
-        signal_process_dict = dict(enumerate(self.signal_process_list,
-                                             start=-(len(self.signal_process_list)-1)))
-        bkg_process_dict    = dict(enumerate(self.bkg_process_list, start=1))
-
-
-        #constructing the lines
-        is_first = True
-        for p_number in sorted(signal_process_dict.keys()):
-            #delimiter = '\t\t'
-            delimiter = ' '
-            if is_first:
-                delimiter = ''
-                is_first = False
-            p_name = signal_process_dict[p_number]
-            p_setup = self.d_input['processes'][p_name]
-            process_lines['bin']    += ( delimiter + 'cat_' + str(self.d_input['category']))
-            process_lines['name']   += ( delimiter + str(p_name) )
-            process_lines['number'] += ( delimiter + str(p_number) )
-            process_lines['rate']   += ( delimiter + str(float(p_setup['rate'])  *
-                                                         self.lumi_scaling) )
-            #process_lines['sys']     = "#systematics line: not implemented yet!!!"
-
-        for p_number in sorted(bkg_process_dict.keys()):
-            #delimiter = '\t\t'
-            delimiter = ' '
-            if is_first:
-                delimiter = ''
-                is_first = False
-            p_name = bkg_process_dict[p_number]
-            p_setup = self.d_input['processes'][p_name]
-            process_lines['bin']    += ( delimiter + 'cat_' + str(self.d_input['category']))
-            process_lines['name']   += ( delimiter + str(p_name) )
-            process_lines['number'] += ( delimiter + str(p_number) )
-            process_lines['rate']   += ( delimiter + str(float(p_setup['rate']) *
-                                                         self.lumi_scaling) )
-            #process_lines['sys']     = "#systematics line: not implemented yet!!!"
-
-
-        return process_lines
+    def _get_process_table(self):
+        """
+        Gets the columns of the process part of the card, in the order of
+        self.process_list: {'bin': [...], 'name': [...], 'number': [...], 'rate': [...]}
+        Signals are numbered <=0, backgrounds >0.
+        """
+        n_signals = len(self.signal_process_list)
+        bin_name = 'cat_' + str(self.d_input['category'])
+        process_table = {'bin': [bin_name]*len(self.process_list),
+                         'name': [str(p_name) for p_name in self.process_list],
+                         'number': [str(p_number) for p_number in
+                                    range(-(n_signals-1), len(self.process_list)-n_signals+1)],
+                         'rate': [str(float(self.d_input['processes'][p_name]['rate']) *
+                                      self.lumi_scaling) for p_name in self.process_list]}
+        return process_table
 
     #___________________________________________________________________________
     def _get_observed_rate(self):
@@ -653,54 +798,74 @@ class LegoCards(object):
 
 
     #___________________________________________________________________________
-    def _get_systematics_lines(self):
-        """Find systematics and construct a table/dict
+    def _get_systematics_table(self):
+        """Find systematics and construct a table: list of rows
+        (sys_name, sys_type, [value per process in self.process_list]).
+        Missing values are '-'. Rows of 'param' systematics have no values.
         """
         self.log.info('Extracting systematics.')
 
-        systematics_lines_list = []
-
-        sys_dict = self._get_systematics_dict()
-        #loop on keys, i.e. sys names and append value if process found, otherwise, append '-'
-        for sys_id in sys_dict.keys():
-            values = []
-            for sig_id in self.signal_process_list:
-                try:
-                    value = sys_dict[sys_id][sig_id]
-                except KeyError:
-                    value = '-'
-                values.append(str(value))
-
-            for bkg_id in self.bkg_process_list:
-                try:
-                    value = sys_dict[sys_id][bkg_id]
-                except KeyError:
-                    value = '-'
-                values.append(str(value))
-
-            if sys_dict[sys_id]['type'].startswith('param'): values=[]
-            systematics_lines_list.append('{0} {1} {2}'.format(sys_id,
-                                                               sys_dict[sys_id]['type'],
-                                                               string.join(values,' ') ))
+        sys_matrix = self.sys_matrix
+        if sys_matrix is None:
+            sys_matrix = self._get_systematics_matrix()
+        systematics_table = []
+        for sys_id, sys_type, values in sys_matrix.iter_rows():
+            if sys_type.startswith('param'):
+                values = []
+            systematics_table.append((sys_id, sys_type, values))
             #show the last one
-            self.log.debug('Systematic line: {0} '.format(systematics_lines_list[-1]))
+            self.log.debug('Systematic line: {0} '.format(systematics_table[-1]))
 
+        return (len(systematics_table), systematics_table)
 
-        systematics_lines = ''
-        n_systematics = 0
-        for line in systematics_lines_list:
-            systematics_lines += line
-            systematics_lines += '\n'
-            n_systematics += 1
-        return (n_systematics, systematics_lines)
-
+    #___________________________________________________________________________
+    def _get_txt_card_lines(self):
+        """
+        Generates the lines of the txt card. The label column and the
+        column of each process are aligned to their widest cell.
+        """
+        separator = 60*'-'
+        sys_labels = ['{0} {1}'.format(sys_id, sys_type)
+                      for sys_id, sys_type, values in self.systematics_table if values]
+        label_width = max([len('observation ')] + [len(label) for label in sys_labels])
+        column_widths = [max(len(cell) for cell in column) for column in
+                         zip(self.process_table['bin'], self.process_table['name'],
+                             self.process_table['number'], self.process_table['rate'],
+                             *[values for sys_id, sys_type, values in self.systematics_table
+                               if values])]
+
+        def table_row(label, cells):
+            return ' '.join([label.ljust(label_width)] +
+                            [cell.ljust(width) for cell, width in zip(cells, column_widths)]).rstrip()
+
+        yield ''
+        yield 'Datacard for event category: {0}'.format(self.d_input['category'])
+        yield self.card_header
+        yield ''
+        yield separator
+        yield 'imax 1 number of bins'
+        yield 'jmax {0} number of processes minus 1'.format(len(self.process_list)-1)
+        yield 'kmax {0} number of nuisance parameters'.format(self.n_systematics)
+        yield separator
+        yield self._get_shapes_line()
+        yield separator
+        yield table_row('bin', ['cat_{0}'.format(self.d_input['category'])])
+        yield table_row('observation', [str(self._get_observed_rate())])
+        yield separator
+        yield table_row('bin', self.process_table['bin'])
+        yield table_row('process', self.process_table['name'])
+        yield table_row('process', self.process_table['number'])
+        yield table_row('rate', self.process_table['rate'])
+        yield separator
+        for sys_id, sys_type, values in self.systematics_table:
+            yield table_row('{0} {1}'.format(sys_id, sys_type), values)
 
     #___________________________________________________________________________
-    def _get_systematics_dict(self):
-        """Find systematics and construct a dict.
+    def _get_systematics_matrix(self):
+        """Find systematics and construct a SystematicsMatrix.
 
         Updates for systematics are treated.
-        Finally, dict of format is constructed:
+        The matrix holds the same information as dict of format:
         {sys1_name:
             type: lnN
             p1: 1.04
@@ -709,26 +874,23 @@ class LegoCards(object):
             ...
         }
         """
-        self.log.info('Building systematics input dictionary.')
+        self.log.info('Building systematics input matrix.')
 
+        sys_matrix = SystematicsMatrix(self.process_list)
         sys_inputs = self.d_input['systematics']
 
         #Picking up from 'systematics' section. It can be a pure dict or a list
-        #of dicts
+        #of dicts. Later blocks override the earlier ones.
         if isinstance(sys_inputs, dict):
-            sys_dict = self._reduce_to_expected_systematic_dict(nd.nested_dict(sys_inputs))
-
-        elif isinstance(sys_inputs, list):
-            sys_dict = nd.nested_dict()
-            for sys_input in sys_inputs:
-                self.pp.pprint(sys_input)
-                #sys_dict = update_leaf(sys_dict, sys_input)
-                sys_dict.update(self._reduce_to_expected_systematic_dict(nd.nested_dict(sys_input)))
-        else:
-            sys_dict = nd.nested_dict()
+            sys_inputs = [sys_inputs]
+        elif not isinstance(sys_inputs, list):
+            sys_inputs = []
+        for sys_input in sys_inputs:
+            sys_matrix.update(*self._reduce_to_expected_systematic_cells(sys_input))
 
-        #Now we have a plane systematics dictionary, but still,
+        #Now we have a plane systematics matrix, but still,
         #something might be defined under processes. We update with that.
+        cells = []
         for proc_id in self.process_list:
 
             try:
@@ -741,99 +903,100 @@ class LegoCards(object):
                         #type:XXX
                         #p1: XXX
                         #p2: XXX}}
+                    sys_type = str(sys_value).split()[0]
+                    sys_size = str(sys_value).split()[1:]  #everything else
 
                     #check if this sys exists, and check the type
-                    if sys_id in sys_dict.keys():
-                        sys_type = str(sys_value).split()[0]
-                        sys_size = str(sys_value).split()[1:]  #everything else
-
-                        assert sys_dict[sys_id]['type'].split()[0]== sys_type,(
+                    if sys_id in sys_matrix:
+                        old_type = sys_matrix.get_type(sys_id)
+                        assert old_type.split()[0]== sys_type,(
                         'Systematics type needs to be the same as in existing dictionary!'
                         'Otherwise you will mix-up the systematics for other processes.\n'
                         'So, the systematic type under processes section should be '
                         'the same as one already provided within systematics section.\n'
                         'Systematic {0}.type is Old:{1} New:{2}. Make them the same or just '
                         'create a new systematic error name.'
-                        .format(sys_id, sys_dict[sys_id]['type'].split()[0], sys_type)
+                        .format(sys_id, old_type.split()[0], sys_type)
                         )
 
                         if sys_type.startswith('param'):
-                            if sys_dict[sys_id]['type'] != sys_value:
+                            if old_type != sys_value:
                                 self.log.warn(
                                     'You are replacing an existing parametric '
                                     'systematic <{0}> with <{1}>.\n'
                                     'Are you sure you want to do that?!'
-                                    .format(sys_dict[sys_id]['type'],sys_value)
+                                    .format(old_type,sys_value)
                                     )
-                            sys_dict[sys_id]['type'] = sys_value
+                            sys_matrix.set_type(sys_id, sys_value)
                         else:
-                            sys_dict[sys_id][proc_id] = float(sys_size[0])
-
-                    else: #this sys_id is not present in the dictionary
-                        sys_dict[sys_id] = {}
-                        sys_type = str(sys_value).split()[0]
-                        sys_size = str(sys_value).split()[1:]  #everything else
+                            cells.append((sys_id, proc_id, float(sys_size[0])))
 
+                    else: #this sys_id is not present in the matrix
                         if sys_type.startswith('param'):
-                            sys_dict[sys_id]['type'] = sys_value
+                            sys_matrix.set_type(sys_id, sys_value)
                         else:
-                            sys_dict[sys_id]['type'] = sys_type
-                            sys_dict[sys_id][proc_id] = float(sys_size[0])
-        self.d_input['systematics'] = sys_dict.to_dict()
-        return self.d_input['systematics']
+                            sys_matrix.set_type(sys_id, sys_type)
+                            cells.append((sys_id, proc_id, float(sys_size[0])))
+        #all the overrides from processes merged at once
+        sys_matrix.update([], cells)
+        #the dumped full configuration shows the merged systematics
+        self.d_input['systematics'] = sys_matrix.to_dict()
+        return sys_matrix
 
 
     #___________________________________________________________________________
-    def _reduce_to_expected_systematic_dict(self, sys_dict):
+    def _reduce_to_expected_systematic_cells(self, sys_dict):
         """
-        Reduce new_sys dictionary to dict typicalfor systematics.
+        Reduce new_sys dictionary to the types and cells of the
+        systematics matrix, i.e. ([(sys_name, type)], [(sys_name, process, size)])
 
-        E.g. The systematic dict that is produced looks like:
-        {   'cms_eff_e': {   'WH': 1.046,
-                        'ggH': 1.046,
-                        'type': 'lnN'},
-        'cms_eff_m': {   'WH': 1.026,
-                        'ttH': 1.026,
-                        'type': 'lnN'}}
-
-        Where the input dictionary (new_sys) looked like this:
+        E.g. The input dictionary (new_sys) looked like this:
         {'cms_eff_e': {   'UnTagged': {   'WH': 1.046,
                                             'ttH': 1.046,
                                             'type': 'lnN'}},
         'cms_eff_m': {   'UnTagged': {   'WH': 1.026,
                                         'ttH': 1.026,
                                         'type': 'lnN'}}}
+
+        And the reduced one is:
+        ([('cms_eff_e', 'lnN'), ('cms_eff_m', 'lnN')],
+         [('cms_eff_e', 'WH', 1.046), ('cms_eff_e', 'ttH', 1.046),
+          ('cms_eff_m', 'WH', 1.026), ('cms_eff_m', 'ttH', 1.026)])
         """
         self.log.debug('Removing uncesary keys from systematics dict.')
 
-        flat_sys_dict = nd.flatten(sys_dict)
-        #check that the flatten dict has more than 1 key in tuple
-        for tuple_key in flat_sys_dict.keys():
-            assert len(tuple_key)>=2, ('Wrong format of systematics dictionary. '
+        types, cells = [], []
+        intermediate_keys = {}
+        for sys_id, sys_input in sys_dict.iteritems():
+            assert isinstance(sys_input, dict), ('Wrong format of systematics dictionary. '
                                     'Should be sys_name:process_sys_size')
+            #walk down to the leaves, remembering the keys between sys_name and the leaf
+            stack = [((), sys_input)]
+            while stack:
+                path, node = stack.pop()
+                for key, value in node.iteritems():
+                    if isinstance(value, dict):
+                        stack.append((path + (key,), value))
+                        continue
+                    intermediate_keys.setdefault(sys_id, set()).add(path)
+                    if key == 'type':
+                        types.append((sys_id, value))
+                    elif key in self.process_list:
+                        #it is safe to remove intermediate keys.
+                        cells.append((sys_id, key, value))
+        self.log.debug(intermediate_keys)
 
-        keys_set = set([key[:-1] for key in flat_sys_dict.keys()])
-        self.log.debug(keys_set)
         #make sure that all the sys_names are different, and that all the
-        assert len(keys_set)==len(set(item[0] for item in keys_set)), (
+        assert all(len(paths)==1 for paths in intermediate_keys.itervalues()), (
                         'Wrong format of systematics dictionary. '
                         'You might be picking same systematics for '
                         'different categories. Be careful!')
 
-        assert len(set(item[1:] for item in keys_set))==1, (
+        assert len(set(paths.pop() for paths in intermediate_keys.itervalues()))<=1, (
                         'Wrong format of systematics dictionary. '
                         'You might be selecting more categories. '
                         'Be careful!')
-        #now remove all keys between first and last in flat_sys_dict.keys()
-        flat_sys_dict_reduced = nd.nested_dict()
-        for tuple_key, value in flat_sys_dict.iteritems():
-            #it is safe to remove intermediate keys.
-            if tuple_key[-1] not in self.process_list and tuple_key[-1] !='type':
-                continue
-            reduced_tuple_key = (tuple_key[0], tuple_key[-1])
-            flat_sys_dict_reduced[reduced_tuple_key] = value
-
-        return nd.unflatten(flat_sys_dict_reduced)
+        return (types, cells)
 
 
 #_______________________________________________________________________________
@@ -850,42 +1013,330 @@ def parseOptions():
     parser.add_option('-d'  , '--outdir', dest='out_dir', type='string',
                       default=".",
                       help='Output directory for cards txt and workspace.')
-    parser.add_option('-c', '--category', dest='category', type='string',
+    parser.add_option('-c', '--section', '--category', dest='section', type='string',
                       default = None,
-                      help=('Name of the section/category from yaml cfg file to be run. '
-                            'We produce one datacards  txt/workspace pair per section. '
-                            'If not specified we assume that we process the whole '
-                            'config_filename.'))
-    parser.add_option('-s', '--scale_lumi_by', dest='scale_lumi_by', type='float',
-                      default=1.0,    help='Scale luminosity in cards by this factor.')
+                      help=('Build the card from this top-level section of the configuration, '
+                            'for configurations with several categories. The section name is '
+                            'appended to the card name. In batch mode a comma separated list '
+                            'of names or wildcards. If not specified, the whole configuration '
+                            'is one card.'))
+    parser.add_option('', '--batch-cfg', dest='batch_cfg', type='string', default=None,
+                      help=('Batch mode: comma separated list of configuration files '
+                            '(wildcards allowed), the sections are selected with --section.'))
+    parser.add_option('', '--manifest', dest='manifest', type='string', default=None,
+                      help=('Batch mode: text file with lines of format '
+                            '"config_glob [section_glob ...]".'))
+    parser.add_option('-j', '--jobs', dest='jobs', type='int', default=1,
+                      help='Number of processes used to build the cards in batch mode.')
+    parser.add_option('-s', '--scale_lumi_by', dest='scale_lumi_by', type='string',
+                      default='1.0', help=('Scale luminosity in cards by this factor. '
+                          'With comma separated factors (e.g. 1,2,5,10) the workspace '
+                          'is built once and one txt card per factor is made.'))
+    parser.add_option('', '--no-card-echo', dest='no_card_echo', action='store_true',
+                      default=False, help='Do not print the txt cards to stdout.')
+    parser.add_option('', '--incremental', dest='incremental', action='store_true',
+                      default=False, help=('Rebuild workspace and txt card only if the '
+                          'configuration, input ROOT files, lumi scaling or the tool changed.'))
+    parser.add_option('', '--hash-inputs', dest='hash_inputs', action='store_true',
+                      default=False, help=('With --incremental, compare the content of the input '
+                          'ROOT files instead of their modification time and size.'))
+    parser.add_option('', '--profile-report', dest='profile_report', type='string',
+                      default=None, help=('Measure wall time, CPU time and peak memory growth of '
+                          'all the build stages and write them to this json file.'))
+    parser.add_option('', '--dataset-cache-dir', dest='dataset_cache_dir', type='string',
+                      default=DatasetCache.DEFAULT_CACHE_DIR,
+                      help='Directory where the selected data_obs columns are cached.')
+    parser.add_option('', '--dataset-cache-size', dest='dataset_cache_size', type='float',
+                      default=2048, help=('Maximal size of the dataset cache in MB, the least '
+                          'recently used datasets are removed.'))
+    parser.add_option('', '--no-dataset-cache', dest='no_dataset_cache', action='store_true',
+                      default=False, help='Always read data_obs from the input trees.')
     parser.add_option('-v', '--verbosity', dest='verbosity', type='int',
                       default=10, help=('Set the levelof output for all the subscripts. '
                           'Default [10] --> very verbose'))
+    parser.add_option('', '--yaml-loader', dest='yaml_loader', type='choice',
+                      choices=yaml_loader_choices, default='auto',
+                      help=('YAML loader: {0}. Default [auto] uses libyaml if available.'
+                            .format(', '.join(yaml_loader_choices))))
+    parser.add_option('', '--lazy-cfg', dest='lazy_cfg', action='store_true',
+                      default=False, help=('Resolve INSERTs only for the parts of the '
+                          'configuration which are used (e.g. only the --section section).'))
+    parser.add_option('', '--cfg-cache-dir', dest='cfg_cache_dir', type='string',
+                      default=ResolvedConfigCache.DEFAULT_CACHE_DIR,
+                      help='Directory where resolved configurations are cached.')
+    parser.add_option('', '--no-cfg-cache', dest='no_cfg_cache', action='store_true',
+                      default=False, help='Always parse the configuration files (bypass the cache).')
+    parser.add_option('', '--clear-cfg-cache', dest='clear_cfg_cache', action='store_true',
+                      default=False, help='Remove all cached configurations before running.')
 
     # store options and arguments as global variables
     global opt, args
     (opt, args) = parser.parse_args()
 
 
+def read_config(config_filename):
+    """
+    Read and resolve the configuration, using the cache of resolved configs.
+    Returns tuple (cfg_reader, full_config).
+    """
+    cfg_reader = UniversalConfigParser(file_list = config_filename)
+
+    #the resolved config is cached, it is rebuilt only if any of the files changed
+    cfg_cache = ResolvedConfigCache(opt.cfg_cache_dir)
+    full_config = None
+    if not opt.no_cfg_cache:
+        with profiler.stage('config cache load'):
+            full_config = cfg_cache.load(cfg_reader.file_list)
+    if full_config is None and not opt.no_cfg_cache:
+        #INSERT strings tokenized in the previous runs
+        add_parsed_insert_lines(cfg_cache.load_insert_lines())
+    if full_config is None and opt.lazy_cfg:
+        #only the INSERTs of the selected section are resolved (and not cached)
+        full_config = cfg_reader.get_dict(lazy = True)
+    elif full_config is None:
+        full_config = cfg_reader.get_dict()
+        if not opt.no_cfg_cache:
+            cfg_cache.store(cfg_reader.file_list, full_config,
+                            cfg_reader.get_dependencies())
+            cfg_cache.store_insert_lines(get_parsed_insert_lines())
+    return (cfg_reader, full_config)
+
+
+def get_datacard_input(full_config, section, config_filename):
+    """
+    Select the top-level section (see --section) from the full configuration,
+    or the whole configuration if section is None.
+    Returns tuple (datacard_name, datacard_input).
+    """
+    #datacard_name = os.path.basename(opt.config_filename).rstrip('.yaml')
+    datacard_name = os.path.splitext(os.path.basename(config_filename))[0]
+    datacard_input = full_config
+    if section:
+        try:
+            datacard_input = full_config[section]
+        except KeyError:
+            raise KeyError, ('Section {0} is not defined in {1}.'
+                             .format(section, config_filename))
+        datacard_name += '_' + section
+    if isinstance(datacard_input, LazyConfigDict):
+        datacard_input = datacard_input.to_dict()
+    return (datacard_name, datacard_input)
+
+
+def is_datacard_section(cfg_section):
+    """
+    True if cfg_section can be built as a datacard, i.e. it is a dictionary
+    with processes and observation.
+    """
+    return (isinstance(cfg_section, dict) and
+            'processes' in cfg_section and 'observation' in cfg_section)
+
+
+def get_lumi_scalings():
+    """
+    List of luminosity scaling factors from --scale_lumi_by.
+    """
+    try:
+        return [float(factor) for factor in opt.scale_lumi_by.split(',') if factor.strip()]
+    except ValueError:
+        raise ValueError, ('--scale_lumi_by should be a number or comma separated '
+                           'numbers, not {0}'.format(opt.scale_lumi_by))
+
+
+def make_cards(datacard_builder, lumi_scalings):
+    """
+    Make workspace and txt card(s). For more lumi scalings the workspace
+    is made once and shared by all the txt cards.
+    """
+    if len(lumi_scalings) == 1:
+        datacard_builder.scale_lumi_by(lumi_scalings[0])
+        datacard_builder.make_workspace()
+        datacard_builder.make_txt_card()
+    else:
+        datacard_builder.make_workspace()
+        datacard_builder.make_lumi_scan_txt_cards(lumi_scalings)
+
+
+def get_dataset_cache(cache_dir, max_size_MB):
+    """
+    DatasetCache in cache_dir, or None (no caching) if cache_dir is None.
+    """
+    if cache_dir is None:
+        return None
+    return DatasetCache(cache_dir, max_size_MB = max_size_MB)
+
+
+def build_datacard(job):
+    """
+    Build workspace and txt card for one job dictionary with keys:
+    datacard_name, datacard_input, config_filename, out_dir, scale_lumi_by.
+
+    Returns tuple (datacard_name, success, error_message, profile_records).
+    This is the unit of work of the batch mode, so it must not raise.
+    """
+    n_records = len(profiler.records)
+    try:
+        datacard_builder = LegoCards(datacard_input = job['datacard_input'],
+                                     datacard_name = job['datacard_name'])
+
+        datacard_builder.set_cfg_dir(job['config_filename'])
+        datacard_builder.set_out_dir(job['out_dir'])
+        datacard_builder.set_echo_txt_card(job['echo_txt_card'])
+        datacard_builder.set_build_cache(job['incremental'], job['hash_inputs'])
+        datacard_builder.set_dataset_cache(get_dataset_cache(job['dataset_cache_dir'],
+                                                             job['dataset_cache_size']))
+        make_cards(datacard_builder, job['scale_lumi_by'])
+    except Exception:
+        import traceback
+        return (job['datacard_name'], False, traceback.format_exc(),
+                profiler.records[n_records:])
+    return (job['datacard_name'], True, '', profiler.records[n_records:])
+
+
+def get_batch_inputs():
+    """
+    List of (config_filename, section_pattern) from --batch-cfg/--section
+    and from the --manifest file.
+
+    Manifest lines have the format: config_glob [section_glob ...]
+    Empty lines and lines starting with '#' are ignored.
+    """
+    import glob
+    batch_inputs = []
+
+    def add_inputs(config_pattern, section_patterns):
+        config_files = sorted(glob.glob(config_pattern))
+        if not config_files:
+            raise IOError, 'No configuration matches: {0}'.format(config_pattern)
+        for config_filename in config_files:
+            for section_pattern in (section_patterns or [None]):
+                batch_inputs.append((config_filename, section_pattern))
+
+    section_patterns = []
+    if opt.section:
+        section_patterns = [s.strip() for s in opt.section.split(',')]
+    if opt.batch_cfg:
+        for config_pattern in opt.batch_cfg.split(','):
+            add_inputs(config_pattern.strip(), section_patterns)
+    if opt.manifest:
+        with open(opt.manifest) as manifest:
+            for line in manifest:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                add_inputs(line.split()[0], line.split()[1:])
+    return batch_inputs
+
+
+def run_batch():
+    """
+    Build many cards: each configuration is read once and the cards for all
+    its selected sections are built in a pool of opt.jobs processes.
+    """
+    import fnmatch, multiprocessing
+    jobs = []
+    configs = {}
+    for config_filename, section_pattern in get_batch_inputs():
+        if config_filename not in configs:
+            configs[config_filename] = read_config(config_filename)
+        full_config = configs[config_filename][1]
+        if section_pattern is None:
+            sections = [None]
+        else:
+            #wildcards match only the card sections, not e.g. a shared anchor section
+            sections = [section for section in sorted(full_config.keys())
+                        if fnmatch.fnmatchcase(str(section), section_pattern)
+                        and is_datacard_section(full_config[section])]
+            if not sections:
+                raise KeyError, ('No section matches {0} in {1}.'
+                                 .format(section_pattern, config_filename))
+        for section in sections:
+            datacard_name, datacard_input = get_datacard_input(full_config, section,
+                                                               config_filename)
+            jobs.append({'datacard_name': datacard_name,
+                         'datacard_input': datacard_input,
+                         'config_filename': config_filename,
+                         'out_dir': opt.out_dir,
+                         'scale_lumi_by': get_lumi_scalings(),
+                         'echo_txt_card': not opt.no_card_echo,
+                         'incremental': opt.incremental,
+                         'hash_inputs': opt.hash_inputs,
+                         'dataset_cache_dir': (None if opt.no_dataset_cache
+                                               else opt.dataset_cache_dir),
+                         'dataset_cache_size': opt.dataset_cache_size})
+
+    print 'Building {0} datacards from {1} configurations with {2} processes.'.format(
+                len(jobs), len(configs), opt.jobs)
+    if opt.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(opt.jobs)
+        results = pool.map(build_datacard, jobs, chunksize = 1)
+        pool.close()
+        pool.join()
+        #the workers profiled their jobs in their own processes
+        for result in results:
+            profiler.records.extend(result[3])
+    else:
+        results = [build_datacard(job) for job in jobs]
+
+    n_failed = 0
+    print 20*"----"
+    for datacard_name, success, error_message, profile_records in results:
+        if success:
+            print '{0:<60} OK'.format(datacard_name)
+        else:
+            n_failed += 1
+            print '{0:<60} FAILED'.format(datacard_name)
+            print '\n'.join('    ' + line for line in error_message.splitlines())
+    print 20*"----"
+    print 'Datacards built: {0} succeeded, {1} failed.'.format(len(results) - n_failed, n_failed)
+    return n_failed
+
+
+def write_profile_report():
+    """
+    Print the time and memory used per stage and save all the
+    records to the --profile-report file.
+    """
+    if not opt.profile_report:
+        return
+    print 20*"----"
+    profiler.print_summary()
+    profiler.write_report(opt.profile_report)
+    print 'Profile report written to {0}'.format(opt.profile_report)
+
+
 def main():
     parseOptions()
     #read configuration
     #set the verbosity at all levels (all Loggers)
     os.environ['PYTHON_LOGGER_VERBOSITY'] =  str(opt.verbosity)
-    cfg_reader = UniversalConfigParser(file_list = opt.config_filename)
+    set_yaml_loader(opt.yaml_loader)
     pp = pprint.PrettyPrinter(indent=4)
-    full_config = cfg_reader.get_dict()
+    if opt.clear_cfg_cache:
+        ResolvedConfigCache(opt.cfg_cache_dir).clear()
 
-    #datacard_name = os.path.basename(opt.config_filename).rstrip('.yaml')
-    datacard_name = os.path.splitext(os.path.basename(opt.config_filename))[0]
+    if opt.profile_report:
+        profiler.enable()
+
+    if opt.batch_cfg or opt.manifest:
+        n_failed = run_batch()
+        write_profile_report()
+        sys.exit(1 if n_failed else 0)
+
+    cfg_reader, full_config = read_config(opt.config_filename)
+    datacard_name, full_config = get_datacard_input(full_config, opt.section,
+                                                    opt.config_filename)
     datacard_builder = LegoCards(datacard_input = full_config,
                                  datacard_name = datacard_name)
 
     datacard_builder.set_cfg_dir(opt.config_filename)
     datacard_builder.set_out_dir(opt.out_dir)
-    datacard_builder.scale_lumi_by(opt.scale_lumi_by)
-    datacard_builder.make_workspace()
-    datacard_builder.make_txt_card()
+    datacard_builder.set_echo_txt_card(not opt.no_card_echo)
+    datacard_builder.set_build_cache(opt.incremental, opt.hash_inputs)
+    datacard_builder.set_dataset_cache(get_dataset_cache(
+                    None if opt.no_dataset_cache else opt.dataset_cache_dir,
+                    opt.dataset_cache_size))
+    make_cards(datacard_builder, get_lumi_scalings())
 
 
 
@@ -894,6 +1345,7 @@ def main():
     filename_full_cfg = os.path.splitext(opt.config_filename)[0]+'_full_cfg'
     cfg_reader.dump_to_yaml(filename_full_cfg+'.yaml', full_config)
     cfg_reader.dump_to_json(filename_full_cfg+'.json', full_config)
+    write_profile_report()
 
 
 
@@ -0,0 +1,68 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - run RooWorkspace factory statements only once per workspace
+#    - report conflicting definitions of the same object
+#-------------------------------------------------------------------------------
+import sys, os, re
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)))
+from lib.util.Logger import Logger
+
+
+class FactoryRegistry(object):
+    """
+    Wraps RooWorkspace::factory. Statements are normalized (all white space
+    removed) and a statement which was already built in the workspace is
+    skipped. Configurations often repeat the same definitions through INSERT
+    or YAML anchors (e.g. the same observable under every process).
+
+    If the same object name is defined again with a different statement,
+    a warning is logged and the statement is passed to the factory, which
+    then complains as before.
+    """
+    p_object_name = re.compile(r'^(?:\w+::)?(?P<name>\w+)[\[\(]')
+
+    def __init__(self, workspace):
+        self.my_logger = Logger()
+        self.log = self.my_logger.getLogger(self.__class__.__name__, 10)
+        self.w = workspace
+        self.statements = {}  #normalized statement -> object name
+        self.definitions = {}  #object name -> normalized statement
+        self.n_calls = 0
+        self.n_skipped = 0
+
+    def normalize(self, statement):
+        return re.sub(r'\s+', '', str(statement))
+
+    def get_object_name(self, statement):
+        """
+        Name of the object defined by the (normalized) statement,
+        e.g. 'mass4l' for 'mass4l[105,140]' or 'sig' for 'RooDoubleCB::sig(...)'.
+        Returns None if it cannot be found.
+        """
+        m_name = self.p_object_name.match(statement)
+        return m_name.group('name') if m_name else None
+
+    def factory(self, statement):
+        """
+        Calls self.w.factory(statement) unless the same statement was already built.
+        """
+        self.n_calls += 1
+        normalized = self.normalize(statement)
+        if normalized in self.statements:
+            self.n_skipped += 1
+            self.log.debug('Skipping already built factory statement: {0}'.format(statement))
+            name = self.statements[normalized]
+            return self.w.obj(name) if name else None
+
+        name = self.get_object_name(normalized)
+        if name in self.definitions:
+            self.log.warn('Conflicting definition of <{0}>:\n    built: {1}\n    new:   {2}'
+                          .format(name, self.definitions[name], normalized))
+        elif name:
+            self.definitions[name] = normalized
+        self.statements[normalized] = name
+        return self.w.factory(statement)
+
+    def report(self):
+        self.log.info('Factory statements: {0} requested, {1} built, {2} duplicates skipped.'
+                      .format(self.n_calls, self.n_calls - self.n_skipped, self.n_skipped))
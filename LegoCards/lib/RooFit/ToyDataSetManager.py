@@ -7,12 +7,52 @@
 #    - produce toys datasets from MC by selecting events.
 #-------------------------------------------------------------------------------
 import sys, os, pprint
-from ROOT import RooAbsData, RooArgSet, RooArgList, RooDataSet
+from ROOT import RooAbsData, RooArgSet, RooArgList, RooDataSet, RooDataHist
 from ROOT import RooFit, RooWorkspace, RooRealVar, gSystem
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)))
 from lib.util.Logger import Logger
 from lib.RootHelpers.RootHelperBase import RootHelperBase
 
+#C++ loop adding the rows of a row-major buffer of doubles to a RooDataSet,
+#compiled by the interpreter on first use (see _get_fill_dataset_function).
+_FILL_DATASET_CODE = """
+#include "RooDataSet.h"
+#include "RooArgList.h"
+#include "RooArgSet.h"
+#include "RooRealVar.h"
+void LegoCards_fill_dataset(RooDataSet& dataset, const RooArgList& variables,
+                            const double* rows, long n_rows)
+{
+    const int n_vars = variables.getSize();
+    RooArgSet row(variables);
+    for (long i_row = 0; i_row < n_rows; ++i_row) {
+        for (int i_var = 0; i_var < n_vars; ++i_var)
+            static_cast<RooRealVar&>(variables[i_var]).setVal(rows[i_row * n_vars + i_var]);
+        dataset.add(row);
+    }
+}
+"""
+_fill_dataset_function = None
+
+def _get_fill_dataset_function(log):
+    """
+    Returns the compiled LegoCards_fill_dataset or False if the interpreter
+    can't compile it (e.g. ROOT 5).
+    """
+    global _fill_dataset_function
+    if _fill_dataset_function is None:
+        _fill_dataset_function = False
+        try:
+            from ROOT import gInterpreter
+            if gInterpreter.Declare(_FILL_DATASET_CODE):
+                import ROOT
+                _fill_dataset_function = ROOT.LegoCards_fill_dataset
+        except (ImportError, AttributeError):
+            pass
+        if not _fill_dataset_function:
+            log.warn('Cannot compile the dataset filling loop, datasets are filled row by row.')
+    return _fill_dataset_function
+
 
 class ToyDataSetManager(RootHelperBase):
 
@@ -27,6 +67,7 @@ class ToyDataSetManager(RootHelperBase):
         #initialize RooFit
         gSystem.Load("libHiggsAnalysisCombinedLimit.so")
         self.output_filename = 'worskapce_with_embedded_toys.root'
+        self.dataset_cache = None
 
 
 
@@ -193,6 +234,12 @@ class ToyDataSetManager(RootHelperBase):
             - check if adding toy dataset to each channel workspace individually behaves well
               after combineCards.py.
         """
+        if self.dataset_cache:
+            #the selected columns are read from (and stored to) the dataset cache
+            return self.get_dataset_from_tree_columnar(path_to_tree, tree_variables,
+                                                       selection = weight,
+                                                       dataset_name = dataset_name,
+                                                       basket = basket)
 
         #make RooRealVars from tree_variables
         my_arg_set = RooArgSet()
@@ -223,9 +270,397 @@ class ToyDataSetManager(RootHelperBase):
 
         return self.dataset_from_tree
 
+    def _iter_tree_columns(self, path_to_tree, tree_variables, selection = "1==1",
+                           chunk_size = None, cache_size = 30*1024*1024):
+        """
+        Reads the selected values of tree_variables in chunks of chunk_size
+        tree entries (all entries at once if chunk_size is None).
+
+        Only the branches of tree_variables and of the selection are enabled
+        and read through the TTreeCache. The values are copied to NumPy arrays
+        in one TTree::Draw pass per chunk, without an intermediate selected tree.
+
+        Yields:
+        -------
+        list of NumPy arrays, one per variable, for each chunk.
+        Sets self.n_entries_read and self.n_entries_selected.
+
+        With a dataset cache (set_dataset_cache) the selected columns are
+        stored on disk and read from there if the inputs didn't change.
+        """
+        import numpy as np
+
+        cache_writer = None
+        if self.dataset_cache:
+            path_list = path_to_tree if isinstance(path_to_tree, list) else [path_to_tree]
+            cache_key = self.dataset_cache.get_key([self.get_paths(path)[0] for path in path_list],
+                                                   self.get_paths(path_list[0])[1],
+                                                   selection, tree_variables)
+            cached = self.dataset_cache.load(cache_key) if cache_key else None
+            if cached:
+                columns, meta = cached
+                self.n_entries_read = meta['n_entries']
+                self.n_entries_selected = meta['n_rows']
+                step = chunk_size or max(meta['n_rows'], 1)
+                for first_row in range(0, meta['n_rows'], step):
+                    yield [np.array(column[first_row:first_row + step]) for column in columns]
+                return
+            if cache_key:
+                cache_writer = self.dataset_cache.get_writer(cache_key, tree_variables)
+
+        try:
+            for columns in self._read_tree_columns(path_to_tree, tree_variables, selection,
+                                                   chunk_size, cache_size):
+                if cache_writer:
+                    cache_writer.append(columns)
+                yield columns
+        except:
+            if cache_writer:
+                cache_writer.abort()
+            raise
+        if cache_writer:
+            cache_writer.commit(n_entries = self.n_entries_read, selection = selection)
+
+    def _read_tree_columns(self, path_to_tree, tree_variables, selection, chunk_size, cache_size):
+        """
+        Reading of the tree for _iter_tree_columns.
+        """
+        import re
+        import numpy as np
+
+        my_tree = self.get_TTree(path_to_tree)
+        n_entries = my_tree.GetEntries()
+
+        #prune branches: tree variables and everything used in the selection
+        my_tree.SetBranchStatus('*', 0)
+        used_branches = []
+        for branch in my_tree.GetListOfBranches():
+            branch_name = branch.GetName()
+            if (branch_name in tree_variables or
+                    re.search(r'\b{0}\b'.format(re.escape(branch_name)), selection)):
+                my_tree.SetBranchStatus(branch_name, 1)
+                used_branches.append(branch_name)
+        missing = [var_name for var_name in tree_variables if var_name not in used_branches]
+        if missing:
+            raise NameError, 'Branches {0} do not exist in {1}'.format(missing, path_to_tree)
+        my_tree.SetCacheSize(cache_size)
+        for branch_name in used_branches:
+            my_tree.AddBranchToCache(branch_name, True)
+        self.log.debug('Reading branches {0} of {1}'.format(used_branches, path_to_tree))
+
+        if not chunk_size:
+            chunk_size = max(n_entries, 1)
+        #the Draw buffers are allocated once for the largest chunk
+        my_tree.SetEstimate(min(chunk_size, n_entries) + 1)
+        self.n_entries_read = 0
+        self.n_entries_selected = 0
+        for first_entry in range(0, n_entries, chunk_size):
+            n_selected = my_tree.Draw(':'.join(tree_variables), selection, 'goff',
+                                      chunk_size, first_entry)
+            if n_selected < 0:
+                raise RuntimeError, 'Cannot evaluate selection {0} on {1}'.format(selection,
+                                                                                   path_to_tree)
+            columns = []
+            for i_var in range(len(tree_variables)):
+                values = my_tree.GetVal(i_var)
+                try:
+                    values.SetSize(n_selected)
+                except AttributeError:  #newer PyROOT returns sized views
+                    values.reshape((n_selected,))
+                columns.append(np.array(np.frombuffer(values, dtype = np.float64,
+                                                      count = n_selected)))
+            self.n_entries_read += min(chunk_size, n_entries - first_entry)
+            self.n_entries_selected += n_selected
+            yield columns
+
+    def _make_arg_set(self, tree_variables, binning = None):
+        """
+        RooArgSet of RooRealVars for tree_variables. With binning
+        {var_name: [n_bins, min, max]} the variables get the range and bins.
+        """
+        my_arg_set = RooArgSet()
+        my_rrv = dict()
+        for var_name in tree_variables:
+            if binning:
+                n_bins, var_min, var_max = binning[var_name]
+                my_rrv[var_name] = RooRealVar(var_name, var_name, var_min, var_max)
+                my_rrv[var_name].setBins(int(n_bins))
+            else:
+                my_rrv[var_name] = RooRealVar(var_name,var_name,-999999999,999999999)
+            my_arg_set.add(my_rrv[var_name])
+        self.current_arg_set = my_arg_set
+        self.current_rrv = my_rrv
+        return my_arg_set
+
+    def _fill_dataset(self, dataset, tree_variables, columns):
+        """
+        Append the rows of the columns to the RooDataSet. All the rows are
+        added in one compiled loop over the NumPy buffer; rows are added one
+        by one from python only if the loop can't be compiled.
+        """
+        import numpy as np
+        if not len(columns[0]):
+            return
+        rrv_list = [self.current_rrv[var_name] for var_name in tree_variables]
+        fill_function = _get_fill_dataset_function(self.log)
+        if fill_function:
+            rows = np.ascontiguousarray(np.column_stack(columns), dtype = np.float64)
+            ral_variables = RooArgList()
+            for rrv in rrv_list:
+                ral_variables.add(rrv)
+            fill_function(dataset, ral_variables, rows.ravel(), len(rows))
+            return
+        for row in zip(*[column.tolist() for column in columns]):
+            for rrv, value in zip(rrv_list, row):
+                rrv.setVal(value)
+            dataset.add(self.current_arg_set)
+
+    def _fill_datahist(self, datahist, tree_variables, binning, counts):
+        """
+        Set the bin contents of RooDataHist from the NumPy array of counts
+        (as returned by numpy.histogramdd with the same binning).
+        """
+        import numpy as np
+        rrv_list = [self.current_rrv[var_name] for var_name in tree_variables]
+        bin_centers = []
+        for var_name in tree_variables:
+            n_bins, var_min, var_max = binning[var_name]
+            edges = np.linspace(var_min, var_max, int(n_bins) + 1)
+            bin_centers.append((0.5 * (edges[1:] + edges[:-1])).tolist())
+        for bin_index in zip(*np.nonzero(counts)):
+            for rrv, centers, i_bin in zip(rrv_list, bin_centers, bin_index):
+                rrv.setVal(centers[i_bin])
+            datahist.add(self.current_arg_set, float(counts[bin_index]))
+
+    def _log_read_rate(self, dataset_name, start):
+        import time
+        elapsed = time.time() - start
+        self.log.info('{0}: {1} of {2} entries selected in {3:.2f} s ({4:.0f} entries/s)'
+                      .format(dataset_name, self.n_entries_selected, self.n_entries_read, elapsed,
+                              self.n_entries_read / elapsed if elapsed > 0 else 0.))
+
+    def get_dataset_from_tree_columnar(self, path_to_tree, tree_variables, selection = "1==1",
+                                       dataset_name = "my_dataset", basket = True,
+                                       cache_size = 30*1024*1024):
+        """
+        Creates RooDataSet from a plain root tree, like get_dataset_from_tree, but
+        reads only what is needed:
+        - only the branches of tree_variables and of the selection are enabled
+          and read through the TTreeCache
+        - the selected values are copied to NumPy arrays in one TTree::Draw pass
+          (no intermediate selected tree) and filled directly into RooDataSet
+          by one compiled loop (see benchmarks/bench_dataset_from_tree.py)
+
+        Returns:
+        --------
+        - RooDataSet
+        - also fills the basket with datasets (basket inhereted from RootHelperBase class)
+        """
+        import time
+        start = time.time()
+
+        my_arg_set = self._make_arg_set(tree_variables)
+        self.dataset_from_tree = RooDataSet(dataset_name, dataset_name, my_arg_set)
+        for columns in self._iter_tree_columns(path_to_tree, tree_variables, selection,
+                                               cache_size = cache_size):
+            self._fill_dataset(self.dataset_from_tree, tree_variables, columns)
+        self._log_read_rate(dataset_name, start)
+
+        #add dataset to basket
+        if basket:
+            self.add_to_basket(self.dataset_from_tree, new_name = dataset_name, new_title = dataset_name)
+
+        return self.dataset_from_tree
+
+    def get_dataset_from_tree_streaming(self, path_to_tree, tree_variables, selection = "1==1",
+                                        dataset_name = "my_dataset", binning = None,
+                                        max_memory_MB = 500, basket = True):
+        """
+        Creates RooDataSet (or RooDataHist with binning) from trees which
+        don't fit in memory. The TChain is read in chunks of entries, the
+        selection is applied per chunk and the selected values are appended
+        to the output. The chunk size follows from max_memory_MB, so the
+        memory used for reading does not depend on the size of the input.
+
+        The unbinned RooDataSet itself still holds all the selected rows in
+        memory (RooFit keeps the data of a RooDataSet in memory, also with
+        the tree storage), so only the binned output has a fixed size.
+
+        binning: {var_name: [n_bins, min, max]} for all tree_variables.
+                 The chunks are histogrammed with NumPy and only the bin
+                 contents are kept, so also the output has a fixed size.
+                 Entries outside of the binning range [min, max) are dropped.
+
+        Returns:
+        --------
+        - RooDataSet or RooDataHist
+        - also fills the basket with datasets (basket inhereted from RootHelperBase class)
+        """
+        import time
+        import numpy as np
+        start = time.time()
+
+        #per selected value: Draw buffer, NumPy copy and python float when filling
+        bytes_per_entry = 64 * (len(tree_variables) + 1)
+        chunk_size = max(1000, int(max_memory_MB * 1024 * 1024 / bytes_per_entry))
+        self.log.debug('Reading {0} in chunks of {1} entries.'.format(path_to_tree, chunk_size))
+
+        my_arg_set = self._make_arg_set(tree_variables, binning)
+        if binning:
+            edges = [np.linspace(binning[var_name][1], binning[var_name][2],
+                                 int(binning[var_name][0]) + 1) for var_name in tree_variables]
+            counts = np.zeros([len(var_edges) - 1 for var_edges in edges])
+            upper_edges = np.array([var_edges[-1] for var_edges in edges])
+            self.dataset_from_tree = RooDataHist(dataset_name, dataset_name, my_arg_set)
+        else:
+            self.dataset_from_tree = RooDataSet(dataset_name, dataset_name, my_arg_set)
+
+        for columns in self._iter_tree_columns(path_to_tree, tree_variables, selection,
+                                               chunk_size = chunk_size):
+            if binning:
+                values = np.column_stack(columns)
+                #histogramdd counts x == max in the last bin, RooFit ranges exclude it
+                values = values[np.all(values < upper_edges, axis = 1)]
+                counts += np.histogramdd(values, bins = edges)[0]
+            else:
+                self._fill_dataset(self.dataset_from_tree, tree_variables, columns)
+        if binning:
+            self._fill_datahist(self.dataset_from_tree, tree_variables, binning, counts)
+        self._log_read_rate(dataset_name, start)
+
+        #add dataset to basket
+        if basket:
+            self.add_to_basket(self.dataset_from_tree, new_name = dataset_name, new_title = dataset_name)
+
+        return self.dataset_from_tree
+
+    def set_dataset_cache(self, dataset_cache):
+        """
+        Use the DatasetCache for the selected datasets (None to disable).
+        """
+        self.dataset_cache = dataset_cache
+
+    def generate_toys(self, workspace_path, pdf, n_toys, n_events, seed = 1234,
+                      observables = None, extended = False, n_jobs = None,
+                      output_filename = None):
+        """
+        Generate n_toys toy datasets with n_events each from the pdf in the
+        workspace and write them to output_filename as toy_0, toy_1, ...
+
+        The toys are split to n_jobs shards (MiscTools.get_ranges) generated in a
+        pool of processes, each writing its own file, and the files are merged
+        at the end. Every toy has its own seed derived from seed and the toy
+        index, so the toys don't depend on the number of jobs.
+
+        Parameters:
+        -----------
+        workspace_path : path/to/file.root/workspace_name
+        pdf            : name of the pdf in the workspace
+        observables    : names of the observables to generate. By default the
+                         observables of data_obs in the workspace.
+        extended       : Poisson fluctuate the number of events around n_events.
+        n_jobs         : number of processes, by default the number of cores.
+
+        Returns:
+        --------
+        name of the output file.
+        """
+        import multiprocessing
+        import lib.util.MiscTools as misc
+
+        assert n_toys > 0, 'Number of toys has to be positive, not {0}'.format(n_toys)
+        if not output_filename:
+            output_filename = 'toys_{0}_{1}x{2}_seed{3}.root'.format(pdf, n_toys, n_events, seed)
+        n_jobs = min(n_jobs or multiprocessing.cpu_count(), n_toys)
+        shards = []
+        for i_shard, (first_toy, last_toy) in enumerate(misc.get_ranges(n_toys, n_jobs)):
+            shard_filename = '{0}.shard{1}.root'.format(os.path.splitext(output_filename)[0], i_shard)
+            shards.append({'workspace_path': workspace_path, 'pdf': pdf,
+                           'first_toy': first_toy, 'last_toy': last_toy,
+                           'n_events': n_events, 'seed': seed, 'observables': observables,
+                           'extended': extended, 'output_filename': shard_filename})
+        self.log.info('Generating {0} toys of {1} in {2} processes.'.format(n_toys, pdf, n_jobs))
+
+        try:
+            if n_jobs > 1:
+                pool = multiprocessing.Pool(n_jobs)
+                try:
+                    shard_filenames = pool.map(_generate_toys_shard, shards, chunksize = 1)
+                    pool.close()
+                except:
+                    #don't wait for the other shards if one fails
+                    pool.terminate()
+                    raise
+                finally:
+                    pool.join()
+            else:
+                shard_filenames = [self.generate_toys_shard(**shards[0])]
+            self.merge_toys(shard_filenames, output_filename)
+        finally:
+            #also the shards written before a failure
+            for shard in shards:
+                if os.path.exists(shard['output_filename']):
+                    os.remove(shard['output_filename'])
+        self.log.info('{0} toys written to {1}'.format(n_toys, output_filename))
+        return output_filename
+
+    def generate_toys_shard(self, workspace_path, pdf, first_toy, last_toy, n_events, seed,
+                            observables = None, extended = False, output_filename = None):
+        """
+        Generate toys first_toy ... last_toy (including) to output_filename.
+        This is the unit of work of generate_toys().
+        """
+        from ROOT import TFile, RooRandom
+
+        ws = self.get_object(path = workspace_path, object_type = RooWorkspace, clone = False)
+        the_pdf = ws.pdf(pdf)
+        if not the_pdf:
+            raise NameError, 'There is no pdf {0} in {1}'.format(pdf, workspace_path)
+        if not observables:
+            if not ws.data('data_obs'):
+                raise AttributeError, ('Observables are needed to generate toys: there is no '
+                                       'data_obs in {0}'.format(workspace_path))
+            observables = ws.data('data_obs').get().contentsString().split(',')
+        obs_set = RooArgSet()
+        for obs in observables:
+            obs_set.add(ws.var(obs))
+
+        output_file = TFile.Open(output_filename, 'RECREATE')
+        for i_toy in range(first_toy, last_toy + 1):
+            #seed 0 would mean a random seed in TRandom3
+            RooRandom.randomGenerator().SetSeed((seed * 1000003 + i_toy) % 4294967295 + 1)
+            toy = the_pdf.generate(obs_set, n_events, RooFit.Extended(extended))
+            toy.SetName('toy_{0}'.format(i_toy))
+            output_file.cd()
+            toy.Write()
+        output_file.Close()
+        self.log.debug('Toys {0}-{1} written to {2}'.format(first_toy, last_toy, output_filename))
+        return output_filename
+
+    def merge_toys(self, toys_filenames, output_filename):
+        """
+        Copy all toys from toys_filenames to one file.
+        """
+        from ROOT import TFile
+        output_file = TFile.Open(output_filename, 'RECREATE')
+        for toys_filename in toys_filenames:
+            toys_file = TFile.Open(toys_filename, 'READ')
+            for key in toys_file.GetListOfKeys():
+                toy = key.ReadObj()
+                output_file.cd()
+                toy.Write(key.GetName())
+            toys_file.Close()
+        output_file.Close()
+
     def get_current_arg_set(self):
         """
         Return last dataset setup used by get_dataset_from_tree().
         """
         return self.current_arg_set
 
+
+def _generate_toys_shard(shard):
+    """
+    Worker of ToyDataSetManager.generate_toys (must be picklable).
+    """
+    return ToyDataSetManager().generate_toys_shard(**shard)
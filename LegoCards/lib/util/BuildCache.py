@@ -0,0 +1,95 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - fingerprints of built datacards (workspace, txt card) kept next to them
+#    - outputs are rebuilt only if their configuration, inputs or the tool changed
+#-------------------------------------------------------------------------------
+import os, hashlib, json
+from Logger import Logger
+
+_tool_versions = {}
+
+
+def get_tool_version(source_dir):
+    """
+    Hash of all the python sources of the tool below source_dir.
+    Any change of the code invalidates the fingerprints.
+    """
+    source_dir = os.path.abspath(source_dir)
+    if source_dir not in _tool_versions:
+        tool_hash = hashlib.sha1()
+        for dir_path, dir_names, file_names in os.walk(source_dir):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.endswith('.py'):
+                    file_path = os.path.join(dir_path, file_name)
+                    tool_hash.update(os.path.relpath(file_path, source_dir))
+                    with open(file_path, 'rb') as fd:
+                        tool_hash.update(fd.read())
+        _tool_versions[source_dir] = tool_hash.hexdigest()
+    return _tool_versions[source_dir]
+
+
+class BuildCache(object):
+    """
+    Keeps <output>.fingerprint json files with the fingerprint of the inputs
+    from which <output> was built (and optional extra information).
+
+    The fingerprint is the hash of:
+        - the resolved configuration section
+        - the input files (path, mtime and size, or the content with hash_inputs)
+        - any other parameters (e.g. the luminosity scaling factor)
+        - the tool version
+    """
+    def __init__(self, tool_version, hash_inputs = False):
+        self.my_logger = Logger()
+        self.log = self.my_logger.getLogger(self.__class__.__name__, 10)
+        self.tool_version = tool_version
+        self.hash_inputs = hash_inputs
+
+    def get_fingerprint(self, cfg_section, input_files, **parameters):
+        fingerprint = hashlib.sha1('tool={0}'.format(self.tool_version))
+        fingerprint.update(json.dumps(cfg_section, sort_keys = True, default = str))
+        fingerprint.update(json.dumps(parameters, sort_keys = True, default = str))
+        for input_file in sorted(set(input_files)):
+            fingerprint.update(input_file)
+            if not os.path.exists(input_file):
+                fingerprint.update('missing')
+            elif self.hash_inputs:
+                with open(input_file, 'rb') as fd:
+                    for chunk in iter(lambda: fd.read(1 << 20), ''):
+                        fingerprint.update(chunk)
+            else:
+                stat = os.stat(input_file)
+                fingerprint.update('{0} {1}'.format(stat.st_mtime, stat.st_size))
+        return fingerprint.hexdigest()
+
+    def _get_stamp_path(self, output_file):
+        return output_file + '.fingerprint'
+
+    def load(self, output_file, fingerprint):
+        """
+        Returns the information stored with output_file if the output exists
+        and was built with the same fingerprint, otherwise None.
+        """
+        if not os.path.exists(output_file):
+            return None
+        try:
+            with open(self._get_stamp_path(output_file)) as fd:
+                stamp = json.load(fd)
+        except (IOError, ValueError):
+            return None
+        if stamp.get('fingerprint') != fingerprint:
+            self.log.debug('Fingerprint of {0} changed.'.format(output_file))
+            return None
+        return stamp.get('info', {})
+
+    def store(self, output_file, fingerprint, **info):
+        """
+        Store the fingerprint of the freshly built output_file.
+        """
+        stamp_path = self._get_stamp_path(output_file)
+        tmp_stamp_path = '{0}.{1}.tmp'.format(stamp_path, os.getpid())
+        with open(tmp_stamp_path, 'w') as fd:
+            json.dump({'fingerprint': fingerprint, 'info': info}, fd, indent = 4)
+        os.rename(tmp_stamp_path, stamp_path)
+        self.log.debug('Stored fingerprint {0} of {1}'.format(fingerprint, output_file))
@@ -0,0 +1,77 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - readers for JSON and INI configuration files used by UniversalConfigParser
+#    - both keep the order of the keys as in the file
+#-------------------------------------------------------------------------------
+import collections
+
+#simplejson (with C speedups) is much faster than json on python 2.
+try:
+    import simplejson as json_backend
+except ImportError:
+    import json as json_backend
+
+
+def _to_str(obj):
+    """
+    JSON strings are unicode. Convert them to str, since the rest of the
+    configuration machinery (e.g. INSERT) works with str as YAML does.
+    """
+    if isinstance(obj, dict):
+        return collections.OrderedDict((_to_str(key), _to_str(value))
+                                       for key, value in obj.iteritems())
+    elif isinstance(obj, list):
+        return [_to_str(value) for value in obj]
+    elif isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    return obj
+
+
+def parse_json(file_name):
+    """
+    Returns the content of the JSON file as OrderedDict.
+    """
+    with open(file_name, 'r') as fd:
+        return _to_str(json_backend.load(fd, object_pairs_hook = collections.OrderedDict))
+
+
+def _convert_ini_value(value):
+    """
+    INI values are strings. Convert numbers to int/float like YAML does.
+    """
+    for value_type in (int, float):
+        try:
+            return value_type(value)
+        except ValueError:
+            pass
+    return value
+
+
+class ConfigParserWrapper(object):
+    """
+    Reads INI files into dictionary of sections:
+    {section: {option: value}}
+    The case of options is kept (process names are case sensitive) and
+    there is no '%' interpolation, since it clashes with the expressions.
+    """
+    def __init__(self):
+        import ConfigParser
+        self.parser = ConfigParser.RawConfigParser(dict_type = collections.OrderedDict)
+        self.parser.optionxform = str
+
+    def load(self, fd):
+        self.parser.readfp(fd)
+        cfg_dict = collections.OrderedDict()
+        for section in self.parser.sections():
+            cfg_dict[section] = collections.OrderedDict(
+                (option, _convert_ini_value(value))
+                for option, value in self.parser.items(section))
+        return cfg_dict
+
+
+def parse_ini(file_name):
+    """
+    Returns the content of the INI file as OrderedDict of sections.
+    """
+    with open(file_name, 'r') as fd:
+        return ConfigParserWrapper().load(fd)
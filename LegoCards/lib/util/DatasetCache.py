@@ -0,0 +1,176 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - keep the selected columns of input trees on disk
+#    - skip reading the input trees when the files, the tree, the selection
+#      and the observables did not change
+#-------------------------------------------------------------------------------
+import os, glob, hashlib, json, shutil
+import numpy as np
+from Logger import Logger
+import MiscTools as misc
+
+
+class DatasetCache(object):
+    """
+    On-disk cache of selected datasets.
+
+    Every entry is a directory <key>/ with one raw float64 file per variable
+    (read back with numpy.memmap, so big entries are not loaded at once) and
+    meta.json. The key is the hash of the input files (path, mtime and size),
+    the tree name, the selection and the list of variables.
+
+    When the total size of the cache exceeds max_size_MB, the least recently
+    used entries are removed. Entries bigger than max_size_MB are not stored.
+    """
+    DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'LegoCards', 'datasets')
+
+    def __init__(self, cache_dir = None, max_size_MB = 2048):
+        self.my_logger = Logger()
+        self.log = self.my_logger.getLogger(self.__class__.__name__, 10)
+        self.cache_dir = cache_dir or self.DEFAULT_CACHE_DIR
+        self.max_size_MB = max_size_MB
+
+    def get_key(self, file_patterns, tree_name, selection, variables):
+        """
+        Key of the dataset. Returns None if any of the input files is missing,
+        then the dataset is not cached.
+        """
+        key = hashlib.sha1('tree={0}\nselection={1}\nvariables={2}'
+                           .format(tree_name, selection, ','.join(variables)))
+        input_files = []
+        for file_pattern in file_patterns:
+            input_files += sorted(glob.glob(file_pattern)) or [file_pattern]
+        for input_file in input_files:
+            try:
+                stat = os.stat(input_file)
+            except OSError:
+                return None
+            key.update('\n{0} {1} {2}'.format(os.path.abspath(input_file),
+                                              stat.st_mtime, stat.st_size))
+        return key.hexdigest()
+
+    def _get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """
+        Returns (columns, meta) for the key or None if it is not cached.
+        The columns are read-only memory maps in the order of meta['variables'].
+        """
+        entry_dir = self._get_entry_dir(key)
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        try:
+            with open(meta_path) as fd:
+                meta = json.load(fd)
+        except (IOError, ValueError):
+            return None
+        columns = []
+        for i_var in range(len(meta['variables'])):
+            column_path = os.path.join(entry_dir, '{0}.f8'.format(i_var))
+            if meta['n_rows']:
+                columns.append(np.memmap(column_path, dtype = np.float64, mode = 'r',
+                                         shape = (meta['n_rows'],)))
+            else:
+                columns.append(np.zeros(0))
+        #mark as recently used
+        os.utime(meta_path, None)
+        self.log.info('Using cached dataset {0} ({1} rows)'.format(key, meta['n_rows']))
+        return (columns, meta)
+
+    def get_writer(self, key, variables):
+        return DatasetCacheWriter(self, key, variables)
+
+    def get_size_MB(self):
+        return sum(self._get_entry_size(entry_dir) for entry_dir in self._get_entries()) / 1024. / 1024.
+
+    def _get_entries(self):
+        return [entry_dir for entry_dir in glob.glob(os.path.join(self.cache_dir, '*'))
+                if os.path.exists(os.path.join(entry_dir, 'meta.json'))]
+
+    def _get_entry_size(self, entry_dir):
+        return sum(os.path.getsize(os.path.join(entry_dir, file_name))
+                   for file_name in os.listdir(entry_dir))
+
+    def evict(self, keep = None):
+        """
+        Remove the least recently used entries until the cache fits into max_size_MB.
+        The entry of key keep (e.g. the one just stored) is never removed.
+        """
+        entries = sorted([entry_dir for entry_dir in self._get_entries()
+                          if os.path.basename(entry_dir) != keep],
+                         key = lambda entry_dir: os.path.getmtime(os.path.join(entry_dir, 'meta.json')))
+        sizes = dict((entry_dir, self._get_entry_size(entry_dir)) for entry_dir in entries)
+        total_size = sum(sizes.values())
+        if keep and os.path.exists(self._get_entry_dir(keep)):
+            total_size += self._get_entry_size(self._get_entry_dir(keep))
+        max_size = self.max_size_MB * 1024 * 1024
+        for entry_dir in entries:
+            if total_size <= max_size:
+                break
+            shutil.rmtree(entry_dir, ignore_errors = True)
+            total_size -= sizes[entry_dir]
+            self.log.debug('Evicted cached dataset {0}'.format(os.path.basename(entry_dir)))
+
+    def clear(self):
+        """
+        Remove all the cached datasets.
+        """
+        if os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+        self.log.info('Dataset cache cleared: {0}'.format(self.cache_dir))
+
+
+class DatasetCacheWriter(object):
+    """
+    Writes one cache entry chunk by chunk into a temporary directory,
+    which is renamed to the entry only in commit(). Entries of
+    interrupted reads are thus never used. Once the columns grow over
+    the max_size_MB of the cache, writing stops and nothing is stored.
+    """
+    def __init__(self, cache, key, variables):
+        self.cache = cache
+        self.key = key
+        self.variables = list(variables)
+        self.n_rows = 0
+        self.n_bytes = 0
+        self.too_big = False
+        misc.make_sure_path_exists(cache.cache_dir)
+        self.tmp_dir = '{0}.{1}.tmp'.format(cache._get_entry_dir(key), os.getpid())
+        misc.make_sure_path_exists(self.tmp_dir)
+        self.column_files = [open(os.path.join(self.tmp_dir, '{0}.f8'.format(i_var)), 'ab')
+                             for i_var in range(len(self.variables))]
+
+    def append(self, columns):
+        if self.too_big:
+            return
+        n_rows = len(columns[0]) if columns else 0
+        self.n_bytes += n_rows * len(self.variables) * 8
+        if self.n_bytes > self.cache.max_size_MB * 1024 * 1024:
+            self.cache.log.info('Dataset {0} is bigger than the cache ({1} MB), it is not cached.'
+                                .format(self.key, self.cache.max_size_MB))
+            self.too_big = True
+            self.abort()
+            return
+        for column_file, column in zip(self.column_files, columns):
+            np.asarray(column, dtype = np.float64).tofile(column_file)
+        self.n_rows += n_rows
+
+    def commit(self, **meta):
+        if self.too_big:
+            return
+        for column_file in self.column_files:
+            column_file.close()
+        meta.update({'variables': self.variables, 'n_rows': self.n_rows})
+        with open(os.path.join(self.tmp_dir, 'meta.json'), 'w') as fd:
+            json.dump(meta, fd, indent = 4)
+        entry_dir = self.cache._get_entry_dir(self.key)
+        try:
+            os.rename(self.tmp_dir, entry_dir)
+        except OSError:  #stored meanwhile by another process
+            self.abort()
+        self.cache.evict(keep = self.key)
+
+    def abort(self):
+        for column_file in self.column_files:
+            column_file.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors = True)
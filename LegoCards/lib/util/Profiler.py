@@ -0,0 +1,96 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - measure wall time, CPU time and peak memory growth of the stages of a build
+#    - per category/process records and an aggregated table per stage
+#-------------------------------------------------------------------------------
+import os, time, json, resource, collections
+from contextlib import contextmanager
+
+
+def _get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _get_peak_rss_MB():
+    #ru_maxrss is in kB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+class Profiler(object):
+    """
+    Collects one record per executed stage:
+    {stage, category, process, wall_s, cpu_s, peak_rss_increase_MB, pid}
+
+    peak_rss_increase_MB is how much the peak RSS (high-water mark) of the
+    process grew during the stage, so the stages which need the memory can
+    be found.
+
+    Only the outermost stages are recorded: a stage started inside another
+    one (e.g. parsing an INSERTed config during INSERT resolution) is
+    already measured by the enclosing stage.
+
+    Disabled by default, then stage() costs almost nothing.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self._depth = 0
+
+    def enable(self, enabled = True):
+        self.enabled = enabled
+
+    @contextmanager
+    def stage(self, stage_name, category = None, process = None):
+        """
+        Measure the code in the with-block:
+            with profiler.stage('writeToFile', category = 'ggH'):
+                ...
+        """
+        if not self.enabled or self._depth:
+            yield
+            return
+        start_wall, start_cpu, start_rss = time.time(), _get_cpu_time(), _get_peak_rss_MB()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            self.records.append({'stage': stage_name,
+                                 'category': category,
+                                 'process': process,
+                                 'wall_s': time.time() - start_wall,
+                                 'cpu_s': _get_cpu_time() - start_cpu,
+                                 'peak_rss_increase_MB': _get_peak_rss_MB() - start_rss,
+                                 'pid': os.getpid()})
+
+    def get_summary(self):
+        """
+        Records aggregated per stage, in the order the stages were first seen.
+        """
+        summary = collections.OrderedDict()
+        for record in self.records:
+            stage = summary.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0,
+                                                         'wall_s': 0., 'cpu_s': 0.,
+                                                         'peak_rss_increase_MB': 0.})
+            stage['calls'] += 1
+            stage['wall_s'] += record['wall_s']
+            stage['cpu_s'] += record['cpu_s']
+            stage['peak_rss_increase_MB'] += record['peak_rss_increase_MB']
+        return summary.values()
+
+    def print_summary(self):
+        print '{0:<32} {1:>7} {2:>10} {3:>10} {4:>18}'.format('stage', 'calls', 'wall [s]',
+                                                            'CPU [s]', 'peak RSS +[MB]')
+        for stage in self.get_summary():
+            print '{0:<32} {1:>7} {2:>10.3f} {3:>10.3f} {4:>18.1f}'.format(
+                stage['stage'], stage['calls'], stage['wall_s'], stage['cpu_s'],
+                stage['peak_rss_increase_MB'])
+
+    def write_report(self, file_name):
+        with open(file_name, 'w') as fd:
+            json.dump({'summary': self.get_summary(), 'records': self.records}, fd, indent = 4)
+
+
+#one profiler per process, shared by all the modules
+profiler = Profiler()
@@ -0,0 +1,128 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - keep fully resolved configurations (all INSERTs expanded) on disk
+#    - skip config parsing when none of the input config files changed
+#-------------------------------------------------------------------------------
+import os, hashlib, shutil
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from Logger import Logger
+import MiscTools as misc
+
+
+class ResolvedConfigCache(object):
+    """
+    Content-addressed on-disk cache of resolved configuration dictionaries
+    (and of the parsed INSERT strings, used when a configuration is parsed again).
+
+    For every top-level file list a small manifest with the list of all
+    the files it depends on (itself + transitively INSERTed files) is kept.
+    The resolved dictionary is stored under the hash of the content of all
+    those files, so any change in any of them results in a cache miss.
+    """
+    #increase when the format of the resolved dictionary changes
+    CACHE_VERSION = 1
+    DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'LegoCards', 'configs')
+
+    def __init__(self, cache_dir = None):
+        self.my_logger = Logger()
+        self.log = self.my_logger.getLogger(self.__class__.__name__, 10)
+        self.cache_dir = cache_dir or self.DEFAULT_CACHE_DIR
+
+    def _get_manifest_path(self, file_list):
+        file_list = [os.path.abspath(cfg_file) for cfg_file in file_list]
+        key = hashlib.sha1('\n'.join(file_list)).hexdigest()
+        return os.path.join(self.cache_dir, key + '.deps')
+
+    def _get_content_hash(self, dependencies):
+        """
+        Hash of the content of all dependencies. Returns None
+        if any of them is missing.
+        """
+        content_hash = hashlib.sha1('version={0}'.format(self.CACHE_VERSION))
+        for dep_file in dependencies:
+            content_hash.update(dep_file)
+            try:
+                with open(dep_file, 'rb') as fd:
+                    content_hash.update(fd.read())
+            except IOError:
+                return None
+        return content_hash.hexdigest()
+
+    def load(self, file_list):
+        """
+        Returns the resolved configuration for file_list or None if there
+        is no valid cached entry.
+        """
+        try:
+            with open(self._get_manifest_path(file_list), 'rb') as fd:
+                dependencies = pickle.load(fd)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            self.log.debug('No cached configuration for {0}'.format(file_list))
+            return None
+
+        content_hash = self._get_content_hash(dependencies)
+        if content_hash is None:
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, content_hash + '.pkl'), 'rb') as fd:
+                cfg_dict = pickle.load(fd)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            self.log.debug('Cached configuration for {0} is outdated.'.format(file_list))
+            return None
+        self.log.info('Using cached configuration {0} for {1}'.format(content_hash, file_list))
+        return cfg_dict
+
+    def store(self, file_list, cfg_dict, dependencies):
+        """
+        Store the resolved configuration cfg_dict which was built from dependencies.
+        """
+        content_hash = self._get_content_hash(dependencies)
+        if content_hash is None:
+            self.log.warn('Cannot cache configuration {0}: missing dependencies.'.format(file_list))
+            return
+        misc.make_sure_path_exists(self.cache_dir)
+        #write to temporary files and rename, so that parallel runs never read half-written files
+        for file_name, obj in [(os.path.join(self.cache_dir, content_hash + '.pkl'), cfg_dict),
+                               (self._get_manifest_path(file_list), dependencies)]:
+            tmp_file_name = '{0}.{1}.tmp'.format(file_name, os.getpid())
+            with open(tmp_file_name, 'wb') as fd:
+                pickle.dump(obj, fd, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file_name, file_name)
+        self.log.debug('Stored configuration {0} for {1}'.format(content_hash, file_list))
+
+    def _get_insert_lines_path(self):
+        return os.path.join(self.cache_dir, 'insert_lines.pkl')
+
+    def load_insert_lines(self):
+        """
+        Returns the parsed INSERT strings stored by store_insert_lines()
+        (empty dict if there are none).
+        """
+        try:
+            with open(self._get_insert_lines_path(), 'rb') as fd:
+                return pickle.load(fd)
+        except (IOError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+            return {}
+
+    def store_insert_lines(self, parsed_lines):
+        """
+        Keep the parsed INSERT strings (see UniversalConfigParser.get_parsed_insert_lines)
+        for the next parsing of any configuration.
+        """
+        misc.make_sure_path_exists(self.cache_dir)
+        file_name = self._get_insert_lines_path()
+        tmp_file_name = '{0}.{1}.tmp'.format(file_name, os.getpid())
+        with open(tmp_file_name, 'wb') as fd:
+            pickle.dump(parsed_lines, fd, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file_name, file_name)
+
+    def clear(self):
+        """
+        Remove all the cached configurations.
+        """
+        if os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+        self.log.info('Configuration cache cleared: {0}'.format(self.cache_dir))
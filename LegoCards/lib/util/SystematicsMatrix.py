@@ -0,0 +1,162 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - dense nuisance x process table of systematic uncertainties
+#    - nuisance and process names are interned to row/column indices once per
+#      block of systematics, so that merging a block is an array assignment
+#-------------------------------------------------------------------------------
+import itertools
+import numpy as np
+
+
+class SystematicsMatrix(object):
+    """
+    Systematics of one datacard as a matrix:
+        rows    - nuisances, in the order they were first seen
+        columns - processes, in the order of process_list
+    plus a column with the type of each nuisance (lnN, gmN 10, param 0 1, ...).
+
+    Sizes are kept in a float array and written as str(float(size)), as
+    the sizes from the config are. Cells which were never set are written
+    as '-' in the card. Sizes which are not floats (e.g. ints or asymmetric
+    lnN '0.95/1.05') are kept as they are in an object array of the same
+    shape (None for float cells) and written as str(size).
+    """
+    def __init__(self, process_list):
+        self.process_list = list(process_list)
+        self.process_index = dict((p_name, i_col) for i_col, p_name in enumerate(self.process_list))
+        self.nuisance_list = []
+        self.nuisance_index = {}
+        self.types = []
+        self.values = np.zeros((0, len(self.process_list)))
+        self.is_set = np.zeros((0, len(self.process_list)), dtype = bool)
+        self.raw_values = np.empty((0, len(self.process_list)), dtype = object)
+
+    def __len__(self):
+        return len(self.nuisance_list)
+
+    def __contains__(self, sys_id):
+        return sys_id in self.nuisance_index
+
+    def _intern(self, sys_id):
+        """
+        Returns the row of the nuisance, a new one is appended if needed.
+        """
+        try:
+            return self.nuisance_index[sys_id]
+        except KeyError:
+            self.nuisance_index[sys_id] = len(self.nuisance_list)
+            self.nuisance_list.append(sys_id)
+            self.types.append(None)
+            return self.nuisance_index[sys_id]
+
+    def _grow(self):
+        """
+        Add rows to the value arrays for the newly interned nuisances.
+        """
+        n_new = len(self.nuisance_list) - self.values.shape[0]
+        if n_new > 0:
+            n_processes = len(self.process_list)
+            self.values = np.vstack([self.values, np.zeros((n_new, n_processes))])
+            self.is_set = np.vstack([self.is_set, np.zeros((n_new, n_processes), dtype = bool)])
+            self.raw_values = np.vstack([self.raw_values,
+                                         np.empty((n_new, n_processes), dtype = object)])
+
+    def get_type(self, sys_id):
+        return self.types[self.nuisance_index[sys_id]]
+
+    def set_type(self, sys_id, sys_type):
+        self.types[self._intern(sys_id)] = sys_type
+
+    def update(self, types, cells):
+        """
+        Merge a block of systematics into the matrix.
+            types - iterable of (sys_id, sys_type)
+            cells - iterable of (sys_id, process, size)
+        Cells override the existing ones. One (sys_id, process) pair should
+        appear only once per block. Cells of processes which are not in
+        the card are ignored.
+
+        The names are turned to row/column indices through the index dicts
+        (with map, not a python loop per cell) and the cells are assigned
+        as arrays.
+        """
+        for sys_id, sys_type in types:
+            self.set_type(sys_id, sys_type)
+        cells = list(cells)
+        if not cells:
+            return
+
+        sys_ids, p_names, sizes = zip(*cells)
+        n_cells = len(sys_ids)
+        cols = np.array(map(self.process_index.get, p_names, [-1] * n_cells))
+        in_card = cols >= 0
+        if not in_card.all():
+            cols = cols[in_card]
+            sys_ids = tuple(itertools.compress(sys_ids, in_card))
+            sizes = tuple(itertools.compress(sizes, in_card))
+            n_cells = len(sys_ids)
+            if not n_cells:
+                return
+
+        #new nuisances are appended in the order they are first seen
+        new_sys_ids = set(sys_ids).difference(self.nuisance_index)
+        if new_sys_ids:
+            first_seen = dict(itertools.izip(reversed(sys_ids), xrange(n_cells - 1, -1, -1)))
+            for sys_id in sorted(new_sys_ids, key = first_seen.get):
+                self._intern(sys_id)
+        self._grow()
+        rows = np.array(map(self.nuisance_index.__getitem__, sys_ids))
+
+        is_float = np.array(map(isinstance, sizes, [float] * n_cells), dtype = bool)
+        raw_sizes = np.empty(n_cells, dtype = object)
+        if is_float.all():
+            float_sizes = np.array(sizes, dtype = float)
+        else:
+            sizes = np.array(sizes, dtype = object)
+            float_sizes = np.full(n_cells, np.nan)
+            float_sizes[is_float] = sizes[is_float].astype(float)
+            raw_sizes[~is_float] = sizes[~is_float]
+            for i_cell in np.flatnonzero(~is_float):
+                #ints, strings, ... (few) are converted one by one
+                try:
+                    float_sizes[i_cell] = float(sizes[i_cell])
+                except (TypeError, ValueError):
+                    pass
+
+        self.values[rows, cols] = float_sizes
+        self.is_set[rows, cols] = True
+        self.raw_values[rows, cols] = raw_sizes
+
+    def _get_cells(self):
+        """
+        All the cells of the card as strings, '-' for the cells not set.
+        """
+        self._grow()
+        cells = np.full(self.values.shape, '-', dtype = object)
+        is_raw = self.is_set & np.not_equal(self.raw_values, None)
+        is_float = self.is_set & ~is_raw
+        cells[is_float] = map(str, self.values[is_float].tolist())
+        cells[is_raw] = map(str, self.raw_values[is_raw])
+        return cells
+
+    def iter_rows(self):
+        """
+        Yields (sys_id, sys_type, [size as string per process]) for every nuisance.
+        """
+        for i_row, row_cells in enumerate(self._get_cells().tolist()):
+            yield (self.nuisance_list[i_row], self.types[i_row], row_cells)
+
+    def to_dict(self):
+        """
+        The matrix in the format of the systematics section:
+        {sys_name: {type: lnN, p1: 1.04, p2: 1.05}, ...}
+        """
+        self._grow()
+        sys_dict = {}
+        for i_row, sys_id in enumerate(self.nuisance_list):
+            sys_dict[sys_id] = {'type': self.types[i_row]}
+            for i_col in np.flatnonzero(self.is_set[i_row]):
+                raw_value = self.raw_values[i_row, i_col]
+                sys_dict[sys_id][self.process_list[i_col]] = (
+                    float(self.values[i_row, i_col]) if raw_value is None else raw_value)
+        return sys_dict
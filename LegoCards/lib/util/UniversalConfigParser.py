@@ -1,7 +1,8 @@
 
-import re, string, pdb, os.path
-from nested_dict import flatten, unflatten, filter_flatten_dict
+import re, os.path, copy, collections
+from nested_dict import flatten, unflatten, flat_dict_index
 from Logger import Logger
+from Profiler import profiler
 
 
 def update_leaf(initial_dict, update_dict):
@@ -24,6 +25,403 @@ def update_leaf(initial_dict, update_dict):
     nd_initial_dict.update(nd_update_dict)
     return nd_initial_dict.to_dict()
 
+
+#YAML loader used by all the parsers:
+# - 'auto'   : libyaml based CSafeLoader if PyYAML was built with it, otherwise SafeLoader
+# - 'c'      : CSafeLoader (falls back to SafeLoader with a warning if not available)
+# - 'python' : pure-python SafeLoader
+yaml_loader_choices = ['auto', 'c', 'python']
+_yaml_loader_name = 'auto'
+_yaml_loader_logged = False
+
+def set_yaml_loader(loader_name):
+    """
+    Select the YAML loader for all the UniversalConfigParser instances.
+    """
+    global _yaml_loader_name, _yaml_loader_logged
+    loader_name = loader_name.lower()
+    assert loader_name in yaml_loader_choices, ('YAML loader not supported. '
+            'Supported loaders are only {0}').format(yaml_loader_choices)
+    _yaml_loader_name = loader_name
+    _yaml_loader_logged = False
+
+def get_yaml_loader(log = None):
+    """
+    Returns the YAML loader class according to set_yaml_loader().
+    The choice is logged only once.
+    """
+    global _yaml_loader_logged
+    import yaml
+    loader = yaml.SafeLoader
+    message = 'Using pure-python YAML loader (SafeLoader).'
+    if _yaml_loader_name in ['auto', 'c']:
+        try:
+            loader = yaml.CSafeLoader
+        except AttributeError:
+            message = 'PyYAML is built without libyaml. Using pure-python YAML loader (SafeLoader).'
+        else:
+            message = 'Using libyaml YAML loader (CSafeLoader).'
+    if log and not _yaml_loader_logged:
+        if _yaml_loader_name == 'c' and loader is yaml.SafeLoader:
+            log.warn(message)
+        else:
+            log.info(message)
+        _yaml_loader_logged = True
+    return loader
+
+
+_yaml_dumper = None
+
+def get_yaml_dumper():
+    """
+    Returns yaml.Dumper subclass which dumps ordered dicts (JSON and INI
+    configs) as plain mappings. The class is created only once.
+    """
+    global _yaml_dumper
+    if _yaml_dumper is None:
+        import yaml
+        class OrderedDictDumper(yaml.Dumper):
+            pass
+        OrderedDictDumper.add_representer(collections.OrderedDict,
+                lambda dumper, data: dumper.represent_dict(data.items()))
+        _yaml_dumper = OrderedDictDumper
+    return _yaml_dumper
+
+
+class ParsedConfigCache(object):
+    """
+    Process-wide LRU cache of parsed (and INSERT-resolved) config documents.
+
+    Documents are keyed by (abspath, mtime, size), so a file that changes on
+    disk is parsed again. The (mtime, size) of the files a document depends on
+    (e.g. the files it INSERTs) are stored with it and a document is parsed
+    again also when any of them changes. Cached documents must be treated as
+    read-only, i.e. copy whatever you take out of them before modifying it.
+    """
+    def __init__(self, max_size=64, get_dependencies=None):
+        import collections
+        self.max_size = max_size
+        #function doc -> list of files the document depends on
+        self.get_dependencies = get_dependencies
+        self.hits = 0
+        self.misses = 0
+        self._docs = collections.OrderedDict()
+
+    def _get_key(self, file_name):
+        file_name = os.path.abspath(file_name)
+        file_stat = os.stat(file_name)
+        return (file_name, file_stat.st_mtime, file_stat.st_size)
+
+    def _get_stamps(self, dependencies):
+        stamps = []
+        for dep_file in dependencies:
+            try:
+                stamps.append(self._get_key(dep_file))
+            except OSError:
+                stamps.append((os.path.abspath(dep_file), None, None))
+        return tuple(stamps)
+
+    def _is_valid(self, key):
+        doc, stamps = self._docs[key]
+        return self._get_stamps([stamp[0] for stamp in stamps]) == stamps
+
+    def get(self, file_name, parse_function, dependencies=None):
+        """
+        Return parsed document of file_name. The parse_function(file_name)
+        is called only if the document is not cached already or any of its
+        dependencies changed. The dependencies are given explicitly or taken
+        from the document with get_dependencies.
+        """
+        key = self._get_key(file_name)
+        try:
+            if not self._is_valid(key):
+                del self._docs[key]
+            doc, stamps = self._docs.pop(key)
+        except KeyError:
+            self.misses += 1
+            doc = parse_function(file_name)
+            if dependencies is None and self.get_dependencies:
+                dependencies = self.get_dependencies(doc)
+            stamps = self._get_stamps(dependencies or [])
+        else:
+            self.hits += 1
+        #(re)inserting puts the key to the end, i.e. most recently used
+        self._docs[key] = (doc, stamps)
+        while len(self._docs) > self.max_size:
+            self._docs.popitem(last=False)
+        return doc
+
+    def contains(self, file_name):
+        try:
+            key = self._get_key(file_name)
+            return key in self._docs and self._is_valid(key)
+        except OSError:
+            return False
+
+    def clear(self):
+        self._docs.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._docs)}
+
+def _get_inserted_cfg_type(file_name):
+    """
+    INSERTed files are read according to their extension, YAML by default.
+    """
+    cfg_type = os.path.splitext(file_name)[1].replace('.','').lower()
+    if cfg_type in UniversalConfigParser.supported_cfg_types:
+        return cfg_type
+    return 'yaml'
+
+def _raise_insert_cycle(cycle):
+    raise RuntimeError, ('Cyclic INSERT commands are not allowed: {0}'
+                         .format(' -> '.join(cycle)))
+
+#abspaths of the INSERTed files being parsed, innermost last. Catches cycles
+#which are not seen by the prefetch pre-pass (lazy configuration).
+_files_being_parsed = []
+
+def _parse_inserted_cfg(file_name):
+    """
+    Returns tuple (cfg_dict, list of files INSERTed into file_name).
+    """
+    file_name = os.path.abspath(file_name)
+    if file_name in _files_being_parsed:
+        _raise_insert_cycle(_files_being_parsed[_files_being_parsed.index(file_name):] + [file_name])
+    _files_being_parsed.append(file_name)
+    try:
+        another_cfg_reader = UniversalConfigParser(cfg_type=_get_inserted_cfg_type(file_name),
+                                                   file_list = file_name)
+        cfg_dict = another_cfg_reader.get_dict(prefetch = False)
+    finally:
+        _files_being_parsed.pop()
+    return (cfg_dict, another_cfg_reader.inserted_files)
+
+#one cache for the whole process: each INSERTed file is parsed once per build.
+#The documents depend on the files they INSERT themselves.
+parsed_cfg_cache = ParsedConfigCache(get_dependencies = lambda doc: doc[1])
+
+#wildcard index of the flatten documents from parsed_cfg_cache, built on first use
+flat_index_cache = ParsedConfigCache()
+
+#raw (not yet INSERT-resolved) documents read by the prefetch pre-pass, keyed by
+#abspath. Each one is taken out (once) by _get_dict_yaml.
+_prefetched_docs = {}
+#number of threads used to read INSERTed files concurrently
+insert_prefetch_threads = 8
+
+def _find_inserted_files(obj):
+    """
+    Returns the list of file names (as written in the config, i.e. relative to
+    it) used by INSERT statements anywhere in obj.
+    """
+    inserted_files = []
+    if isinstance(obj, dict):
+        for value in obj.itervalues():
+            inserted_files += _find_inserted_files(value)
+    elif isinstance(obj, list):
+        for value in obj:
+            inserted_files += _find_inserted_files(value)
+    elif isinstance(obj, str):
+        parsed_line = parse_insert_line(obj)
+        if parsed_line is None:
+            return inserted_files
+        for tok in parsed_line.segments:
+            if (isinstance(tok, InsertToken) and tok.file_name != 'THIS_CONFIG'
+                    and tok.file_name not in inserted_files):
+                inserted_files.append(tok.file_name)
+    return inserted_files
+
+def _load_raw_cfg(file_name):
+    cfg_type = _get_inserted_cfg_type(file_name)
+    if cfg_type == 'json':
+        import lib.util.ConfigHelpers as ch
+        return ch.parse_json(file_name)
+    elif cfg_type == 'ini':
+        import lib.util.ConfigHelpers as ch
+        return ch.parse_ini(file_name)
+    elif cfg_type == 'xml':
+        import lib.util.XmlDictConverter as xmlc
+        return xmlc.ConvertXmlToDictStreaming(file_name)
+    import yaml
+    with open(file_name,'r') as fd:
+        return yaml.load(fd, Loader = get_yaml_loader())
+
+
+#parsed form of a string with INSERT commands:
+# - segments: literal strings and InsertToken items, in order of appearance
+# - is_single_insert: the whole string is one INSERT, so any object can be inserted
+InsertToken = collections.namedtuple('InsertToken', ['file_name', 'keys', 'use_fnmatch'])
+ParsedInsertLine = collections.namedtuple('ParsedInsertLine', ['segments', 'is_single_insert'])
+
+_p_insert = re.compile(r"INSERT\((.+?)\)")
+_p_wildcards = re.compile(r'[\*\?\[\]\,]')  #wildcards possible '*?[],'
+#LRU cache of parsed INSERT strings, see parse_insert_line
+_parsed_insert_lines = collections.OrderedDict()
+max_parsed_insert_lines = 65536
+
+_p_path_wildcards = re.compile(r'[\*\?\[]')
+_compiled_path_segments = {}
+
+def _compile_path_segment(segment):
+    try:
+        return _compiled_path_segments[segment]
+    except KeyError:
+        import fnmatch
+        _compiled_path_segments[segment] = re.compile(fnmatch.translate(segment)).match
+        return _compiled_path_segments[segment]
+
+def parse_insert_line(line):
+    """
+    Tokenize a config string once. Returns None if there is no INSERT in it,
+    otherwise ParsedInsertLine. Results are kept in an LRU cache of at most
+    max_parsed_insert_lines strings.
+    """
+    if 'INSERT(' not in line:
+        return None
+    try:
+        parsed_line = _parsed_insert_lines.pop(line)
+    except KeyError:
+        parsed_line = _tokenize_insert_line(line)
+    #(re)inserting puts the line to the end, i.e. most recently used
+    _parsed_insert_lines[line] = parsed_line
+    if len(_parsed_insert_lines) > max_parsed_insert_lines:
+        _parsed_insert_lines.popitem(last=False)
+    return parsed_line
+
+def _tokenize_insert_line(line):
+    segments = []
+    last_end = 0
+    for match in _p_insert.finditer(line):
+        tok = match.group(1)
+        #raise error if using multiple enclosed INSERT commands INSERT(INSERT()...)
+        if 'INSERT(' in tok:
+            raise RuntimeError, ('Multiple-level INSERT commands are not allowed. '
+                                 'Check your configuration files.')
+        if match.start() > last_end:
+            segments.append(line[last_end:match.start()])
+        inputs = tok.split(':')
+        segments.append(InsertToken(file_name = inputs[0],
+                                    keys = tuple(inputs[1:]),
+                                    use_fnmatch = bool(_p_wildcards.search(''.join(inputs[1:])))))
+        last_end = match.end()
+    if not segments:
+        return None
+    if last_end < len(line):
+        segments.append(line[last_end:])
+    return ParsedInsertLine(segments = tuple(segments),
+                            is_single_insert = (len(segments)==1 and
+                                                isinstance(segments[0], InsertToken)))
+
+def get_parsed_insert_lines():
+    """
+    Copy of the cache of parsed INSERT strings, e.g. to be kept on disk.
+    """
+    return collections.OrderedDict(_parsed_insert_lines)
+
+def add_parsed_insert_lines(parsed_lines):
+    """
+    Fill the cache of parsed INSERT strings (from get_parsed_insert_lines)
+    so the strings are not tokenized again.
+    """
+    for line, parsed_line in parsed_lines.iteritems():
+        if line not in _parsed_insert_lines:
+            _parsed_insert_lines[line] = parsed_line
+    while len(_parsed_insert_lines) > max_parsed_insert_lines:
+        _parsed_insert_lines.popitem(last=False)
+
+def _lazy_resolve(value, cfg_parser):
+    """
+    Wraps dicts and lists into lazy containers and resolves INSERT strings.
+    """
+    if isinstance(value, (LazyConfigDict, LazyConfigList)):
+        return value
+    if isinstance(value, dict):
+        return LazyConfigDict(value, cfg_parser)
+    if isinstance(value, list):
+        return LazyConfigList(value, cfg_parser)
+    if isinstance(value, str) and parse_insert_line(value):
+        return cfg_parser._insert_value(value)
+    return value
+
+def _materialize(value):
+    if isinstance(value, LazyConfigDict):
+        return value.to_dict()
+    if isinstance(value, LazyConfigList):
+        return value.to_list()
+    return value
+
+
+class LazyConfigDict(dict):
+    """
+    Configuration dictionary which resolves INSERT statements only when the
+    value is read (see UniversalConfigParser.get_dict(lazy=True)). Resolved
+    values are stored back, so each INSERT is resolved only once.
+
+    Use to_dict() to get a fully resolved plain dictionary, e.g. before
+    dumping it or giving it to code which reads it with dict internals.
+    """
+    def __init__(self, raw_dict, cfg_parser):
+        dict.__init__(self, raw_dict)
+        self._cfg_parser = cfg_parser
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        resolved_value = _lazy_resolve(value, self._cfg_parser)
+        if resolved_value is not value:
+            dict.__setitem__(self, key, resolved_value)
+        return resolved_value
+
+    def get(self, key, default = None):
+        if key in self:
+            return self[key]
+        return default
+
+    def iteritems(self):
+        for key in self.keys():
+            yield (key, self[key])
+
+    def itervalues(self):
+        for key in self.keys():
+            yield self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def to_dict(self):
+        return dict((key, _materialize(value)) for key, value in self.iteritems())
+
+
+class LazyConfigList(list):
+    """
+    List counterpart of LazyConfigDict.
+    """
+    def __init__(self, raw_list, cfg_parser):
+        list.__init__(self, raw_list)
+        self._cfg_parser = cfg_parser
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        value = list.__getitem__(self, idx)
+        resolved_value = _lazy_resolve(value, self._cfg_parser)
+        if resolved_value is not value:
+            list.__setitem__(self, idx, resolved_value)
+        return resolved_value
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def to_list(self):
+        return [_materialize(value) for value in self]
+
+
 class UniversalConfigParser(object):
     """
     Wraper for XML, YAML, JSON, INI which can return dictionary.
@@ -39,6 +437,8 @@ class UniversalConfigParser(object):
 	self.cfg_type = self.set_cfg_type(cfg_type)
 	self.file_list = self.set_files(file_list)
 	self.cfg_dict = {}
+	self.inserted_files = []
+	self._path_index = None
 
 
 
@@ -88,45 +488,190 @@ class UniversalConfigParser(object):
     def item(self, item_name):
 	"""Get one item from cfg dictionary.
 
-	If the item is nested, then use "." to set the path to the item.
-	Check the implementation in XmlDictConverter.py
-	"""
-	self.log.info('Not implemented yet... Sorry!')
-	pass
+	If the item is nested, then use "." to set the path to the item,
+	e.g. item('processes.ggH.rate'). List elements are addressed by
+	position, e.g. item('setup.process_names.0').
+	Segments can contain Unix style wildcards, e.g. item('processes.*.rate'),
+	in which case a dict {path: value} of all matching items is returned.
 
-    def get_dict(self, file_list=None, cfg_type=None):
+	Lookups use an index of all paths built once per get_dict().
+	"""
+	if self._path_index is None:
+	    self._build_path_index()
+	if not _p_path_wildcards.search(item_name):
+	    try:
+	        return self._path_index[item_name]
+	    except KeyError:
+	        raise KeyError, 'There is no item {0} in configuration.'.format(item_name)
+
+	segment_matches = [_compile_path_segment(segment) for segment in item_name.split('.')]
+	matching_items = {}
+	for path_segments, path in self._paths_by_depth.get(len(segment_matches), []):
+	    if all(match(segment) for match, segment in zip(segment_matches, path_segments)):
+	        matching_items[path] = self._path_index[path]
+	return matching_items
+
+    def _build_path_index(self):
+	"""
+	Index all the nodes of the configuration by their dotted path.
+	"""
+	self._path_index = {}
+	self._paths_by_depth = {}
+
+	def add_paths(obj, path_segments):
+	    if path_segments:
+	        path = '.'.join(path_segments)
+	        self._path_index[path] = obj
+	        self._paths_by_depth.setdefault(len(path_segments), []).append((path_segments, path))
+	    if isinstance(obj, dict):
+	        for key, value in obj.iteritems():
+	            add_paths(value, path_segments + (str(key),))
+	    elif isinstance(obj, list):
+	        for idx, value in enumerate(obj):
+	            add_paths(value, path_segments + (str(idx),))
+
+	add_paths(_materialize(self.cfg_dict), ())
+	self.log.debug('Path index built with {0} items.'.format(len(self._path_index)))
+
+    def get_dict(self, file_list=None, cfg_type=None, prefetch=True, lazy=False):
 	"""
 	Returns the full configuration in the form of dictionary.
+
+	With prefetch, the graph of INSERTed files is built first (cycles are
+	rejected) and all the files are read concurrently before substitution.
+
+	With lazy, a LazyConfigDict is returned and INSERTs are resolved only
+	for the values that are read. No prefetch is done in this case.
 	"""
 	if file_list:
             self.file_list = self.set_files(file_list)
         self.cfg_dict = {}
+        self.inserted_files = []
+        self._path_index = None
         if cfg_type:
             self.cfg_type = self.set_cfg_type(cfg_type)
 
 	self.log.debug('Getting dictionary from config files: %s', str(self.file_list))
-	for cfg_file in self.file_list:
-	    """
-	    We want to append dictionaries from all the config files.
-	    """
-	    self.this_cfg_dir = os.path.dirname(os.path.abspath(cfg_file))
-	    #os.environ['THIS_CFG_DIR'] =  str(self.this_cfg_dir)
-
-	    if self.cfg_type == None: self.cfg_type = self._get_cfg_type(cfg_file)
-	    self.log.debug('Updating dictionary from config file in the order provided: %s',str(cfg_file) )
-	    if self.cfg_type.lower() in ['yaml', "yml"]: self._get_dict_yaml(cfg_file)
-	    elif self.cfg_type.lower() == 'xml': self._get_dict_xml(cfg_file)
-	    elif self.cfg_type.lower() == 'json': self._get_dict_json(cfg_file)
-	    elif self.cfg_type.lower() == 'ini': self._get_dict_ini(cfg_file)
-
-
-        #check for interpreter_keywors
-        #loop on dict and update values with values from another cfg.
-        #used to input values from other cfg files.
-        self._interpret_keywords_and_update(self.cfg_dict)
+        with profiler.stage('config parse'):
+            for cfg_file in self.file_list:
+                """
+                We want to append dictionaries from all the config files.
+                """
+                self.this_cfg_dir = os.path.dirname(os.path.abspath(cfg_file))
+                #os.environ['THIS_CFG_DIR'] =  str(self.this_cfg_dir)
+
+                if self.cfg_type == None: self.cfg_type = self._get_cfg_type(cfg_file)
+                self.log.debug('Updating dictionary from config file in the order provided: %s',str(cfg_file) )
+                if self.cfg_type.lower() in ['yaml', "yml"]: self._get_dict_yaml(cfg_file)
+                elif self.cfg_type.lower() == 'xml': self._get_dict_xml(cfg_file)
+                elif self.cfg_type.lower() == 'json': self._get_dict_json(cfg_file)
+                elif self.cfg_type.lower() == 'ini': self._get_dict_ini(cfg_file)
+
+
+        if lazy:
+            self.log.debug('Returning lazy configuration. INSERTs are resolved on access.')
+            self.cfg_dict = LazyConfigDict(self.cfg_dict, self)
+            return self.cfg_dict
+
+        with profiler.stage('INSERT resolution'):
+            try:
+                if prefetch:
+                    self.get_insert_graph()
+
+                #check for interpreter_keywors
+                #loop on dict and update values with values from another cfg.
+                #used to input values from other cfg files.
+                self._interpret_keywords_and_update(self.cfg_dict)
+            finally:
+                #never leave prefetched documents for the next parser
+                if prefetch:
+                    _prefetched_docs.clear()
+        self.log.debug('Parsed config cache: {0}'.format(parsed_cfg_cache.stats()))
 
 	return self.cfg_dict
 
+    def get_dependencies(self):
+        """
+        Get abspaths of all files the configuration was built from, i.e. the
+        files from file_list and all the files they (transitively) INSERT.
+        Available after get_dict().
+        """
+        dependencies = [os.path.abspath(cfg_file) for cfg_file in self.file_list]
+        for inserted_file in self.inserted_files:
+            if inserted_file not in dependencies:
+                dependencies.append(inserted_file)
+        return dependencies
+
+    def get_insert_graph(self):
+        """
+        Scan the configuration (without resolving it) and return the graph of
+        INSERTs as {abspath_of_file: [abspaths of files it INSERTs]}.
+        The top-level configuration is under the key None.
+        Raises RuntimeError if the files INSERT each other in a cycle.
+
+        The files are read level by level, each level concurrently, and kept
+        for _get_dict_yaml so they are not read again.
+        """
+        from multiprocessing.pool import ThreadPool
+
+        def get_abspaths(file_names, cfg_dir):
+            return [os.path.abspath(os.path.join(cfg_dir, file_name))
+                    for file_name in file_names]
+
+        insert_graph = {None: get_abspaths(_find_inserted_files(self.cfg_dict),
+                                           self.this_cfg_dir)}
+        to_read = list(insert_graph[None])
+        pool = None
+        try:
+            while to_read:
+                to_read = [file_name for file_name in set(to_read) if file_name not in insert_graph]
+                for file_name in [f for f in to_read if parsed_cfg_cache.contains(f)]:
+                    #already resolved, so it can't be a part of a cycle
+                    insert_graph[file_name] = []
+                    to_read.remove(file_name)
+                if not to_read:
+                    break
+                self.log.debug('Reading {0} INSERTed files concurrently: {1}'
+                               .format(len(to_read), to_read))
+                if pool is None and len(to_read) > 1:
+                    pool = ThreadPool(insert_prefetch_threads)
+                if pool:
+                    docs = pool.map(_load_raw_cfg, to_read)
+                else:
+                    docs = [_load_raw_cfg(file_name) for file_name in to_read]
+                next_to_read = []
+                for file_name, doc in zip(to_read, docs):
+                    _prefetched_docs[file_name] = doc
+                    insert_graph[file_name] = get_abspaths(_find_inserted_files(doc),
+                                                           os.path.dirname(file_name))
+                    next_to_read += insert_graph[file_name]
+                to_read = next_to_read
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        self._check_insert_cycles(insert_graph)
+        return insert_graph
+
+    def _check_insert_cycles(self, insert_graph):
+        """
+        Depth-first search for cycles in the INSERT graph.
+        """
+        done = set()
+
+        def visit(file_name, path):
+            if file_name in path:
+                _raise_insert_cycle(path[path.index(file_name):] + [file_name])
+            if file_name in done:
+                return
+            for inserted_file in insert_graph.get(file_name, []):
+                visit(inserted_file, path + [file_name])
+            done.add(file_name)
+
+        for file_name in insert_graph[None]:
+            visit(file_name, [os.path.abspath(cfg_file) for cfg_file in self.file_list])
+
     def get_cfg_dirname(self):
         """
         Get abspath of directory where current config lives.
@@ -155,13 +700,9 @@ class UniversalConfigParser(object):
                     recursive_parse(obj[key])
 
                     ##now do the interatation
-                    if isinstance(obj[key], str):
-                        all_matches = re.findall("INSERT\((.+?)\)",str(obj[key]))
-                        #print 'all_matches_dict', all_matches
-                        if len(all_matches)>0:
-                            self.log.debug('Parsing with INSERT: {0}'.format(obj[key]))
-                            obj[key] = INSERT(obj[key])
-                            #pdb.set_trace()
+                    if isinstance(obj[key], str) and parse_insert_line(obj[key]):
+                        self.log.debug('Parsing with INSERT: {0}'.format(obj[key]))
+                        obj[key] = self._insert_value(obj[key])
 
             elif isinstance(obj, list):
                 for idx, item in list(enumerate(new_obj)):
@@ -171,108 +712,11 @@ class UniversalConfigParser(object):
                     recursive_parse(item)
 
                     ##now do the interatation
-                    if isinstance(item, str):
-                        all_matches = re.findall(r"INSERT\((.+?)\)",str(item))
-                        #print 'all_matches_list', all_matches
-                        if len(all_matches)>0:
-                            self.log.debug('Parsing with INSERT: {0}'.format(item))
-                            obj[idx] = INSERT(obj[idx])
-
-
-        def INSERT(input_line):
-            """
-            Receives the line and parses like:
-            'INSERT(path_to_file_with_yields.yaml:2e2mu:ggH)'
-            - reads config from path_to_file_with_yields.yaml
-            - gets value for full_config['2e2mu']['ggH']
-            """
-            pattern = "INSERT\((.+?)\)"
-            p = re.compile(r'''
-                    INSERT     #look for INSERT
-                    \(         #match opening (
-                    [^\(\)]*?  #match anything but ( or )
-                    \)         #match closing )
-                    ''', re.VERBOSE)
-            #tokens = p.split(input_line)
-            #matching_tokens = p.findall(input_line)
-            tokens = re.split(pattern, input_line)
-            matching_tokens = re.findall(pattern, input_line)
-
-
-            #raise error if using multiple enclosed INSERT commands INSERT(INSERT()...)
-            if p.search(p.sub('XXX',input_line)):
-                raise RuntimeError, ('Multiple-level INSERT commands are not allowed. '
-                                     'Check your configuration files.')
-
-            self.log.debug('tokens: {0}\nmatching_tokens: {1}'.format(tokens, matching_tokens))
-
-            new_input_line=''
-            enforce_string = True
-
-
-            if len(matching_tokens)==1:
-                striped_line = input_line.lstrip('INSERT(').rstrip(')')
-                if matching_tokens[0] == striped_line:
-                    #we can insert the dict or whatever object
-                    enforce_string = False
-
-            for tok in tokens:
-                if tok in matching_tokens:
-                    #now read from other config
-                    inputs = tok.split(':')
-                    filename = inputs[0]
-                    keys = inputs[1:]
-                    self.log.debug('filename = {0} keys={1}'.format(filename, keys))
-                    if filename!='THIS_CONFIG':
-                        self.log.debug('filename = {0} keys={1} this_cfg_dir={2}'
-                            .format(filename, keys, self.this_cfg_dir))
-                        filename = os.path.join(self.this_cfg_dir,
-                                                os.path.dirname(filename),
-                                                os.path.basename(filename))
-                        another_cfg_reader = UniversalConfigParser(cfg_type="YAML",
-                                                                   file_list = filename)
-                        full_config = another_cfg_reader.get_dict()
-                        #TODO check that youare notrreading the same file which is already read not to blow up the memory.
-                        #print full_config
-                        if len(keys)>0:
-                            #check if there are wildcards used
-                            #use_fnmatch = any(c in '*?[],' for c in string.join(keys))
-                            #p = re.compile(r'[\*\?\[\]\,]')  #wildcards possible '*?[],'
-                            use_fnmatch = bool(re.search(r'[\*\?\[\]\,]', string.join(keys)))
-
-                            if use_fnmatch:
-                                partial_config_flat = filter_flatten_dict(flatten(full_config),keys)
-                                partial_config = unflatten(partial_config_flat).to_dict()
-
-                                #if len(new_dict.keys)==1 return the value
-                                if len(partial_config_flat.keys())==1:
-                                    partial_config = partial_config_flat[partial_config_flat.keys()[0]]
-
-                            else:
-                                partial_config = full_config
-                                for item in keys:
-                                    #in this way we get the last item
-                                    partial_config = partial_config[item]
-
-                            if not enforce_string:
-                                return partial_config
-                            else:
-                                new_input_line+=str(partial_config)  #basically inserts value
-                        else:
-                            return full_config
-
-
-
-                    else:
-                        raise RuntimeError, 'THIS_CONFIG is not yet implemented keyword!'
+                    if isinstance(item, str) and parse_insert_line(item):
+                        self.log.debug('Parsing with INSERT: {0}'.format(item))
+                        obj[idx] = self._insert_value(obj[idx])
 
 
-                else:
-                    new_input_line+=tok
-            #print new_input_line
-            if enforce_string:
-                return new_input_line
-
         recursive_parse(this_dict)
 
 
@@ -282,32 +726,110 @@ class UniversalConfigParser(object):
         return this_dict
 
 
+    def _insert_value(self, input_line):
+        """
+        Receives the line and parses like:
+        'INSERT(path_to_file_with_yields.yaml:2e2mu:ggH)'
+        - reads config from path_to_file_with_yields.yaml
+        - gets value for full_config['2e2mu']['ggH']
+        """
+        parsed_line = parse_insert_line(input_line)
+        if parsed_line is None:
+            return input_line
+        self.log.debug('Parsed INSERT line: {0}'.format(parsed_line))
+
+        #if the line is a single INSERT we can insert the dict or whatever object
+        enforce_string = not parsed_line.is_single_insert
+        new_input_line=''
+
+        for tok in parsed_line.segments:
+            if not isinstance(tok, InsertToken):
+                new_input_line+=tok
+                continue
+
+            #now read from other config
+            filename = tok.file_name
+            keys = list(tok.keys)
+            if filename=='THIS_CONFIG':
+                raise RuntimeError, 'THIS_CONFIG is not yet implemented keyword!'
+
+            self.log.debug('filename = {0} keys={1} this_cfg_dir={2}'
+                .format(filename, keys, self.this_cfg_dir))
+            filename = os.path.join(self.this_cfg_dir,
+                                    os.path.dirname(filename),
+                                    os.path.basename(filename))
+            #each file is parsed only once; the cached document is shared
+            #so we copy whatever we insert from it.
+            full_config, nested_files = parsed_cfg_cache.get(filename,
+                                                             _parse_inserted_cfg)
+            for inserted_file in [os.path.abspath(filename)] + nested_files:
+                if inserted_file not in self.inserted_files:
+                    self.inserted_files.append(inserted_file)
+            if len(keys)==0:
+                return copy.deepcopy(full_config)
+
+            if tok.use_fnmatch:
+                flat_index = flat_index_cache.get(filename,
+                        lambda f: flat_dict_index(flatten(full_config)),
+                        dependencies = nested_files)
+                partial_config_flat = flat_index.filter(keys)
+                partial_config = unflatten(partial_config_flat).to_dict()
+
+                #if len(new_dict.keys)==1 return the value
+                if len(partial_config_flat.keys())==1:
+                    partial_config = partial_config_flat[partial_config_flat.keys()[0]]
+
+            else:
+                partial_config = full_config
+                for item in keys:
+                    #in this way we get the last item
+                    partial_config = partial_config[item]
+
+            if not enforce_string:
+                return copy.deepcopy(partial_config)
+            else:
+                new_input_line+=str(partial_config)  #basically inserts value
+
+        return new_input_line
+
+
     def _get_dict_yaml(self,file_name):
         self.log.debug('Reading yaml configuration and updating dictionary.')
         import yaml
-        with open(file_name,'r') as fd:
-            self.cfg_dict.update(yaml.load(fd))
+        try:
+            #the document may have been read already by the INSERT pre-pass
+            self.cfg_dict.update(_prefetched_docs.pop(os.path.abspath(file_name)))
+        except KeyError:
+            with open(file_name,'r') as fd:
+                self.cfg_dict.update(yaml.load(fd, Loader = get_yaml_loader(self.log)))
 
 
     def _get_dict_xml(self,file_name):
         import lib.util.XmlDictConverter as xmlc
-        self.cfg_dict.update(xmlc.ConvertXmlToDict(file_name))
+        try:
+            self.cfg_dict.update(_prefetched_docs.pop(os.path.abspath(file_name)))
+        except KeyError:
+            self.cfg_dict.update(xmlc.ConvertXmlToDictStreaming(file_name))
 
 
     def _get_dict_json(self,file_name):
-        #import json
-        #with open(file_name) as fd:
-            #self.cfg_dict.update(json.load(fd))
         import lib.util.ConfigHelpers as ch
-        self.cfg_dict.update(ch.parse_json(file_name))
-
+        if not self.cfg_dict:
+            self.cfg_dict = collections.OrderedDict()
+        try:
+            self.cfg_dict.update(_prefetched_docs.pop(os.path.abspath(file_name)))
+        except KeyError:
+            self.cfg_dict.update(ch.parse_json(file_name))
 
 
     def _get_dict_ini(self,file_name):
         import lib.util.ConfigHelpers as ch
-        ini = ch.ConfigParserWrapper()
-        with open(file_name,'r') as fd:
-            self.cfg_dict.update(ini.load(fd))
+        if not self.cfg_dict:
+            self.cfg_dict = collections.OrderedDict()
+        try:
+            self.cfg_dict.update(_prefetched_docs.pop(os.path.abspath(file_name)))
+        except KeyError:
+            self.cfg_dict.update(ch.parse_ini(file_name))
 
     def dump_to_json(self,dump_file_name, new_dict):
        import json
@@ -324,6 +846,7 @@ class UniversalConfigParser(object):
         if os.path.dirname(dump_file_name) and not os.path.exists(os.path.dirname(dump_file_name)):
                 os.makedirs(os.path.dirname(dump_file_name))
         with open(dump_file_name, 'w') as yaml_file:
-            yaml_file.write( yaml.dump(new_dict, default_flow_style=False))
+            yaml_file.write( yaml.dump(new_dict, Dumper=get_yaml_dumper(),
+                                       default_flow_style=False))
             self.log.info('Written yaml file: {0}'.format(dump_file_name))
 
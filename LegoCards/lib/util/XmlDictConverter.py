@@ -114,17 +114,7 @@ def _ConvertXmlToDictRecurse(node, dictclass):
     for child in node:
         # recursively add the element's children
         newitem = _ConvertXmlToDictRecurse(child, dictclass)
-        if nodedict.has_key(child.tag):
-            # found duplicate tag, force a list
-            if type(nodedict[child.tag]) is type([]):
-                # append to existing list
-                nodedict[child.tag].append(newitem)
-            else:
-                # convert to list
-                nodedict[child.tag] = [nodedict[child.tag], newitem]
-        else:
-            # only one, directly set the dictionary
-            nodedict[child.tag] = newitem
+        _AddChildToDict(nodedict, child.tag, newitem)
 
     if node.text is None: 
         text = ''
@@ -154,6 +144,69 @@ def ConvertXmlToDict(root, dictclass=XmlDictObject):
 
     return dictclass({root.tag: _ConvertXmlToDictRecurse(root, dictclass)})
 
+def _AddChildToDict(nodedict, tag, newitem):
+    if nodedict.has_key(tag):
+        # found duplicate tag, force a list
+        if type(nodedict[tag]) is type([]):
+            # append to existing list
+            nodedict[tag].append(newitem)
+        else:
+            # convert to list
+            nodedict[tag] = [nodedict[tag], newitem]
+    else:
+        # only one, directly set the dictionary
+        nodedict[tag] = newitem
+
+def ConvertXmlToDictStreaming(source, dictclass=XmlDictObject):
+    """
+    Converts an XML file (path or file object) to a dictionary, like
+    ConvertXmlToDict, but with iterparse: the dictionary is built while
+    parsing and every element is dropped as soon as it is converted, so
+    the full element tree is never held in memory.
+    """
+    try:
+        from xml.etree.cElementTree import iterparse
+    except ImportError:
+        from xml.etree.ElementTree import iterparse
+
+    # stack of (element, nodedict) for the elements being parsed
+    stack = []
+    root_tag, root_item = None, None
+    for event, node in iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            nodedict = dictclass()
+            if len(node.items()) > 0:
+                # if we have attributes, set them
+                nodedict.update(dict(node.items()))
+            stack.append((node, nodedict))
+            continue
+
+        node, nodedict = stack.pop()
+        if node.text is None:
+            text = ''
+        else:
+            text = node.text.strip()
+
+        if len(nodedict) > 0:
+            # if we have a dictionary add the text as a dictionary value (if there is any)
+            if len(text) > 0:
+                nodedict['_text'] = text
+        else:
+            # if we don't have child nodes or attributes, just set the text
+            nodedict = text
+
+        if stack:
+            parent, parentdict = stack[-1]
+            _AddChildToDict(parentdict, node.tag, nodedict)
+            # free the memory of the converted element
+            node.clear()
+            parent.remove(node)
+        else:
+            root_tag, root_item = node.tag, nodedict
+            node.clear()
+
+    return dictclass({root_tag: root_item})
+
 
 if __name__ == '__main__':
     main()
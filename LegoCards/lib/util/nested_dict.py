@@ -33,7 +33,7 @@ from __future__ import division
 
 
 from collections import defaultdict
-import sys, fnmatch
+import sys, fnmatch, re
 
 
 def flatten_nested_items(dictionary):
@@ -93,29 +93,66 @@ def filter_flatten_dict(dictionary, filter_tags=[]):
     Filters the flatten dictionary according to a list of tags
     with Unix style wildecards.
     """
-    #if fnmatch.fnmatch(item, 'c??'):
+    return flat_dict_index(dictionary).filter(filter_tags)
 
-    filtered_dict = {}
-    for tuple_key, val in dictionary.iteritems():
 
-        #found_tags=[]
-        found_tags=True
-        for tag in filter_tags:
-            found_tag=False
-            for item in tuple_key:
-                if fnmatch.fnmatch(str(item),tag):
-                    #print 'FOUND tag', item,tag
-                    found_tag = True
-                    #found_tags.append(True)
-                    break
-            #found_tags.append(found_tag)
-            found_tags*=found_tag
-        #print "FOUND TAGS:", bool(found_tags)
-        #if all(found_tags):
-        if found_tags:
-            filtered_dict[tuple_key] = val
-    return filtered_dict
+_compiled_tags = {}
+
+def _compile_tag(tag):
+    """
+    Unix style wildcard tag compiled to regexp (cached).
+    """
+    try:
+        return _compiled_tags[tag]
+    except KeyError:
+        _compiled_tags[tag] = re.compile(fnmatch.translate(tag)).match
+        return _compiled_tags[tag]
+
 
+class flat_dict_index(object):
+    """
+    Index of a flatten dictionary for repeated filtering with Unix style
+    wildcard tags (see filter_flatten_dict).
+
+    A tag selects the keys which have at least one element matching it, on
+    any level. Every distinct key element is indexed with the set of keys
+    containing it, so a literal tag is a dict lookup and a wildcard tag is
+    matched only against the distinct elements, not against every key.
+    """
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+        self.keys_by_item = {}
+        for tuple_key in dictionary.keys():
+            for item in tuple_key:
+                self.keys_by_item.setdefault(str(item), set()).add(tuple_key)
+
+    def _get_keys(self, tag):
+        if not any(c in tag for c in '*?['):
+            return self.keys_by_item.get(tag, set())
+        if tag == '*':
+            return None  #matches everything
+        match = _compile_tag(tag)
+        keys = set()
+        for item, item_keys in self.keys_by_item.iteritems():
+            if match(item):
+                keys.update(item_keys)
+        return keys
+
+    def filter(self, filter_tags=[]):
+        selected_keys = None
+        for tag in filter_tags:
+            tag_keys = self._get_keys(tag)
+            if tag_keys is None:
+                continue
+            if selected_keys is None:
+                selected_keys = set(tag_keys)
+            else:
+                selected_keys &= tag_keys
+            if not selected_keys:
+                return {}
+        if selected_keys is None:
+            return dict(self.dictionary)
+        return dict((tuple_key, self.dictionary[tuple_key]) for tuple_key in selected_keys)
 
 
 
@@ -0,0 +1,67 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - unit tests of the fingerprints used by the incremental builds
+#-------------------------------------------------------------------------------
+import sys, os, shutil, tempfile, unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib.util.BuildCache import BuildCache, get_tool_version
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix = 'test_build_cache_')
+        self.input_file = os.path.join(self.tmp_dir, 'input.root')
+        self.output_file = os.path.join(self.tmp_dir, 'card.txt')
+        for file_name in [self.input_file, self.output_file]:
+            with open(file_name, 'w') as fd:
+                fd.write('content')
+        self.cfg_section = {'processes': {'ggH': {'rate': 1.0}}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def touch(self, file_name, text):
+        with open(file_name, 'w') as fd:
+            fd.write(text)
+        stat = os.stat(file_name)
+        os.utime(file_name, (stat.st_atime, stat.st_mtime + 10))
+
+    def test_fingerprint_changes(self):
+        cache = BuildCache('v1')
+        fingerprint = cache.get_fingerprint(self.cfg_section, [self.input_file], lumi = 1.0)
+        self.assertEqual(fingerprint, cache.get_fingerprint(self.cfg_section, [self.input_file],
+                                                            lumi = 1.0))
+        self.assertNotEqual(fingerprint, cache.get_fingerprint(self.cfg_section, [self.input_file],
+                                                               lumi = 2.0))
+        self.assertNotEqual(fingerprint, BuildCache('v2').get_fingerprint(
+                                self.cfg_section, [self.input_file], lumi = 1.0))
+        self.assertNotEqual(fingerprint, cache.get_fingerprint({'processes': {}},
+                                                               [self.input_file], lumi = 1.0))
+        self.touch(self.input_file, 'content')
+        self.assertNotEqual(fingerprint, cache.get_fingerprint(self.cfg_section, [self.input_file],
+                                                               lumi = 1.0))
+
+    def test_hash_inputs_ignores_mtime(self):
+        cache = BuildCache('v1', hash_inputs = True)
+        fingerprint = cache.get_fingerprint(self.cfg_section, [self.input_file])
+        self.touch(self.input_file, 'content')
+        self.assertEqual(fingerprint, cache.get_fingerprint(self.cfg_section, [self.input_file]))
+        self.touch(self.input_file, 'other content')
+        self.assertNotEqual(fingerprint, cache.get_fingerprint(self.cfg_section, [self.input_file]))
+
+    def test_store_load(self):
+        cache = BuildCache('v1')
+        self.assertIsNone(cache.load(self.output_file, 'abc'))
+        cache.store(self.output_file, 'abc', n_data_obs = 8)
+        self.assertEqual(cache.load(self.output_file, 'abc'), {'n_data_obs': 8})
+        self.assertIsNone(cache.load(self.output_file, 'other'))
+        os.remove(self.output_file)
+        self.assertIsNone(cache.load(self.output_file, 'abc'))
+
+    def test_tool_version(self):
+        self.assertEqual(get_tool_version(self.tmp_dir), get_tool_version(self.tmp_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - unit tests of the JSON and INI readers and INSERT between formats
+#-------------------------------------------------------------------------------
+import sys, os, collections, unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+import lib.util.ConfigHelpers as ch
+from test_UniversalConfigParser import ConfigTestCase
+
+
+class TestParseJson(ConfigTestCase):
+
+    def test_key_order(self):
+        json_file = self.write('card.json', '{"z": 1, "a": {"y": 2, "b": 3}, "m": [1, 2]}')
+        cfg = ch.parse_json(json_file)
+        self.assertIsInstance(cfg, collections.OrderedDict)
+        self.assertEqual(cfg.keys(), ['z', 'a', 'm'])
+        self.assertEqual(cfg['a'].keys(), ['y', 'b'])
+
+    def test_unicode_to_str(self):
+        json_file = self.write('card.json', '{"name": "ggH", "list": ["a", {"key": "b"}], "rate": 1.5}')
+        cfg = ch.parse_json(json_file)
+        self.assertEqual(cfg, {'name': 'ggH', 'list': ['a', {'key': 'b'}], 'rate': 1.5})
+        for value in [cfg.keys()[0], cfg['name'], cfg['list'][0],
+                      cfg['list'][1].keys()[0], cfg['list'][1]['key']]:
+            self.assertIs(type(value), str)
+
+
+class TestParseIni(ConfigTestCase):
+
+    def test_values(self):
+        ini_file = self.write('card.ini', '\n'.join([
+            '[processes]',
+            'qqZZ = 2',
+            'ggH = 0.5',
+            'bkg_zjets = 1e-3',
+            'formula = 1.0 + 0.1*%(x)s',
+            '[setup]',
+            'category = 2e2mu',
+            '']))
+        cfg = ch.parse_ini(ini_file)
+        self.assertEqual(cfg.keys(), ['processes', 'setup'])
+        #case of the options and their order are kept
+        self.assertEqual(cfg['processes'].keys(), ['qqZZ', 'ggH', 'bkg_zjets', 'formula'])
+        self.assertEqual(cfg['processes']['qqZZ'], 2)
+        self.assertIs(type(cfg['processes']['qqZZ']), int)
+        self.assertEqual(cfg['processes']['ggH'], 0.5)
+        self.assertEqual(cfg['processes']['bkg_zjets'], 1e-3)
+        #no interpolation
+        self.assertEqual(cfg['processes']['formula'], '1.0 + 0.1*%(x)s')
+        self.assertEqual(cfg['setup']['category'], '2e2mu')
+
+
+class TestInsertBetweenFormats(ConfigTestCase):
+
+    def setUp(self):
+        ConfigTestCase.setUp(self)
+        self.write('yields.yaml', 'A: {ggH: 1.5, qqZZ: 2.5}\n')
+
+    def test_insert_yaml_into_json_and_ini(self):
+        self.write('card.json', '{"rates": "INSERT(yields.yaml:A)", "ggH": "INSERT(yields.yaml:A:ggH)"}')
+        self.assertEqual(self.parse('card.json'), {'rates': {'ggH': 1.5, 'qqZZ': 2.5}, 'ggH': 1.5})
+        self.write('card.ini', '[processes]\nggH = INSERT(yields.yaml:A:ggH)\nqqZZ = 3\n')
+        self.assertEqual(self.parse('card.ini'), {'processes': {'ggH': 1.5, 'qqZZ': 3}})
+
+    def test_insert_json_and_ini_into_yaml(self):
+        self.write('rates.json', '{"B": {"ggH": 4.5}}')
+        self.write('rates.ini', '[C]\nqqZZ = 7\n')
+        self.write('card.yaml', 'b: INSERT(rates.json:B:ggH)\nc: INSERT(rates.ini:C)\n')
+        cfg = self.parse('card.yaml')
+        self.assertEqual(cfg, {'b': 4.5, 'c': {'qqZZ': 7}})
+        self.assertIs(type(cfg['c'].keys()[0]), str)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - unit tests of the on-disk cache of selected dataset columns
+#-------------------------------------------------------------------------------
+import sys, os, time, shutil, tempfile, unittest
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib.util.DatasetCache import DatasetCache
+
+
+class TestDatasetCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix = 'test_dataset_cache_')
+        self.cache = DatasetCache(os.path.join(self.tmp_dir, 'cache'))
+        self.input_file = os.path.join(self.tmp_dir, 'data.root')
+        with open(self.input_file, 'w') as fd:
+            fd.write('tree')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_key(self, selection = 'mass4l > 100', variables = ('mass4l', 'KD')):
+        return self.cache.get_key([self.input_file], 'passedEvents', selection, variables)
+
+    def store(self, key, columns):
+        writer = self.cache.get_writer(key, ['mass4l', 'KD'])
+        for first_row in range(0, len(columns[0]), 2):
+            writer.append([column[first_row:first_row + 2] for column in columns])
+        writer.commit(n_entries = 10)
+
+    def test_key(self):
+        key = self.get_key()
+        self.assertEqual(key, self.get_key())
+        self.assertNotEqual(key, self.get_key(selection = 'mass4l > 110'))
+        self.assertNotEqual(key, self.get_key(variables = ('mass4l',)))
+        stat = os.stat(self.input_file)
+        os.utime(self.input_file, (stat.st_atime, stat.st_mtime + 10))
+        self.assertNotEqual(key, self.get_key())
+        self.assertIsNone(self.cache.get_key([os.path.join(self.tmp_dir, 'missing.root')],
+                                             'passedEvents', '1==1', ['mass4l']))
+
+    def test_store_load(self):
+        key = self.get_key()
+        self.assertIsNone(self.cache.load(key))
+        columns = [np.arange(5.), np.linspace(0., 1., 5)]
+        self.store(key, columns)
+        loaded_columns, meta = self.cache.load(key)
+        self.assertEqual(meta['n_rows'], 5)
+        self.assertEqual(meta['n_entries'], 10)
+        self.assertEqual(meta['variables'], ['mass4l', 'KD'])
+        for loaded_column, column in zip(loaded_columns, columns):
+            np.testing.assert_array_equal(loaded_column, column)
+
+    def test_empty_entry(self):
+        key = self.get_key()
+        self.store(key, [np.zeros(0), np.zeros(0)])
+        loaded_columns, meta = self.cache.load(key)
+        self.assertEqual(meta['n_rows'], 0)
+        self.assertEqual([len(column) for column in loaded_columns], [0, 0])
+
+    def test_abort(self):
+        key = self.get_key()
+        writer = self.cache.get_writer(key, ['mass4l', 'KD'])
+        writer.append([np.arange(3.), np.arange(3.)])
+        writer.abort()
+        self.assertIsNone(self.cache.load(key))
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+
+    def test_evict_least_recently_used(self):
+        self.cache.max_size_MB = 1.5
+        column = np.zeros(1024 * 1024 / 8 / 2)  #0.5 MB per column, 1 MB per entry
+        keys = [self.get_key(selection = 'mass4l > {0}'.format(i)) for i in range(2)]
+        self.store(keys[0], [column, column])
+        #the first entry is used long before the second one
+        meta_path = os.path.join(self.cache.cache_dir, keys[0], 'meta.json')
+        os.utime(meta_path, (time.time() - 100, time.time() - 100))
+        self.store(keys[1], [column, column])
+        self.assertEqual(len(self.cache._get_entries()), 1)
+        self.assertIsNone(self.cache.load(keys[0]))
+        self.assertIsNotNone(self.cache.load(keys[1]))
+        self.cache.clear()
+        self.assertEqual(self.cache.get_size_MB(), 0)
+
+    def test_new_entry_is_kept(self):
+        self.cache.max_size_MB = 1.0
+        column = np.zeros(1024 * 1024 / 8 / 10)  #0.1 MB
+        old_key, new_key = [self.get_key(selection = 'mass4l > {0}'.format(i)) for i in range(2)]
+        self.store(old_key, [np.concatenate([column] * 2)] * 2)  #0.4 MB
+        #the new entry is newer than the old one only by a coarse mtime
+        os.utime(os.path.join(self.cache.cache_dir, old_key, 'meta.json'),
+                 (time.time() + 100, time.time() + 100))
+        self.store(new_key, [np.concatenate([column] * 3)] * 2)  #0.6 MB
+        self.assertIsNone(self.cache.load(old_key))
+        self.assertIsNotNone(self.cache.load(new_key))
+
+    def test_too_big_entry_is_not_stored(self):
+        self.cache.max_size_MB = 0.5
+        key = self.get_key()
+        self.store(self.get_key(selection = 'mass4l > 1'), [np.zeros(10), np.zeros(10)])
+        column = np.zeros(1024 * 1024 / 8 / 2)
+        self.store(key, [column, column])
+        self.assertIsNone(self.cache.load(key))
+        self.assertEqual(len(self.cache._get_entries()), 1)
+        self.assertEqual([entry for entry in os.listdir(self.cache.cache_dir)
+                          if entry.endswith('.tmp')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - unit tests of FactoryRegistry against a workspace which records the
+#      factory calls (no ROOT needed)
+#-------------------------------------------------------------------------------
+import sys, os, unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib.RooFit.FactoryRegistry import FactoryRegistry
+
+
+class FakeWorkspace(object):
+    """
+    Records the factory statements, factory() returns the statement.
+    """
+    def __init__(self):
+        self.factory_calls = []
+
+    def factory(self, statement):
+        self.factory_calls.append(statement)
+        return statement
+
+    def obj(self, name):
+        return 'obj:{0}'.format(name)
+
+
+class TestFactoryRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.w = FakeWorkspace()
+        self.registry = FactoryRegistry(self.w)
+
+    def test_object_name(self):
+        self.assertEqual(self.registry.get_object_name('mass4l[105,140]'), 'mass4l')
+        self.assertEqual(self.registry.get_object_name('RooDoubleCB::sig(mass4l,mean,sigma)'), 'sig')
+        self.assertEqual(self.registry.get_object_name('expr::f("x*2",x)'), 'f')
+        self.assertIsNone(self.registry.get_object_name('::'))
+
+    def test_registration(self):
+        self.assertEqual(self.registry.factory('mass4l[105, 140]'), 'mass4l[105, 140]')
+        self.assertEqual(self.registry.definitions, {'mass4l': 'mass4l[105,140]'})
+        self.assertEqual(self.registry.statements, {'mass4l[105,140]': 'mass4l'})
+
+    def test_duplicates_are_skipped(self):
+        self.registry.factory('mass4l[105,140]')
+        #the same statement up to white space returns the built object
+        self.assertEqual(self.registry.factory(' mass4l[105, 140] '), 'obj:mass4l')
+        self.registry.factory('RooGaussian::g(mass4l, mean[125], sigma[2])')
+        self.registry.factory('RooGaussian::g(mass4l,mean[125],sigma[2])')
+        self.assertEqual(self.w.factory_calls,
+                         ['mass4l[105,140]', 'RooGaussian::g(mass4l, mean[125], sigma[2])'])
+        self.assertEqual((self.registry.n_calls, self.registry.n_skipped), (4, 2))
+
+    def test_conflicting_definition_is_passed_on(self):
+        self.registry.factory('mass4l[105,140]')
+        self.registry.factory('mass4l[100,150]')
+        #the first definition is kept, the factory reports the conflict itself
+        self.assertEqual(self.w.factory_calls, ['mass4l[105,140]', 'mass4l[100,150]'])
+        self.assertEqual(self.registry.definitions, {'mass4l': 'mass4l[105,140]'})
+        self.registry.factory('mass4l[100, 150]')
+        self.assertEqual(len(self.w.factory_calls), 2)
+
+    def test_call_order(self):
+        statements = ['x[0,1]', 'y[0,1]', 'x[0, 1]', 'prod::xy(x,y)', 'y[0,1]', 'z[2]']
+        for statement in statements:
+            self.registry.factory(statement)
+        self.assertEqual(self.w.factory_calls, ['x[0,1]', 'y[0,1]', 'prod::xy(x,y)', 'z[2]'])
+
+
+if __name__ == '__main__':
+    unittest.main()
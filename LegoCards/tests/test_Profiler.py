@@ -0,0 +1,80 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - unit tests of the build stage profiler
+#-------------------------------------------------------------------------------
+import sys, os, json, shutil, tempfile, unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib.util.Profiler import Profiler, _get_peak_rss_MB
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = Profiler()
+
+    def test_disabled(self):
+        with self.profiler.stage('parse'):
+            pass
+        self.assertEqual(self.profiler.records, [])
+
+    def test_records(self):
+        self.profiler.enable()
+        for category in ['A', 'B']:
+            with self.profiler.stage('writeToFile', category = category, process = 'ggH'):
+                pass
+        with self.profiler.stage('parse'):
+            pass
+        self.assertEqual([(r['stage'], r['category'], r['process']) for r in self.profiler.records],
+                         [('writeToFile', 'A', 'ggH'), ('writeToFile', 'B', 'ggH'),
+                          ('parse', None, None)])
+        summary = self.profiler.get_summary()
+        self.assertEqual([(s['stage'], s['calls']) for s in summary],
+                         [('writeToFile', 2), ('parse', 1)])
+
+    def test_nested_stages_are_not_counted_twice(self):
+        self.profiler.enable()
+        with self.profiler.stage('INSERT resolution'):
+            with self.profiler.stage('config parse'):
+                pass
+        with self.profiler.stage('config parse'):
+            pass
+        self.assertEqual([r['stage'] for r in self.profiler.records],
+                         ['INSERT resolution', 'config parse'])
+
+    def test_exception_is_recorded(self):
+        self.profiler.enable()
+        def failing_stage():
+            with self.profiler.stage('fail'):
+                raise ValueError
+        self.assertRaises(ValueError, failing_stage)
+        with self.profiler.stage('next'):
+            pass
+        self.assertEqual([r['stage'] for r in self.profiler.records], ['fail', 'next'])
+
+    def test_memory_growth(self):
+        self.profiler.enable()
+        #more than the peak so far, so the high-water mark must grow
+        size_MB = int(_get_peak_rss_MB()) + 64
+        with self.profiler.stage('allocate'):
+            big = ' ' * (size_MB * 1024 * 1024)
+        del big
+        self.assertGreater(self.profiler.records[0]['peak_rss_increase_MB'], 32)
+
+    def test_report(self):
+        self.profiler.enable()
+        with self.profiler.stage('parse'):
+            pass
+        tmp_dir = tempfile.mkdtemp(prefix = 'test_profiler_')
+        try:
+            report_file = os.path.join(tmp_dir, 'report.json')
+            self.profiler.write_report(report_file)
+            with open(report_file) as fd:
+                report = json.load(fd)
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(report['summary'][0]['stage'], 'parse')
+        self.assertEqual(len(report['records']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - unit tests of the on-disk cache of resolved configurations
+#-------------------------------------------------------------------------------
+import sys, os, shutil, tempfile, unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+import lib.util.UniversalConfigParser as ucp
+from lib.util.ResolvedConfigCache import ResolvedConfigCache
+
+
+class TestResolvedConfigCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix = 'test_cfg_cache_')
+        self.cache = ResolvedConfigCache(os.path.join(self.tmp_dir, 'cache'))
+        self.top = os.path.join(self.tmp_dir, 'top.yaml')
+        self.inserted = os.path.join(self.tmp_dir, 'y.yaml')
+        for file_name, text in [(self.top, 'a: INSERT(y.yaml:A)\n'), (self.inserted, 'A: 1\n')]:
+            with open(file_name, 'w') as fd:
+                fd.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_store_load(self):
+        self.assertIsNone(self.cache.load([self.top]))
+        self.cache.store([self.top], {'a': 1}, [self.top, self.inserted])
+        self.assertEqual(self.cache.load([self.top]), {'a': 1})
+
+    def test_dependency_change_invalidates(self):
+        self.cache.store([self.top], {'a': 1}, [self.top, self.inserted])
+        with open(self.inserted, 'w') as fd:
+            fd.write('A: 2\n')
+        self.assertIsNone(self.cache.load([self.top]))
+        os.remove(self.inserted)
+        self.assertIsNone(self.cache.load([self.top]))
+
+    def test_insert_lines(self):
+        self.assertEqual(self.cache.load_insert_lines(), {})
+        parsed_lines = {'INSERT(y.yaml:A)': ucp.parse_insert_line('INSERT(y.yaml:A)')}
+        self.cache.store_insert_lines(parsed_lines)
+        self.assertEqual(self.cache.load_insert_lines(), parsed_lines)
+        self.cache.clear()
+        self.assertEqual(self.cache.load_insert_lines(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - unit tests of the nuisance x process matrix of systematics
+#-------------------------------------------------------------------------------
+import sys, os, unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib.util.SystematicsMatrix import SystematicsMatrix
+
+
+class TestSystematicsMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.sys_matrix = SystematicsMatrix(['ggH', 'qqH', 'bkg'])
+        self.sys_matrix.update([('lumi', 'lnN'), ('asym', 'lnN'), ('shape', 'param 0 1')],
+                               [('lumi', 'ggH', 1.026), ('lumi', 'bkg', 2),
+                                ('asym', 'qqH', '0.95/1.05'), ('lumi', 'other', 1.5)])
+
+    def test_rows(self):
+        self.assertEqual(list(self.sys_matrix.iter_rows()),
+                         [('lumi', 'lnN', ['1.026', '-', '2']),
+                          ('asym', 'lnN', ['-', '0.95/1.05', '-']),
+                          ('shape', 'param 0 1', ['-', '-', '-'])])
+
+    def test_cells_are_formatted_as_floats(self):
+        self.sys_matrix.update([], [('lumi', 'ggH', 1.999999999999999), ('lumi', 'qqH', 1.0)])
+        self.assertEqual(list(self.sys_matrix.iter_rows())[0][2], ['2.0', '1.0', '2'])
+
+    def test_override(self):
+        self.sys_matrix.update([('new', 'lnN')], [('lumi', 'bkg', 1.1), ('asym', 'qqH', 1.2),
+                                                  ('new', 'ggH', '1.3')])
+        self.assertEqual(len(self.sys_matrix), 4)
+        self.assertIn('new', self.sys_matrix)
+        self.assertEqual(self.sys_matrix.to_dict(),
+                         {'lumi': {'type': 'lnN', 'ggH': 1.026, 'bkg': 1.1},
+                          'asym': {'type': 'lnN', 'qqH': 1.2},
+                          'shape': {'type': 'param 0 1'},
+                          'new': {'type': 'lnN', 'ggH': '1.3'}})
+
+    def test_new_nuisances_in_order_of_appearance(self):
+        self.sys_matrix.update([], [('z_sys', 'ggH', 1.1), ('a_sys', 'bkg', 1.2),
+                                    ('z_sys', 'qqH', 1.3), ('m_sys', 'other', 1.4)])
+        self.assertEqual(self.sys_matrix.nuisance_list, ['lumi', 'asym', 'shape', 'z_sys', 'a_sys'])
+        self.assertEqual(list(self.sys_matrix.iter_rows())[3], ('z_sys', None, ['1.1', '1.3', '-']))
+        #a block with processes which are not in the card only
+        self.sys_matrix.update([], [('n_sys', 'other', 1.5)])
+        self.assertNotIn('n_sys', self.sys_matrix)
+
+    def test_numpy_floats(self):
+        import numpy as np
+        self.sys_matrix.update([], [('lumi', 'bkg', np.float64(1.5))])
+        self.assertEqual(self.sys_matrix.to_dict()['lumi']['bkg'], 1.5)
+        self.assertEqual(list(self.sys_matrix.iter_rows())[0][2], ['1.026', '-', '1.5'])
+
+    def test_to_dict_keeps_raw_values(self):
+        self.assertEqual(self.sys_matrix.to_dict()['lumi'], {'type': 'lnN', 'ggH': 1.026, 'bkg': 2})
+        self.assertEqual(self.sys_matrix.get_type('shape'), 'param 0 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - unit tests of UniversalConfigParser and its caches
+#    - run from LegoCards/ with: python -m unittest discover -s tests
+#-------------------------------------------------------------------------------
+import sys, os, time, shutil, tempfile, unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+import lib.util.UniversalConfigParser as ucp
+from lib.util.UniversalConfigParser import UniversalConfigParser
+
+
+class ConfigTestCase(unittest.TestCase):
+    """
+    Writes config files into a temporary directory.
+    """
+    def setUp(self):
+        self.cfg_dir = tempfile.mkdtemp(prefix = 'test_ucp_')
+        ucp.parsed_cfg_cache.clear()
+        ucp.flat_index_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.cfg_dir)
+
+    def write(self, file_name, text):
+        file_path = os.path.join(self.cfg_dir, file_name)
+        with open(file_path, 'w') as fd:
+            fd.write(text)
+        #make sure the mtime changes also on file systems with coarse mtime
+        stat = os.stat(file_path)
+        os.utime(file_path, (stat.st_atime, stat.st_mtime + time.time() % 1 + 1))
+        return file_path
+
+    def parse(self, file_name, **kwargs):
+        return UniversalConfigParser(file_list = os.path.join(self.cfg_dir, file_name)).get_dict(**kwargs)
+
+
+class TestParsedConfigCache(ConfigTestCase):
+
+    def test_nested_insert_change_invalidates(self):
+        self.write('yields.yaml', 'A: {ggH: 1.0}\n')
+        self.write('middle.yaml', 'rates: INSERT(yields.yaml:A)\n')
+        self.write('top.yaml', 'cat: INSERT(middle.yaml:rates:ggH)\n')
+        self.assertEqual(self.parse('top.yaml'), {'cat': 1.0})
+
+        #only the file INSERTed by middle.yaml changes
+        self.write('yields.yaml', 'A: {ggH: 22.5}\n')
+        self.assertEqual(self.parse('top.yaml'), {'cat': 22.5})
+
+    def test_nested_insert_change_invalidates_wildcards(self):
+        self.write('yields.yaml', 'A: {ggH: 1.0, qqH: 2.0}\n')
+        self.write('middle.yaml', 'rates: INSERT(yields.yaml:A)\n')
+        self.write('top.yaml', 'cat: INSERT(middle.yaml:rates:gg*)\n')
+        self.assertEqual(self.parse('top.yaml'), {'cat': 1.0})
+
+        self.write('yields.yaml', 'A: {ggH: 3.5, qqH: 2.0}\n')
+        self.assertEqual(self.parse('top.yaml'), {'cat': 3.5})
+
+    def test_unchanged_files_are_cached(self):
+        self.write('yields.yaml', 'A: {ggH: 1.0}\n')
+        self.write('top.yaml', 'a: INSERT(yields.yaml:A:ggH)\nb: INSERT(yields.yaml:A)\n')
+        self.parse('top.yaml')
+        self.parse('top.yaml')
+        self.assertEqual(ucp.parsed_cfg_cache.misses, 1)
+        self.assertEqual(ucp.parsed_cfg_cache.hits, 3)
+
+    def test_lru_size(self):
+        cache = ucp.ParsedConfigCache(max_size = 2)
+        file_names = [self.write('f{0}.yaml'.format(i), 'a: {0}\n'.format(i)) for i in range(3)]
+        for file_name in file_names:
+            cache.get(file_name, lambda f: f)
+        self.assertFalse(cache.contains(file_names[0]))
+        self.assertTrue(cache.contains(file_names[2]))
+        self.assertEqual(cache.stats()['size'], 2)
+
+
+class TestInsertGraph(ConfigTestCase):
+
+    def test_cycle_is_rejected(self):
+        self.write('a.yaml', 'x: INSERT(b.yaml:y)\n')
+        self.write('b.yaml', 'y: INSERT(c.yaml:z)\n')
+        self.write('c.yaml', 'z: INSERT(a.yaml:x)\n')
+        self.write('top.yaml', 'v: INSERT(a.yaml:x)\nw: INSERT(c.yaml:z)\n')
+        with self.assertRaises(RuntimeError) as raised:
+            self.parse('top.yaml')
+        self.assertIn('Cyclic INSERT', str(raised.exception))
+        #nothing prefetched is left for the next parser
+        self.assertEqual(ucp._prefetched_docs, {})
+
+    def test_missing_file_leaves_no_prefetched_docs(self):
+        self.write('a.yaml', 'x: 1\n')
+        self.write('top.yaml', 'v: INSERT(a.yaml:x)\nw: INSERT(missing.yaml:z)\n')
+        self.assertRaises(IOError, self.parse, 'top.yaml')
+        self.assertEqual(ucp._prefetched_docs, {})
+
+    def test_graph(self):
+        self.write('a.yaml', 'x: INSERT(b.yaml:y)\n')
+        self.write('b.yaml', 'y: 1\n')
+        top = self.write('top.yaml', 'v: INSERT(a.yaml:x)\n')
+        cfg_reader = UniversalConfigParser(file_list = top)
+        self.assertEqual(cfg_reader.get_dict(), {'v': 1})
+        self.assertEqual(cfg_reader.get_dependencies(),
+                         [top, os.path.join(self.cfg_dir, 'a.yaml'),
+                          os.path.join(self.cfg_dir, 'b.yaml')])
+
+
+class TestParseInsertLine(unittest.TestCase):
+
+    def setUp(self):
+        ucp._parsed_insert_lines.clear()
+
+    def tearDown(self):
+        ucp._parsed_insert_lines.clear()
+
+    def test_tokens(self):
+        self.assertIsNone(ucp.parse_insert_line('no insert here'))
+        parsed_line = ucp.parse_insert_line('INSERT(y.yaml:A:gg*)')
+        self.assertTrue(parsed_line.is_single_insert)
+        self.assertEqual(parsed_line.segments,
+                         (ucp.InsertToken('y.yaml', ('A', 'gg*'), True),))
+        parsed_line = ucp.parse_insert_line('1 + INSERT(y.yaml:A:ggH) * 2')
+        self.assertFalse(parsed_line.is_single_insert)
+        self.assertEqual(parsed_line.segments,
+                         ('1 + ', ucp.InsertToken('y.yaml', ('A', 'ggH'), False), ' * 2'))
+        self.assertRaises(RuntimeError, ucp.parse_insert_line, 'INSERT(INSERT(y.yaml))')
+
+    def test_cache_is_bounded(self):
+        max_lines = ucp.max_parsed_insert_lines
+        ucp.max_parsed_insert_lines = 3
+        try:
+            lines = ['INSERT(y.yaml:{0})'.format(i) for i in range(5)]
+            for line in lines:
+                ucp.parse_insert_line(line)
+            ucp.parse_insert_line(lines[2])
+            self.assertEqual(list(ucp._parsed_insert_lines), [lines[3], lines[4], lines[2]])
+            ucp.add_parsed_insert_lines(dict((line, None) for line in lines[:2]))
+            self.assertEqual(len(ucp._parsed_insert_lines), 3)
+        finally:
+            ucp.max_parsed_insert_lines = max_lines
+
+
+class TestLazyConfig(ConfigTestCase):
+
+    def setUp(self):
+        ConfigTestCase.setUp(self)
+        self.write('yields.yaml', 'A: {ggH: 1.5, qqH: 2.5}\nB: {ggH: 3.5}\n')
+        self.write('sys.yaml', 'lumi: {type: lnN, value: 1.026}\n')
+        self.write('top.yaml', '\n'.join([
+            'cat_A:',
+            '    rates: INSERT(yields.yaml:A)',
+            '    ggH: INSERT(yields.yaml:A:ggH)',
+            '    label: "ggH rate INSERT(yields.yaml:A:ggH) in A"',
+            '    systematics: [INSERT(sys.yaml:lumi), {extra: 1}]',
+            '    wildcard: INSERT(yields.yaml:*:qq*)',
+            'cat_B:',
+            '    ggH: INSERT(yields.yaml:B:ggH)',
+            'plain: 7',
+            '']))
+
+    def test_lazy_equals_eager(self):
+        eager = self.parse('top.yaml')
+        lazy = self.parse('top.yaml', lazy = True)
+        self.assertIsInstance(lazy, ucp.LazyConfigDict)
+        self.assertEqual(lazy.to_dict(), eager)
+        self.assertEqual(eager['cat_A']['label'], 'ggH rate 1.5 in A')
+        self.assertEqual(eager['cat_A']['wildcard'], 2.5)
+
+    def test_lazy_cycle_is_rejected(self):
+        self.write('a.yaml', 'x: INSERT(b.yaml:y)\n')
+        self.write('b.yaml', 'y: INSERT(a.yaml:x)\n')
+        self.write('cyclic.yaml', 'v: INSERT(a.yaml:x)\n')
+        lazy = self.parse('cyclic.yaml', lazy = True)
+        with self.assertRaises(RuntimeError) as raised:
+            lazy['v']
+        a_file, b_file = [os.path.join(self.cfg_dir, f) for f in ('a.yaml', 'b.yaml')]
+        self.assertEqual(str(raised.exception), 'Cyclic INSERT commands are not allowed: '
+                         '{0} -> {1} -> {0}'.format(a_file, b_file))
+        self.assertEqual(ucp._files_being_parsed, [])
+
+    def test_lazy_resolves_on_access(self):
+        lazy = self.parse('top.yaml', lazy = True)
+        self.assertEqual(dict.__getitem__(lazy['cat_B'], 'ggH'), 'INSERT(yields.yaml:B:ggH)')
+        self.assertEqual(lazy['cat_B']['ggH'], 3.5)
+        #resolved values are stored back
+        self.assertEqual(dict.__getitem__(lazy['cat_B'], 'ggH'), 3.5)
+        self.assertEqual(lazy['cat_A']['systematics'][0], {'type': 'lnN', 'value': 1.026})
+
+
+class TestItem(ConfigTestCase):
+
+    def setUp(self):
+        ConfigTestCase.setUp(self)
+        self.write('card.yaml', '\n'.join([
+            'setup: {process_names: [ggH, qqZZ]}',
+            'processes:',
+            '    ggH: {rate: 0.5, is_signal: 1}',
+            '    qqZZ: {rate: 2.0, is_signal: 0}',
+            '']))
+        self.cfg_reader = UniversalConfigParser(file_list = os.path.join(self.cfg_dir, 'card.yaml'))
+        self.cfg_reader.get_dict()
+
+    def test_dotted_path(self):
+        self.assertEqual(self.cfg_reader.item('processes.ggH.rate'), 0.5)
+        self.assertEqual(self.cfg_reader.item('processes.qqZZ'), {'rate': 2.0, 'is_signal': 0})
+
+    def test_list_index(self):
+        self.assertEqual(self.cfg_reader.item('setup.process_names.1'), 'qqZZ')
+
+    def test_wildcards(self):
+        self.assertEqual(self.cfg_reader.item('processes.*.rate'),
+                         {'processes.ggH.rate': 0.5, 'processes.qqZZ.rate': 2.0})
+        self.assertEqual(self.cfg_reader.item('setup.process_names.[0]'),
+                         {'setup.process_names.0': 'ggH'})
+        self.assertEqual(self.cfg_reader.item('processes.gg?.rate_*'), {})
+
+    def test_missing_item(self):
+        self.assertRaises(KeyError, self.cfg_reader.item, 'processes.ttH.rate')
+        self.assertRaises(KeyError, self.cfg_reader.item, 'setup.process_names.2')
+
+    def test_index_rebuilt_by_get_dict(self):
+        self.assertEqual(self.cfg_reader.item('processes.ggH.rate'), 0.5)
+        self.write('card.yaml', 'processes: {ggH: {rate: 1.5}}\n')
+        self.cfg_reader.get_dict()
+        self.assertEqual(self.cfg_reader.item('processes.ggH.rate'), 1.5)
+        self.assertRaises(KeyError, self.cfg_reader.item, 'processes.qqZZ.rate')
+
+
+class TestDump(ConfigTestCase):
+
+    def test_ordered_dict_dump(self):
+        import yaml, collections
+        cfg = collections.OrderedDict([('b', collections.OrderedDict([('x', 1)])), ('a', [1.5])])
+        dump_file_name = os.path.join(self.cfg_dir, 'dump.yaml')
+        UniversalConfigParser().dump_to_yaml(dump_file_name, cfg)
+        self.assertEqual(self.parse('dump.yaml'), {'b': {'x': 1}, 'a': [1.5]})
+        #the representer is not registered globally
+        self.assertNotIn(collections.OrderedDict, yaml.Dumper.yaml_representers)
+        self.assertIs(ucp.get_yaml_dumper(), ucp.get_yaml_dumper())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - unit tests of the build_datacard helpers which do not need ROOT
+#-------------------------------------------------------------------------------
+import sys, os, re, shutil, tempfile, unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+import build_datacard
+from lib.util.UniversalConfigParser import UniversalConfigParser
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIGS_DIR = os.path.join(TESTS_DIR, os.pardir, 'configs')
+REFERENCE_DIR = os.path.join(TESTS_DIR, 'reference')
+
+
+def normalized_card_lines(file_name):
+    """
+    Lines of a txt card with the column alignment removed, sorted (the order
+    of the systematics rows is not defined).
+    """
+    with open(file_name) as fd:
+        return sorted(re.sub(r'\s+', ' ', line).strip() for line in fd)
+
+
+class TestBatchSections(unittest.TestCase):
+
+    def test_is_datacard_section(self):
+        self.assertTrue(build_datacard.is_datacard_section(
+                {'setup': {}, 'observation': {'rate': 1}, 'processes': {}}))
+        #shared anchor sections and reserved keys are not cards
+        self.assertFalse(build_datacard.is_datacard_section({'observation': {'rate': 1}}))
+        self.assertFalse(build_datacard.is_datacard_section({'processes': {}}))
+        self.assertFalse(build_datacard.is_datacard_section('2e2mu'))
+        self.assertFalse(build_datacard.is_datacard_section(['processes', 'observation']))
+
+
+class TestOptions(unittest.TestCase):
+
+    def parse(self, argv):
+        sys_argv = sys.argv
+        sys.argv = ['build_datacard.py'] + argv
+        try:
+            build_datacard.parseOptions()
+        finally:
+            sys.argv = sys_argv
+        return build_datacard.opt
+
+    def test_category_is_section(self):
+        for flag in ['-c', '--category', '--section']:
+            self.assertEqual(self.parse([flag, '2e2mu']).section, '2e2mu')
+        self.assertIsNone(self.parse([]).section)
+
+
+class TestTxtCardRegression(unittest.TestCase):
+    """
+    The txt cards are compared with the reference cards made by the
+    original implementation. The observed rate is fixed, so no workspace
+    (and no ROOT) is needed.
+    """
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp(prefix = 'test_cards_')
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def make_txt_card(self, config_filename):
+        datacard_input = UniversalConfigParser(file_list = config_filename).get_dict()
+        datacard_input['observation']['rate'] = 8
+        datacard_name = os.path.splitext(os.path.basename(config_filename))[0]
+        datacard_builder = build_datacard.LegoCards(datacard_input = datacard_input,
+                                                    datacard_name = datacard_name)
+        datacard_builder.set_cfg_dir(config_filename)
+        datacard_builder.set_out_dir(self.out_dir)
+        datacard_builder.set_echo_txt_card(False)
+        datacard_builder.make_txt_card()
+        return (datacard_input, os.path.join(self.out_dir, datacard_name + '.txt'))
+
+    def check_card(self, config_filename):
+        datacard_input, card_file_name = self.make_txt_card(config_filename)
+        reference_file_name = os.path.join(REFERENCE_DIR, os.path.basename(card_file_name))
+        self.assertEqual(normalized_card_lines(card_file_name),
+                         normalized_card_lines(reference_file_name))
+        return datacard_input
+
+    def test_more_complicated_card(self):
+        datacard_input = self.check_card(os.path.join(CONFIGS_DIR,
+                                                      'more_complicated_datacard_8TeV_2e2mu.yaml'))
+        #the merged systematics are written back for the dumped configuration
+        self.assertEqual(datacard_input['systematics']['one_extra_sys_ggH'],
+                         {'type': 'lnN', 'ggH': 1.03, 'qqH': 1.99999})
+
+    def test_systematics_formats_card(self):
+        datacard_input = self.check_card(os.path.join(REFERENCE_DIR, 'systematics_formats.yaml'))
+        self.assertEqual(datacard_input['systematics']['int_size'],
+                         {'type': 'lnN', 'ggH': 2, 'qqZZ': 1})
+
+    def test_lumi_scan(self):
+        config_filename = os.path.join(REFERENCE_DIR, 'systematics_formats.yaml')
+        datacard_input = UniversalConfigParser(file_list = config_filename).get_dict()
+        datacard_builder = build_datacard.LegoCards(datacard_input = datacard_input,
+                                                    datacard_name = 'sf')
+        datacard_builder.set_cfg_dir(config_filename)
+        datacard_builder.set_out_dir(self.out_dir)
+        datacard_builder.set_echo_txt_card(False)
+        datacard_builder.make_lumi_scan_txt_cards([1.0, 2.0, 5.0])
+
+        cards = {}
+        for lumi_scaling, card_name in [(1.0, 'sf.txt'), (2.0, 'sf.lumi_scale_2.00.txt'),
+                                        (5.0, 'sf.lumi_scale_5.00.txt')]:
+            with open(os.path.join(self.out_dir, card_name)) as fd:
+                cards[lumi_scaling] = [re.sub(r'\s+', ' ', line).strip() for line in fd]
+        rate_lines = dict((lumi_scaling, [line for line in lines if line.startswith('rate ')])
+                          for lumi_scaling, lines in cards.iteritems())
+        def without_header_and_rates(lines):
+            return [line for i_line, line in enumerate(lines)
+                    if i_line != 2 and not line.startswith('rate ')]
+
+        self.assertEqual(cards[5.0][2], 'Rates in datacard are scaled by a factor of 5.0')
+        for lumi_scaling in cards:
+            self.assertEqual(rate_lines[lumi_scaling],
+                             ['rate {0} {1}'.format(0.5 * lumi_scaling, 2.0 * lumi_scaling)])
+            #the systematics rows are in the same order in all the cards
+            self.assertEqual(without_header_and_rates(cards[lumi_scaling]),
+                             without_header_and_rates(cards[1.0]))
+        #the scan is the same as the single card
+        self.assertEqual(sorted(cards[1.0]),
+                         normalized_card_lines(os.path.join(REFERENCE_DIR, 'systematics_formats.txt')))
+        self.assertIsNone(datacard_builder.sys_matrix)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#-------------------------------------------------------------------------------
+# Purpose:
+#    - unit tests of nested_dict helpers used by the INSERT command
+#-------------------------------------------------------------------------------
+import sys, os, fnmatch, unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib.util.nested_dict import nested_dict, flatten, unflatten, flat_dict_index, filter_flatten_dict
+
+
+def filter_by_fnmatch(dictionary, filter_tags):
+    """
+    Reference: every tag must match at least one element of the key.
+    """
+    return dict((tuple_key, value) for tuple_key, value in dictionary.iteritems()
+                if all(any(fnmatch.fnmatch(str(item), tag) for item in tuple_key)
+                       for tag in filter_tags))
+
+
+class TestNestedDict(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = {'2e2mu': {'ggH': {'rate': 1.0, 'shape': 'a'}, 'qqH': {'rate': 2.0}},
+                    '4mu': {'ggH': {'rate': 3.0}, 'bkg_zz': {'rate': 4.0}},
+                    'lumi': 19.7, 7: {'int_key': 1}}
+        self.flat = flatten(self.cfg)
+
+    def test_flatten_unflatten(self):
+        self.assertEqual(self.flat[('2e2mu', 'ggH', 'rate')], 1.0)
+        self.assertEqual(self.flat[('lumi',)], 19.7)
+        self.assertEqual(unflatten(self.flat).to_dict(), self.cfg)
+
+    def test_update_is_recursive(self):
+        nd = nested_dict(self.cfg)
+        nd.update({'4mu': {'ggH': {'rate': 5.0}}})
+        self.assertEqual(nd['4mu']['ggH']['rate'], 5.0)
+        self.assertEqual(nd['4mu']['bkg_zz']['rate'], 4.0)
+
+    def test_filter_matches_fnmatch(self):
+        index = flat_dict_index(self.flat)
+        for filter_tags in [[], ['*'], ['2e2mu'], ['*', 'ggH', '*'], ['4mu', 'ggH', 'rate'],
+                            ['*mu', 'gg?'], ['[24]*', 'rate'], ['7'], ['none'],
+                            ['2e2mu', 'bkg_zz'], ['rate', '*', 'ggH']]:
+            self.assertEqual(index.filter(filter_tags), filter_by_fnmatch(self.flat, filter_tags),
+                             msg = 'tags {0}'.format(filter_tags))
+            self.assertEqual(filter_flatten_dict(self.flat, filter_tags),
+                             filter_by_fnmatch(self.flat, filter_tags))
+
+
+if __name__ == '__main__':
+    unittest.main()